@@ -1,9 +1,16 @@
-﻿from tortoise import Tortoise
+﻿import asyncio
+import inspect
+
+from tortoise import Tortoise
 from tortoise.contrib.fastapi import register_tortoise
 
 from app.configs import config
 from utils.logs.log import logger
 from utils.message.send_report import send_server_status
+from utils.message.notify_dispatcher import NotifyDispatcher
+from utils.util.executor_util import ExecutorService
+from utils.client.test_runner.webdriver_pool import WebDriverPool
+from utils.client.test_runner.screenshot import ScreenshotWriter
 
 def register_app_hook(app):
     @app.on_event("startup")
@@ -60,16 +67,59 @@ def register_app_hook(app):
         # aitestrebort 高级功能路由
         app.include_router(advanced_features_router, prefix='/api', tags=["aitestrebort-高级功能"])
 
+        # 消费定时任务触发队列
+        from app.services.system.job import TaskDispatcher
+        TaskDispatcher.start()
+
+        # 检查知识库向量数据和分块是否一致，只补充缺少的向量
+        from app.services.aitestrebort.vector_store import KnowledgeBaseService
+        KnowledgeBaseService.start_check()
+
+        # LLM客户端注册表，导入时注册配置修改、删除的信号
+        from app.models.config.config import Config
+        from app.services.aitestrebort.llm_client_registry import LLMClientRegistry
+        LLMClientRegistry.configure(**await Config.get_llm_client_conf())
+
+        # 开始提供服务前把对话checkpoint数据库切换为增量回收模式
+        from app.services.aitestrebort.checkpointer import CheckpointStore
+        await CheckpointStore.prepare()
+
         app.logger.info(f'\n\n\n{"*" * 20} 服务【{app.title}】启动完成 {"*" * 20}\n\n\n'"")
         if config.is_linux:
             await send_server_status(config.token_secret_key, app.title, action_type='启动')
 
     @app.on_event("shutdown")
     async def shutdown_event():
-        try:
-            await Tortoise.close_connections()
-            app.logger.info(f'\n\n\n{"*" * 20} 服务【{app.title}】关闭完成 {"*" * 20}\n\n\n'"")
-            if config.is_linux:
-                await send_server_status(config.token_secret_key, app.title, action_type='关闭')
-        except Exception as e:
-            app.logger.error(f"Error during shutdown: {e}")
+        """ 应用关闭事件，每一项单独捕获异常，一项失败不影响其他资源的释放，数据库连接最后关闭 """
+        from app.services.system.job import TaskDispatcher
+        from app.services.aitestrebort.vector_store import KnowledgeBaseService
+        from app.services.aitestrebort.llm_client_registry import LLMClientRegistry
+        from app.services.aitestrebort.checkpointer import CheckpointStore
+        from app.services.aitestrebort.qdrant_manager import QdrantManager
+
+        close_list = [
+            ("定时任务触发队列", TaskDispatcher.stop),
+            ("知识库一致性检查", KnowledgeBaseService.stop_check),
+            ("浏览器会话池", WebDriverPool.close_all),  # 关闭会话要用共享线程池
+            ("截图写入队列", ScreenshotWriter.flush),  # 队列中还没写入的截图写完再退出
+        ]
+        if config.is_linux:  # 通过通知发送器发送，要在它关闭之前
+            close_list.append(
+                ("服务关闭通知", lambda: send_server_status(config.token_secret_key, app.title, action_type='关闭')))
+        close_list += [
+            ("通知发送", NotifyDispatcher.close),
+            ("LLM客户端", LLMClientRegistry.close_all),
+            ("对话checkpoint", CheckpointStore.close),
+            ("本地向量库", lambda: asyncio.to_thread(QdrantManager.close_all)),  # 可能要等正在进行的检索
+            ("共享线程池", ExecutorService.shutdown),
+            ("数据库连接", Tortoise.close_connections),
+        ]
+        for name, close_func in close_list:
+            try:
+                result = close_func()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                app.logger.error(f"Error during shutdown ({name}): {e}")
+
+        app.logger.info(f'\n\n\n{"*" * 20} 服务【{app.title}】关闭完成 {"*" * 20}\n\n\n'"")
@@ -1,14 +1,15 @@
 # -*- coding: utf-8 -*-
-import asyncio
+import hashlib
 import importlib
+import importlib.util
 import os
+import sys
 import types
-from concurrent.futures import ThreadPoolExecutor
-from functools import partial  # 处理关键字参数必备
 from typing import Callable, Any
 
 from ..base_model import fields, pydantic_model_creator, BaseModel
 from app.models.config.run_env import RunEnv
+from utils.util.executor_util import ExecutorService
 from utils.util.file_util import FileUtil
 
 
@@ -26,9 +27,60 @@ class Script(BaseModel):
         table = "auto_test_python_script"
         table_description = "python脚本"
 
+    _file_hash_dict = {}  # 当前进程已写入的脚本文件内容hash {文件名: hash}
+    _func_cache_dict = {}  # 已编译的脚本函数 {(运行环境, 脚本名): (内容hash, {函数名: 函数})}，任意脚本有变化时全部清除
+
+    @staticmethod
+    def get_content_hash(content):
+        return hashlib.md5((content or "").encode("utf-8")).hexdigest()
+
+    @classmethod
+    def save_script_file(cls, env_code, name, script_data):
+        """ 把脚本内容写入到py文件，内容没变化且文件存在则不重复写，返回内容是否有变化 """
+        file_name = f'{env_code}_{name}'
+        content_hash = cls.get_content_hash(script_data)
+        is_changed = cls._file_hash_dict.get(file_name) != content_hash
+        if is_changed or not os.path.exists(FileUtil.get_script_path(file_name)):
+            FileUtil.save_script_data(file_name, script_data, env_code)
+            cls._file_hash_dict[file_name] = content_hash
+        return is_changed
+
+    @classmethod
+    def clear_script_cache(cls):
+        """ 脚本内容有变化，或者被重新加载过了，清除已编译的函数
+        脚本之间可能互相引用（A 中 import 了 B），B 变了之后 A 的函数还绑定着旧的 B 模块，所以清除所有脚本的函数缓存，
+        并把已导入的脚本模块从 sys.modules 中移除，下次使用时重新导入
+        """
+        cls._func_cache_dict.clear()
+        for module_name in [module_name for module_name in sys.modules if module_name.startswith("script_list.")]:
+            sys.modules.pop(module_name, None)
+
+    @classmethod
+    def get_script_functions(cls, env_code, name, script_data):
+        """ 获取脚本中的函数，按 运行环境+脚本名+内容hash 缓存，内容有变化才重新编译
+        编译后的模块会注册到 sys.modules，保证函数可以被pickle到进程池中执行
+        """
+        file_name = f'{env_code}_{name}'
+        content_hash = cls.get_content_hash(script_data)
+        cached = cls._func_cache_dict.get((env_code, name))
+        if cached and cached[0] == content_hash:
+            return cached[1]
+
+        cls.save_script_file(env_code, name, script_data)
+        module_name, file_path = f'script_list.{file_name}', FileUtil.get_script_path(file_name)
+        spec = importlib.util.spec_from_file_location(module_name, file_path)
+        module = importlib.util.module_from_spec(spec)
+        exec(compile(FileUtil.build_script_data(script_data, env_code), file_path, "exec"), module.__dict__)
+        sys.modules[module_name] = module
+
+        func_dict = {
+            func_name: item for func_name, item in vars(module).items() if isinstance(item, types.FunctionType)}
+        cls._func_cache_dict[(env_code, name)] = (content_hash, func_dict)
+        return func_dict
+
     @classmethod
     async def create_script_file(cls, env_code=None, not_create_list=[]):
-        """ 创建所有自定义函数 py 文件，默认在第一行加上运行环境
+        """ 创建所有自定义函数 py 文件，默认在第一行加上运行环境，内容没有变化的不重复写入
         示例：
             # coding:utf-8
 
@@ -40,9 +92,12 @@ class Script(BaseModel):
             env_data = await RunEnv.first().values("code")
             env_code = env_data["code"]
 
-        for script in await cls.all():
-            if script.name not in not_create_list:
-                FileUtil.save_script_data(f'{env_code}_{script.name}', script.script_data, env_code)
+        is_changed = False
+        for script in await cls.all().values("name", "script_data"):
+            if script["name"] not in not_create_list:
+                is_changed = cls.save_script_file(env_code, script["name"], script["script_data"]) or is_changed
+        if is_changed:  # 有脚本在其他进程被修改过
+            cls.clear_script_cache()
 
     @classmethod
     async def get_func_by_script_id(cls, script_id_list: list, env_id=None):
@@ -53,32 +108,18 @@ class Script(BaseModel):
             env_data = await RunEnv.filter(id=env_id).first().values("code")
         env_code = env_data["code"]
 
-        await cls.create_script_file(env_code)  # 创建所有函数文件
+        await cls.create_script_file(env_code)  # 创建所有函数文件，脚本之间可能有互相引用
+        script_dict = {
+            script["id"]: script for script in await cls.filter(id__in=script_id_list).values("id", "name", "script_data")}
         func_dict = {}
         for script_id in script_id_list:
-            script = await cls.filter(id=script_id).first().values("name")
-            func_list = importlib.reload(importlib.import_module(f'script_list.{env_code}_{script["name"]}'))
-            func_dict.update({
-                name: item for name, item in vars(func_list).items() if isinstance(item, types.FunctionType)
-            })
+            script = script_dict[script_id]
+            func_dict.update(cls.get_script_functions(env_code, script["name"], script["script_data"]))
         return func_dict
 
     @classmethod
     async def run_func(cls, func: Callable, args: tuple = None, kwargs: dict = None, timeout: int = 600) -> Any:
-        """线程安全的异步任务执行器，支持超时控制和自动资源回收"""
-        args = args or ()
-        kwargs = kwargs or {}
-        max_workers = min(50, os.cpu_count() * 5)
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            try:
-                if not kwargs:
-                    return await asyncio.wait_for(
-                        asyncio.get_running_loop().run_in_executor(executor, func, *args), timeout=timeout)
-                bound_func = partial(func, *args, **kwargs)
-                return await asyncio.wait_for(
-                    asyncio.get_running_loop().run_in_executor(executor, bound_func), timeout=timeout)
-            except Exception as e:
-                executor.shutdown(wait=True)  # 强制终止超时任务
-                raise
+        """线程安全的异步任务执行器，支持超时控制，使用全局共享的线程池"""
+        return await ExecutorService.run(func, args, kwargs, timeout=timeout)
 
 ScriptPydantic = pydantic_model_creator(Script, name="Script")
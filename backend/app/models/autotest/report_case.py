@@ -147,6 +147,21 @@ class BaseReportCase(BaseModel):
                     suite_item["children"].append(resport_case_item)
         return suite_list
 
+    @classmethod
+    async def batch_create_report_case(cls, report_case_list, batch_size=500):
+        """ 批量创建同一个报告下的用例执行记录，并回填id（MySQL批量插入后不会返回id，按插入顺序查出来回填） """
+        if not report_case_list:
+            return report_case_list
+        report_id = report_case_list[0].report_id
+        last_report_case = await cls.filter(report_id=report_id).order_by("-id").first().values("id")
+        last_id = last_report_case["id"] if last_report_case else 0
+
+        await cls.bulk_create(report_case_list, batch_size=batch_size)
+        id_list = await cls.filter(report_id=report_id, id__gt=last_id).order_by("id").values_list("id", flat=True)
+        for report_case, report_case_id in zip(report_case_list, id_list):
+            report_case.id = report_case_id
+        return report_case_list
+
     async def update_report_case_data(self, case_data, summary=None):
         """ 更新测试数据 """
         update_dict = {"case_data": case_data}
@@ -1,8 +1,137 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import time
 
 from ..base_model import BaseModel, fields, pydantic_model_creator
 from ...schemas.enums import ReportStepStatusEnum
+from utils.logs.log import logger
+
+
+class ReportStepProgressBuffer:
+    """ 步骤执行进度的写缓冲
+    执行过程中每个步骤会经过 running、parse、before、run、extract、after、validate、结果 多个阶段，
+    每个阶段都直接写库的话，一个步骤要 UPDATE 9次左右。这里把阶段变更先放到内存中，同一个步骤的多次变更合并为最新值，
+    定时（flush_interval 秒）以及用例执行结束时按 id 批量更新到数据库。
+    未写入数据库的数据可通过 get_pending 获取，查询执行进度时覆盖到数据库的数据上
+    """
+    flush_interval = 1  # 定时写库的间隔，秒
+    batch_size = 200  # 每次批量更新的数据量
+
+    def __init__(self, model):
+        self.model = model
+        self.pending = {}  # {report_step_id: {"process": "run", "result": "running", "step_data": {}}}
+        self.flush_task = None
+        self.lock = asyncio.Lock()
+
+    def add(self, report_step_id, update_dict):
+        """ 记录步骤的变更，和未写库的变更合并，后面的覆盖前面的
+        step_data、summary 在记录时就序列化，执行过程中同一个字典（如 UI 会话的 meta_data、用例的变量）会被后续步骤修改，
+        等到写库时再序列化就会写成后面步骤的数据，可能有 datetime 格式的数据
+        """
+        update_dict = dict(update_dict)
+        for key in ("step_data", "summary"):
+            if isinstance(update_dict.get(key), dict):
+                update_dict[key] = self.model.dumps(update_dict[key])
+        self.pending.setdefault(report_step_id, {}).update(update_dict)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.flush_loop())
+
+    def get_pending(self, report_step_id):
+        return self.pending.get(report_step_id)
+
+    async def flush_loop(self):
+        """ 定时写库，没有待写入的数据了就退出 """
+        while self.pending:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """ 把缓冲中的数据按 id 批量写入数据库，更新的字段相同的数据放到同一批 """
+        async with self.lock:
+            pending, self.pending = self.pending, {}
+            group_dict = {}
+            for report_step_id, update_dict in pending.items():
+                group_dict.setdefault(tuple(sorted(update_dict)), []).append(
+                    self.model(id=report_step_id, **update_dict))
+
+            for field_list, step_list in group_dict.items():
+                try:
+                    await self.model.bulk_update(step_list, fields=list(field_list), batch_size=self.batch_size)
+                except Exception as error:
+                    logger.error(f"批量更新步骤执行进度失败：{error}")
+                    for step in step_list:  # 放回缓冲，下次再写，期间产生了新的变更则以新的为准
+                        self.pending[step.id] = {key: getattr(step, key) for key in field_list} | self.pending.get(
+                            step.id, {})
+
+
+
+class ReportStepStatusRegistry:
+    """ 步骤执行状态（放行、暂停、中断）的进程内登记表
+    当前进程修改状态时登记并唤醒等待放行的步骤，其他进程修改的状态由执行中的用例定时从数据库同步（check_interval 秒一次），
+    没有设置暂停的时候，不用每个步骤都查一次数据库，暂停等待期间也不会阻塞事件循环
+    """
+    check_interval = 3  # 从数据库同步状态的间隔，秒
+
+    def __init__(self, model):
+        self.model = model
+        self.case_status_dict = {}  # {report_case_id: {report_step_id: status}}，只登记非放行的状态
+        self.case_check_time = {}  # {report_case_id: 上次从数据库同步状态的时间}
+        self.event_dict = {}  # {report_step_id: asyncio.Event}，暂停中等待状态变更的步骤
+
+    def get_status(self, report_case_id, report_step_id):
+        return self.case_status_dict.get(report_case_id, {}).get(report_step_id, ReportStepStatusEnum.RESUME)
+
+    def set_status(self, report_step_list, status):
+        """ 登记状态，并唤醒等待中的步骤
+        report_step_list: [{"id": 1, "report_case_id": 1}]
+        """
+        for report_step in report_step_list:
+            case_status = self.case_status_dict.setdefault(report_step["report_case_id"], {})
+            if status == ReportStepStatusEnum.RESUME:
+                case_status.pop(report_step["id"], None)
+            else:
+                case_status[report_step["id"]] = status
+            if report_step["id"] in self.event_dict:
+                self.event_dict[report_step["id"]].set()
+
+    async def sync_case_status(self, report_case_id, force=False):
+        """ 从数据库同步用例下所有步骤的状态，距离上次同步不足 check_interval 秒则跳过 """
+        now = time.monotonic()
+        if force is False and now - self.case_check_time.get(report_case_id, 0) < self.check_interval:
+            return
+        self.case_check_time[report_case_id] = now
+        query_set = await self.model.filter(
+            report_case_id=report_case_id, status__not=ReportStepStatusEnum.RESUME).values("id", "status")
+        self.case_status_dict[report_case_id] = {data["id"]: data["status"] for data in query_set}
+
+    async def wait_status(self, report_case_id, report_step_id, time_out):
+        """ 获取步骤的状态，如果是暂停，则等到状态变更，超时返回None """
+        await self.sync_case_status(report_case_id)
+        status = self.get_status(report_case_id, report_step_id)
+        if status != ReportStepStatusEnum.PAUSE:
+            return status
+
+        event = self.event_dict.setdefault(report_step_id, asyncio.Event())
+        deadline = time.monotonic() + time_out
+        try:
+            while status == ReportStepStatusEnum.PAUSE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(self.check_interval, remaining))
+                except asyncio.TimeoutError:
+                    await self.sync_case_status(report_case_id, force=True)  # 可能是在其他进程放行的
+                status = self.get_status(report_case_id, report_step_id)
+            return status
+        finally:
+            self.event_dict.pop(report_step_id, None)
+
+    def clear_case(self, report_case_id):
+        """ 用例执行完毕，清除登记的数据 """
+        self.case_status_dict.pop(report_case_id, None)
+        self.case_check_time.pop(report_case_id, None)
 
 
 class BaseReportStep(BaseModel):
@@ -30,6 +159,38 @@ class BaseReportStep(BaseModel):
     class Meta:
         abstract = True  # 不生成表
 
+    @classmethod
+    def get_progress_buffer(cls):
+        """ 当前报告步骤表的执行进度写缓冲，每个进程、每张表一个 """
+        if "_progress_buffer" not in cls.__dict__:
+            cls._progress_buffer = ReportStepProgressBuffer(cls)
+        return cls._progress_buffer
+
+    @classmethod
+    def get_status_registry(cls):
+        """ 当前报告步骤表的执行状态登记表，每个进程、每张表一个 """
+        if "_status_registry" not in cls.__dict__:
+            cls._status_registry = ReportStepStatusRegistry(cls)
+        return cls._status_registry
+
+    @classmethod
+    async def flush_progress(cls):
+        """ 把缓冲中的执行进度写入数据库 """
+        await cls.get_progress_buffer().flush()
+
+    @classmethod
+    def merge_pending_progress(cls, report_step_list):
+        """ 查询执行进度时，把还没写入数据库的进度覆盖到查询结果上 """
+        progress_buffer = cls.get_progress_buffer()
+        for report_step in report_step_list:
+            pending = progress_buffer.get_pending(report_step["id"])
+            if pending:
+                for key in ("process", "result", "summary"):
+                    if key in report_step and key in pending:
+                        value = pending[key]
+                        report_step[key] = cls.loads(value) if isinstance(value, str) and key == "summary" else value
+        return report_step_list
+
     @staticmethod
     def get_summary_template():
         return {
@@ -63,48 +224,49 @@ class BaseReportStep(BaseModel):
         query_fields = ["id", "case_id", "name", "process", "result", "status"]
         if get_detail is True:
             query_fields.append("summary")
-        return await cls.filter(report_case_id=report_case_id).values(*query_fields)
+        return cls.merge_pending_progress(await cls.filter(report_case_id=report_case_id).values(*query_fields))
 
     @classmethod
     async def get_resport_step_list_by_report(cls, report_id):
         """ 获取步骤列表，性能考虑，只查关键字段 """
         query_fields = ["id", "case_id", "report_case_id", "name", "process", "result", "summary", "status"]
-        return await cls.filter(report_id=report_id).values(*query_fields)
+        return cls.merge_pending_progress(await cls.filter(report_id=report_id).values(*query_fields))
 
     @classmethod
     async def update_status(cls, report_id=None, report_case_id=None, report_step_id=None, status=ReportStepStatusEnum.RESUME):
         """ 修改步骤的执行状态, stop、pause、resume """
         if report_id and report_case_id is None and report_step_id is None:  # 更新整个测试报告的数据
-            await cls.filter(report_id=report_id).update(status=status)
+            query = cls.filter(report_id=report_id)
         elif report_id is None and report_case_id and report_step_id is None:  # 更新整个用例测试报告的数据
-            await cls.filter(report_case_id=report_case_id).update(status=status)
+            query = cls.filter(report_case_id=report_case_id)
         elif report_id is None and report_case_id and report_step_id:  # 更新用例下指定步骤及之后的测试报告的数据
-            await cls.filter(report_case_id=report_case_id, id__gte=report_step_id).update(status=status)
+            query = cls.filter(report_case_id=report_case_id, id__gte=report_step_id)
         elif report_id is None and report_case_id is None and report_step_id:  # 更新指定数据的状态
-            await cls.filter(id=report_step_id).update(status=status)
+            query = cls.filter(id=report_step_id)
+        else:
+            return
+        report_step_list = await query.values("id", "report_case_id")
+        await query.update(status=status)
+        cls.get_status_registry().set_status(report_step_list, status)  # 唤醒当前进程中等待放行的步骤
 
     @classmethod
-    async def get_resport_step_with_status(cls, resport_step_id, time_out=60):
-        """ 如果步骤的状态是暂停，则等暂停完毕或者暂停超时结束后再返回，模拟debug """
-        while time_out >= 0:
-            report_step = await cls.filter(id=resport_step_id).first()
-            if report_step.status == "pause":  # 如果设置了当前步骤为暂停执行，则每5秒查询一次状态有没有变更
-                time_out -= 5
-                time.sleep(5)
-                if time_out >= 5:  # 最后一次循环就不重置 report_step 变量了
-                    report_step = None
-                continue
-            return report_step
-
-        # 步骤暂停超时过后还没有放行，把后面的所有步骤都改为停止执行
-        await cls.update_status(None, report_step.report_case_id, report_step.id, "stop")
-        report_step.status = "stop"
-        return report_step
+    async def get_resport_step_with_status(cls, resport_step_id, time_out=60, report_id=None, report_case_id=None):
+        """ 如果步骤的状态是暂停，则等暂停完毕或者暂停超时结束后再返回，模拟debug
+        等待期间不阻塞事件循环，状态在当前进程修改的立即唤醒，在其他进程修改的由定时同步感知
+        """
+        if report_case_id is None:
+            report_step = await cls.filter(id=resport_step_id).first().values("report_id", "report_case_id")
+            report_id, report_case_id = report_step["report_id"], report_step["report_case_id"]
+
+        status = await cls.get_status_registry().wait_status(report_case_id, resport_step_id, time_out)
+        if status is None:  # 步骤暂停超时过后还没有放行，把后面的所有步骤都改为停止执行
+            status = ReportStepStatusEnum.STOP
+            await cls.update_status(None, report_case_id, resport_step_id, status)
+        return cls(id=resport_step_id, report_id=report_id, report_case_id=report_case_id, status=status)
 
     async def save_step_result_and_summary(self, step_runner, step_error_traceback=None):
         """ 保存测试步骤的结果和数据 """
-        data = step_runner.get_test_step_data()
-        step_data = self.loads(self.dumps(data))  # 可能有 datetime 格式的数据
+        step_data = step_runner.get_test_step_data()
         step_meta_data = step_runner.client_session.meta_data
         step_data["attachment"] = step_error_traceback
         # 保存测试步骤的结果和数据
@@ -134,81 +296,54 @@ class BaseReportStep(BaseModel):
                 case_summary["stat"]["response_time"]["slow"].append(report_step_id)
 
     async def update_report_step_data(self, **kwargs):
-        """ 更新测试数据 """
-        await self.__class__.filter(id=self.id).update(**kwargs)
+        """ 更新测试数据，先写到缓冲中，由缓冲批量写库 """
+        self.get_progress_buffer().add(self.id, kwargs)
 
     async def update_test_result(self, result, step_data):
         """ 更新测试状态 """
         update_dict = {"result": result}
         if step_data:
-            if isinstance(step_data, dict):
-                step_data = self.dumps(step_data)
             update_dict["step_data"] = step_data
-        await self.__class__.filter(id=self.id).update(**update_dict)
+        await self.update_report_step_data(**update_dict)
 
     async def test_is_running(self, step_data=None):
-        if isinstance(step_data, dict):
-            step_data = self.dumps(step_data)
         await self.update_test_result("running", step_data)
 
     async def test_is_fail(self, step_data=None):
-        if isinstance(step_data, dict):
-            step_data = self.dumps(step_data)
         await self.update_test_result("fail", step_data)
 
     async def test_is_success(self, step_data=None):
-        if isinstance(step_data, dict):
-            step_data = self.dumps(step_data)
         await self.update_test_result("success", step_data)
 
     async def test_is_skip(self, step_data=None):
-        if isinstance(step_data, dict):
-            step_data = self.dumps(step_data)
         await self.update_test_result("skip", step_data)
 
     async def test_is_error(self, step_data=None):
-        if isinstance(step_data, dict):
-            step_data = self.dumps(step_data)
         await self.update_test_result("error", step_data)
 
     async def update_step_process(self, process, step_data):
-        """ 更新数据和执行进度 """
+        """ 更新数据和执行进度，step_data 在记录到缓冲时序列化 """
         update_dict = {"process": process}
         if step_data:
-            if isinstance(step_data, dict):
-                step_data = self.dumps(step_data)
             update_dict["step_data"] = step_data
-
-        await self.__class__.filter(id=self.id).update(**update_dict)
+        await self.update_report_step_data(**update_dict)
 
     async def test_is_start_parse(self, step_data=None):
-        if isinstance(step_data, dict):
-            step_data = self.dumps(step_data)
         await self.update_step_process("parse", step_data)
 
     async def test_is_start_before(self, step_data=None):
-        if isinstance(step_data, dict):
-            step_data = self.dumps(step_data)
         await self.update_step_process("before", step_data)
 
     async def test_is_start_running(self, step_data=None):
-        if isinstance(step_data, dict):
-            step_data = self.dumps(step_data)
         await self.update_step_process("run", step_data)
 
     async def test_is_start_extract(self, step_data=None):
-        if isinstance(step_data, dict):
-            step_data = self.dumps(step_data)
         await self.update_step_process("extract", step_data)
 
     async def test_is_start_after(self, step_data=None):
-        if isinstance(step_data, dict):
-            step_data = self.dumps(step_data)
         await self.update_step_process("after", step_data)
 
     async def test_is_start_validate(self, step_data=None):
-        if isinstance(step_data, dict):
-            step_data = self.dumps(step_data)
         await self.update_step_process("validate", step_data)
 
 
@@ -36,7 +36,7 @@ class BaseTask(BaseModel):
     push_hit = fields.IntField(default=1, null=True, description="任务不通过时，是否自动记录，0：不记录，1：记录，默认1")
     conf = fields.JSONField(
         default={"browser": "chrome", "server_id": "", "phone_id": "", "no_reset": ""},
-        description="运行配置，ui存浏览器，app存运行服务器、手机、是否重置APP")
+        description="运行配置，ui存浏览器，app存运行服务器、手机、是否重置APP，case_concurrency存并行执行的用例并发数")
 
     class Meta:
         abstract = True  # 不生成表
@@ -1,3 +1,6 @@
+import time
+import uuid
+
 from selenium.webdriver.common.keys import Keys
 
 from ..base_model import fields, pydantic_model_creator, NumFiled
@@ -29,9 +32,49 @@ class Config(NumFiled):
         table = "config_config"
         table_description = "配置表"
 
+    # 进程内的配置缓存，{name: (value, 过期时间)}
+    # 修改配置时清空本进程的缓存，并更新数据库中的版本号，其他worker最多 version_check_interval 秒后发现版本变化并清空缓存
+    cache_ttl = 60
+    version_check_interval = 5
+    version_name = "config_cache_version"
+    _cache = {}
+    _cache_version = None
+    _version_check_time = 0
+
     @classmethod
     async def get_config(cls, name: str):
-        """ 获取配置 """
+        """ 获取配置，优先从进程内缓存获取 """
+        await cls.check_cache_version()
+        cache = cls._cache.get(name)
+        if cache and cache[1] > time.monotonic():
+            return cache[0]
+        value = await cls.get_config_from_db(name)
+        cls._cache[name] = (value, time.monotonic() + cls.cache_ttl)
+        return value
+
+    @classmethod
+    async def check_cache_version(cls):
+        """ 每隔 version_check_interval 秒检查一次缓存版本号，其他worker修改过配置则清空本进程的缓存 """
+        now = time.monotonic()
+        if now - cls._version_check_time < cls.version_check_interval:
+            return
+        cls._version_check_time = now
+        data = await cls.filter(name=cls.version_name).first().values("value")
+        version = data["value"] if data else None
+        if version != cls._cache_version:
+            cls._cache, cls._cache_version = {}, version
+
+    @classmethod
+    async def clear_config_cache(cls):
+        """ 配置有修改时调用，清空本进程的缓存，并更新版本号通知其他worker """
+        version = uuid.uuid4().hex
+        if await cls.filter(name=cls.version_name).update(value=version) == 0:
+            await cls.create(name=cls.version_name, value=version, desc="配置缓存版本号，修改配置时自动更新，请勿手动修改")
+        cls._cache, cls._cache_version, cls._version_check_time = {}, version, time.monotonic()
+
+    @classmethod
+    async def get_config_from_db(cls, name: str):
+        """ 从数据库获取配置 """
         data = await cls.filter(name=name).first().values("value")
         if data:
             return data["value"]
@@ -46,7 +89,19 @@ class Config(NumFiled):
                 "response_time_level": [0.5, 1, 2],
                 "pause_step_time_out": 300,
                 "appium_new_command_timeout": 120,
-                "run_time_out": 60
+                "run_time_out": 60,
+                "run_case_concurrency": 5,
+                "http_client_conf": '{"max_connections": 100, "max_keepalive_connections": 20, "keepalive_expiry": 30, "http2": false}',
+                "executor_conf": '{"run_concurrency": 20}',
+                "webdriver_pool_conf": '{"enabled": true, "max_idle": 2, "idle_timeout": 300, "health_check": true}',
+                "screenshot_conf": '{"policy": "all", "every_n": 5, "format": "jpeg", "quality": 75}',
+                "task_dispatch_conf": '{"mode": "queue", "max_concurrency": 10, "poll_interval": 1, "misfire_grace_time": 600, "lease_timeout": 300, "keep_days": 7}',
+                "notify_conf": '{"max_concurrency": 10, "retry_times": 2, "retry_interval": 1, "timeout": {"ding_ding": 10, "we_chat": 10, "fei_shu": 10, "webhook": 30, "email": 60}}',
+                "embedding_conf": '{"batch_size": 32, "concurrency": 4, "cache_mb": 64, "migrate_legacy_vectors": false}',
+                "requirement_review_conf": '{"concurrency": 5, "timeout": 180}',
+                "llm_client_conf": '{"idle_timeout": 600, "max_connections": 100, "keepalive_expiry": 120}',
+                "checkpoint_conf": '{"keep_latest": 20, "busy_timeout": 30, "compact_interval": 600, "vacuum_interval": 86400, "convert_max_mb": 64}',
+                "knowledge_search_conf": '{"hybrid": false}'
             }
             return default_values.get(name, "")
 
@@ -104,6 +159,70 @@ class Config(NumFiled):
     async def get_pause_step_time_out(cls):
         return int(await cls.get_config("pause_step_time_out"))
 
+    @classmethod
+    async def get_run_case_concurrency(cls):
+        """ 并行执行用例时的默认并发数 """
+        return int(await cls.get_config("run_case_concurrency") or 5)
+
+    @classmethod
+    async def get_http_client_conf(cls):
+        """ 接口测试的HTTP连接池配置，连接数上限、keep-alive连接数、keep-alive超时时间（秒）、是否启用HTTP/2 """
+        return cls.loads(await cls.get_config("http_client_conf"))
+
+    @classmethod
+    async def get_executor_conf(cls):
+        """ 共享线程池配置，一次测试运行最多同时占用的线程数（自定义函数、UI操作） """
+        return cls.loads(await cls.get_config("executor_conf"))
+
+    @classmethod
+    async def get_webdriver_pool_conf(cls):
+        """ UI、app测试的会话池配置，是否启用、每种配置最多保留的空闲会话数、空闲超时时间（秒）、借出前是否做健康检查 """
+        return cls.loads(await cls.get_config("webdriver_pool_conf"))
+
+    @classmethod
+    async def get_screenshot_conf(cls):
+        """ UI、app测试的步骤截图配置，截图策略（all/after/failure/every_n）、间隔步骤数、图片格式（png/webp/jpeg）、压缩质量 """
+        return cls.loads(await cls.get_config("screenshot_conf"))
+
+    @classmethod
+    async def get_task_dispatch_conf(cls):
+        """ 定时任务触发配置，触发方式（queue：写入队列由主服务消费，http：调主服务的接口）、同时执行的任务数、队列轮询间隔（秒）、触发后多久未执行则跳过（秒）、
+        执行中的任务多久没有续租则放回队列（秒）、执行完的记录保留天数
+        """
+        return cls.loads(await cls.get_config("task_dispatch_conf"))
+
+    @classmethod
+    async def get_notify_conf(cls):
+        """ 通知发送配置，同时发送的数量、失败重试次数、重试间隔（秒，按2的幂次退避）、各渠道的超时时间（秒） """
+        return cls.loads(await cls.get_config("notify_conf"))
+
+    @classmethod
+    async def get_embedding_conf(cls):
+        """ 知识库文档向量化配置，每次请求的文本数、同时请求的数量、每个进程向量缓存占用的内存上限（MB）、
+        启动检查时是否重新向量化升级前写入的向量 """
+        return cls.loads(await cls.get_config("embedding_conf"))
+
+    @classmethod
+    async def get_requirement_review_conf(cls):
+        """ 需求评审配置，同时执行的专项分析数量、单个专项分析的超时时间（秒） """
+        return cls.loads(await cls.get_config("requirement_review_conf"))
+
+    @classmethod
+    async def get_llm_client_conf(cls):
+        """ LLM客户端配置，实例和连接池的空闲回收时间（秒）、最大连接数、连接保持时间（秒） """
+        return cls.loads(await cls.get_config("llm_client_conf"))
+
+    @classmethod
+    async def get_checkpoint_conf(cls):
+        """ 对话checkpoint存储配置，每个对话保留的checkpoint数、写锁等待时间（秒）、压缩间隔（秒）、空间回收间隔（秒）、
+        启动时在线切换为增量回收模式的数据库大小上限（MB） """
+        return cls.loads(await cls.get_config("checkpoint_conf"))
+
+    @classmethod
+    async def get_knowledge_search_conf(cls):
+        """ 知识库检索配置，是否默认使用混合检索（向量检索+关键词检索），默认关闭 """
+        return cls.loads(await cls.get_config("knowledge_search_conf"))
+
     @classmethod
     async def get_response_time_level(cls):
         return cls.loads(await cls.get_config("response_time_level"))
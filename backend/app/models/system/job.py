@@ -1,4 +1,8 @@
+import datetime
+
 from ..base_model import BaseModel, fields, pydantic_model_creator
+from ...tools.db_compatibility import DatabaseCompatibility
+from utils.logs.log import logger
 
 
 class ApschedulerJobs(BaseModel):
@@ -34,5 +38,110 @@ class JobRunLog(BaseModel):
         await self.model_update({"status": 2, "detail": detail})
 
 
+class TaskRunQueue(BaseModel):
+    """ 定时任务触发队列，job服务触发定时任务时写入，主服务的worker消费执行，不再每次触发都调一次主服务的接口
+    执行中的任务由执行它的worker定时续租（刷新 update_time），worker退出后租约过期，任务放回队列由其他worker重新执行
+    """
+
+    task_code = fields.CharField(64, index=True, description="任务code，任务类型_任务id，如 api_1、cron_cron_clear_report")
+    task_type = fields.CharField(16, description="任务类型：api、ui、app、cron")
+    fire_time = fields.DatetimeField(description="触发时间")
+    status = fields.IntField(
+        default=0, index=True, description="执行状态：0待执行、1执行中、2执行成功、3执行失败、4超过容忍时间未执行")
+    detail = fields.JSONField(default={}, description="执行结果数据")
+
+    class Meta:
+        table = "system_task_run_queue"
+        table_description = "定时任务触发队列表"
+
+    @classmethod
+    async def create_table(cls):
+        """ 表不存在则创建，已部署的环境升级后不用手动建表，和 test_platform.sql 中的表结构一致 """
+        if DatabaseCompatibility.is_postgresql():
+            sql = f"""CREATE TABLE IF NOT EXISTS "{cls._meta.db_table}" (
+                "id" SERIAL NOT NULL PRIMARY KEY,
+                "create_time" TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                "update_time" TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                "create_user" INT DEFAULT 1,
+                "update_user" INT DEFAULT 1,
+                "task_code" VARCHAR(64) NOT NULL,
+                "task_type" VARCHAR(16) NOT NULL,
+                "fire_time" TIMESTAMPTZ NOT NULL,
+                "status" INT NOT NULL DEFAULT 0,
+                "detail" JSONB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS "idx_system_task_task_co_9bfaa2" ON "{cls._meta.db_table}" ("task_code");
+            CREATE INDEX IF NOT EXISTS "idx_system_task_status_c5bda8" ON "{cls._meta.db_table}" ("status");"""
+        else:  # MySQL
+            sql = f"""CREATE TABLE IF NOT EXISTS `{cls._meta.db_table}` (
+                `id` int NOT NULL AUTO_INCREMENT,
+                `create_time` datetime(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) COMMENT '创建时间',
+                `update_time` datetime(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6) COMMENT '最后修改时间',
+                `create_user` int NULL DEFAULT 1 COMMENT '创建人',
+                `update_user` int NULL DEFAULT 1 COMMENT '最后修改人',
+                `task_code` varchar(64) NOT NULL COMMENT '任务code，任务类型_任务id，如 api_1、cron_cron_clear_report',
+                `task_type` varchar(16) NOT NULL COMMENT '任务类型：api、ui、app、cron',
+                `fire_time` datetime(6) NOT NULL COMMENT '触发时间',
+                `status` int NOT NULL DEFAULT 0 COMMENT '执行状态：0待执行、1执行中、2执行成功、3执行失败、4超过容忍时间未执行',
+                `detail` json NOT NULL COMMENT '执行结果数据',
+                PRIMARY KEY (`id`),
+                KEY `idx_system_task_task_co_9bfaa2` (`task_code`),
+                KEY `idx_system_task_status_c5bda8` (`status`)
+            ) ENGINE = InnoDB CHARACTER SET = utf8mb4 COMMENT = '定时任务触发队列表'"""
+        await cls._meta.db.execute_script(sql)
+
+    @classmethod
+    async def enqueue(cls, task_code, task_type):
+        """ 加入队列，同一个任务已经有待执行的则合并，不重复加入 """
+        if await cls.filter(task_code=task_code, status=0).exists():
+            return None
+        return await cls.create(task_code=task_code, task_type=task_type, fire_time=datetime.datetime.now())
+
+    @classmethod
+    async def claim(cls, limit, misfire_grace_time):
+        """ 领取待执行的任务，多个worker同时领取时，以把状态从0改为1成功的为准
+        超过容忍时间还没被领取的，标记为超过容忍时间未执行
+        """
+        expire_time = datetime.datetime.now() - datetime.timedelta(seconds=misfire_grace_time)
+        misfire_count = await cls.filter(status=0, fire_time__lt=expire_time).update(status=4)
+        if misfire_count:
+            logger.warning(f"有 {misfire_count} 个定时任务超过容忍时间未执行，已跳过")
+
+        claimed_list = []
+        for queue in await cls.filter(status=0).order_by("fire_time", "id").limit(limit * 2):
+            if len(claimed_list) >= limit:
+                break
+            if await cls.filter(id=queue.id, status=0).update(status=1, update_time=datetime.datetime.now()):
+                claimed_list.append(queue)
+        return claimed_list
+
+    @classmethod
+    async def renew(cls, id_list):
+        """ 续租，刷新执行中任务的 update_time """
+        if id_list:
+            await cls.filter(id__in=id_list, status=1).update(update_time=datetime.datetime.now())
+
+    @classmethod
+    async def recover(cls, lease_timeout):
+        """ 租约过期（执行的worker已退出）的任务放回队列，超过容忍时间的会在领取时跳过 """
+        expire_time = datetime.datetime.now() - datetime.timedelta(seconds=lease_timeout)
+        recover_count = await cls.filter(status=1, update_time__lt=expire_time).update(status=0)
+        if recover_count:
+            logger.warning(f"有 {recover_count} 个定时任务执行的worker已退出，已放回队列")
+
+    @classmethod
+    async def purge(cls, keep_days):
+        """ 清理已经执行完的记录 """
+        time_point = datetime.datetime.now() - datetime.timedelta(days=keep_days)
+        await cls.filter(status__in=[2, 3, 4], create_time__lt=time_point).delete()
+
+    async def run_success(self, detail=None):
+        await self.model_update({"status": 2, "detail": detail or {}})
+
+    async def run_fail(self, detail=None):
+        await self.model_update({"status": 3, "detail": detail or {}})
+
+
 ApschedulerJobsPydantic = pydantic_model_creator(ApschedulerJobs, name="ApschedulerJobs")
 JobRunLogPydantic = pydantic_model_creator(JobRunLog, name="JobRunLog")
+TaskRunQueuePydantic = pydantic_model_creator(TaskRunQueue, name="TaskRunQueue")
@@ -216,8 +216,8 @@ class User(NumFiled):
 
 
     @classmethod
-    async def get_run_user_id(cls, request: Request):
-        if hasattr(request.state, "user"):
+    async def get_run_user_id(cls, request: Request = None):
+        if request is not None and hasattr(request.state, "user"):
             return request.state.user.id
         data = await User.filter(account='common').first().values("id")
         if data:
@@ -21,4 +21,6 @@ report_router.add_get_route("/step", service.get_report_step, auth=False, summar
 report_router.add_put_route(
     "/step-status", service.change_report_step_status, auth=False, summary="修改步骤的状态，控制模拟debug")
 report_router.add_get_route("/step-img", service.get_report_step_img, auth=False, summary="获取报告的步骤截图")
+report_router.add_get_route(
+    "/step-img-file", service.get_report_step_img_file, auth=False, summary="获取报告的步骤截图文件")
 report_router.add_get_route("/report-clear", service.report_clear, auth=False, summary="清除测试报告")
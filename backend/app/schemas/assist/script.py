@@ -7,7 +7,6 @@ from pydantic import Field
 
 from ..base_form import BaseForm, PaginationForm, ChangeSortForm
 from ...models.assist.model_factory import Script
-from utils.util.file_util import FileUtil
 
 
 class FindScriptForm(PaginationForm):
@@ -81,7 +80,7 @@ class CreatScriptForm(BaseForm):
 
             # 把自定义函数脚本内容写入到python脚本中,
             await Script.create_script_file(default_env)  # 重新发版时会把文件全部删除，所以全部创建
-            FileUtil.save_script_data(f'{default_env}_{self.name}', self.script_data, env=default_env)
+            Script.save_script_file(default_env, self.name, self.script_data)
 
             # 动态导入脚本，语法有错误则不保存
             try:
@@ -91,6 +90,8 @@ class CreatScriptForm(BaseForm):
                     "msg": "语法错误，请检查",
                     "result": "\n".join("{}".format(traceback.format_exc()).split("↵"))
                 })
+            finally:
+                Script.clear_script_cache()  # 模块被重新加载过，已编译的函数不再可用
 
     async def validate_request(self, user, save_func_permissions, *args, **kwargs):
         await self.validate_script_name()
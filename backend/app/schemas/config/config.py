@@ -48,7 +48,7 @@ class FindConfigForm(PaginationForm):
 
     def get_query_filter(self, *args, **kwargs):
         """ 查询条件 """
-        filter_dict = {}
+        filter_dict = {"name__not": "config_cache_version"}  # 配置缓存版本号，不展示
         if self.type:
             filter_dict["type"] = int(self.type)
         if self.name:
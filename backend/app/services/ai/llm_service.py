@@ -7,9 +7,12 @@ import asyncio
 from typing import List, Dict, Any, Optional, Union
 from enum import Enum
 import json
+import time
 import httpx
 from datetime import datetime
 
+from app.services.aitestrebort.llm_client_registry import LLMClientRegistry
+
 logger = logging.getLogger(__name__)
 
 
@@ -483,49 +486,75 @@ if __name__ == "__main__":
             await self.client.aclose()
 
 
-# 全局LLM服务实例管理
-_llm_services: Dict[str, LLMService] = {}
+# 全局LLM服务实例管理，{配置名称: [配置版本, 服务实例, 下次对比配置版本的时间]}
+_llm_services: Dict[str, list] = {}
+_close_task_set = set()  # 等待关闭的旧服务，保留引用，避免任务被回收
+# 本进程修改配置时由信号立即失效，其他worker修改的配置每隔 check_interval 秒对比一次版本
+check_interval = 60
+
+
+def invalidate_llm_services(config_id=None):
+    """ LLM配置保存、删除时调用，激活的配置可能已经换了，下次使用时重新对比配置版本 """
+    for item in _llm_services.values():
+        item[2] = 0
+
+
+LLMClientRegistry.add_invalidate_listener(invalidate_llm_services)
+
+
+async def _close_later(service: LLMService, delay: float):
+    await asyncio.sleep(delay)
+    await service.close()
 
 
 async def get_llm_service(config_name: str = "default") -> LLMService:
-    """获取LLM服务实例"""
-    if config_name not in _llm_services:
-        try:
-            # 从数据库加载LLM配置
-            from app.models.aitestrebort.project import aitestrebortLLMConfig
-            
-            # 获取激活的LLM配置
-            llm_config = await aitestrebortLLMConfig.filter(is_active=True).first()
-            
-            if not llm_config:
-                raise ValueError("没有找到激活的LLM配置，请先在系统中配置LLM")
-            
-            # 构建配置
-            config = {
-                "provider": LLMProvider.CUSTOM,  # 使用自定义提供商
-                "base_url": llm_config.base_url,
-                "model": llm_config.name,
-                "api_key": llm_config.api_key,
-                "timeout": 60.0
-            }
-            
-            _llm_services[config_name] = LLMService(
-                provider=LLMProvider.CUSTOM,
-                config=config
-            )
-            
-            logger.info(f"LLM服务已配置: {llm_config.config_name} ({llm_config.name})")
-            
-        except Exception as e:
-            logger.error(f"LLM服务配置失败: {e}")
-            # 不使用默认配置，直接抛出错误
-            raise ValueError(f"LLM服务配置失败: {e}")
-    
-    return _llm_services[config_name]
+    """获取LLM服务实例，激活的LLM配置修改后重新创建"""
+    item = _llm_services.get(config_name)
+    if item is not None and time.monotonic() < item[2]:
+        return item[1]
+
+    try:
+        from app.models.aitestrebort.project import aitestrebortLLMConfig
+
+        # 获取激活的LLM配置
+        llm_config = await aitestrebortLLMConfig.filter(is_active=True).first()
+
+        if not llm_config:
+            raise ValueError("没有找到激活的LLM配置，请先在系统中配置LLM")
+
+        version = (llm_config.id, LLMClientRegistry.get_version(llm_config))
+        if item is not None and item[0] == version:
+            item[2] = time.monotonic() + check_interval
+            return item[1]
+
+        # 构建配置
+        config = {
+            "provider": LLMProvider.CUSTOM,  # 使用自定义提供商
+            "base_url": llm_config.base_url,
+            "model": llm_config.name,
+            "api_key": llm_config.api_key,
+            "timeout": 60.0
+        }
+
+        service = LLMService(provider=LLMProvider.CUSTOM, config=config)
+        _llm_services[config_name] = [version, service, time.monotonic() + check_interval]
+        if item is not None:  # 等正在进行的请求超时后再关闭旧连接
+            task = asyncio.create_task(_close_later(item[1], config["timeout"]))
+            _close_task_set.add(task)
+            task.add_done_callback(_close_task_set.discard)
+
+        logger.info(f"LLM服务已配置: {llm_config.config_name} ({llm_config.name})")
+
+    except Exception as e:
+        logger.error(f"LLM服务配置失败: {e}")
+        # 不使用默认配置，直接抛出错误
+        raise ValueError(f"LLM服务配置失败: {e}")
+
+    return service
 
 
 async def cleanup_llm_services():
     """清理所有LLM服务实例"""
-    for service in _llm_services.values():
+    for _, service, _ in _llm_services.values():
         await service.close()
-    _llm_services.clear()
\ No newline at end of file
+    _llm_services.clear()
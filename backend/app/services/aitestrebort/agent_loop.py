@@ -16,6 +16,8 @@ from typing import Any, Dict, List, Optional, Tuple
 
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 
+from utils.util.executor_util import ExecutorService
+
 logger = logging.getLogger(__name__)
 
 
@@ -24,6 +26,10 @@ class AgentOrchestrator:
     
     DEFAULT_MAX_STEPS = 500
     DEFAULT_HISTORY_WINDOW = 10  # 传给 AI 的历史条数
+    DEFAULT_TOOL_CONCURRENCY = 5  # 同一步中最多同时执行的工具数
+    DEFAULT_TOOL_TIMEOUT = 300  # 单个工具的超时时间（秒）
+    # 操作同一个浏览器页面的工具有先后顺序，同一步中按模型给出的顺序逐个执行
+    SERIAL_TOOL_KEYWORDS = ['playwright', 'browser', 'page', 'snapshot']
     
     # AI 决策提示词
     STEP_SYSTEM_PROMPT = """你是一个智能助手，正在执行用户的任务。
@@ -49,7 +55,15 @@ class AgentOrchestrator:
 注意：每次只执行一个操作，执行后会收到结果再决定下一步。
 """
 
-    def __init__(self, llm, tools=None, max_steps: int = None):
+    def __init__(
+        self,
+        llm,
+        tools=None,
+        max_steps: int = None,
+        tool_concurrency: int = None,
+        tool_timeout: int = None,
+        tool_timeouts: Dict[str, int] = None
+    ):
         """
         初始化编排器
         
@@ -57,10 +71,17 @@ class AgentOrchestrator:
             llm: LangChain LLM 实例
             tools: 可用的工具列表
             max_steps: 最大步骤数
+            tool_concurrency: 同一步中最多同时执行的工具数
+            tool_timeout: 工具默认超时时间（秒）
+            tool_timeouts: 按工具名单独设置的超时时间（秒）
         """
         self.llm = llm
         self.tools = tools or []
         self.max_steps = max_steps or self.DEFAULT_MAX_STEPS
+        self.tool_concurrency = max(tool_concurrency or self.DEFAULT_TOOL_CONCURRENCY, 1)
+        self.tool_timeout = tool_timeout or self.DEFAULT_TOOL_TIMEOUT
+        self.tool_timeouts = tool_timeouts or {}
+        self.tool_dict = {getattr(tool, 'name', None): tool for tool in self.tools}
         
         # 如果有工具，绑定到 LLM
         if self.tools:
@@ -465,53 +486,73 @@ class AgentOrchestrator:
         return result
     
     async def _execute_tools(self, tool_calls: List) -> List[Dict]:
-        """执行工具调用"""
-        results = []
+        """
+        执行工具调用
         
-        for tool_call in tool_calls:
+        互不依赖的工具调用并发执行，同时执行的数量不超过 tool_concurrency
+        操作浏览器页面的工具按顺序逐个执行，结果按模型给出的顺序返回
+        """
+        semaphore = asyncio.Semaphore(self.tool_concurrency)
+        serial_lock = asyncio.Lock()
+        
+        async def run(tool_call):
             tool_name, tool_args = self._extract_tool_call_payload(tool_call)
-            
-            if not tool_name:
-                results.append({
-                    'tool_name': '',
-                    'input': tool_args,
-                    'error': '工具名称缺失'
-                })
-                continue
-            
-            # 查找工具
-            tool = self._find_tool(tool_name)
-            if not tool:
-                results.append({
-                    'tool_name': tool_name,
-                    'error': f'工具 {tool_name} 不存在'
-                })
-                continue
-            
-            try:
-                # 执行工具（支持同步/异步）
-                output = await self._invoke_tool(tool, tool_args)
-                results.append({
-                    'tool_name': tool_name,
-                    'input': tool_args,
-                    'output': output
-                })
-            except Exception as e:
-                logger.error(f"工具 {tool_name} 调用失败: {e}", exc_info=True)
-                results.append({
-                    'tool_name': tool_name,
-                    'input': tool_args,
-                    'error': str(e)
-                })
-        
-        return results
+            if self._is_serial_tool(tool_name):
+                async with serial_lock, semaphore:
+                    return await self._execute_tool(tool_name, tool_args)
+            async with semaphore:
+                return await self._execute_tool(tool_name, tool_args)
+        
+        return list(await asyncio.gather(*[run(tool_call) for tool_call in tool_calls]))
+    
+    async def _execute_tool(self, tool_name: str, tool_args: Dict[str, Any]) -> Dict:
+        """执行单个工具调用，异常、超时都转为错误结果，不影响同一步的其他工具"""
+        if not tool_name:
+            return {
+                'tool_name': '',
+                'input': tool_args,
+                'error': '工具名称缺失'
+            }
+        
+        # 查找工具
+        tool = self._find_tool(tool_name)
+        if not tool:
+            return {
+                'tool_name': tool_name,
+                'error': f'工具 {tool_name} 不存在'
+            }
+        
+        timeout = self.tool_timeouts.get(tool_name, self.tool_timeout)
+        try:
+            # 执行工具（支持同步/异步）
+            output = await self._invoke_tool(tool, tool_args, timeout)
+            return {
+                'tool_name': tool_name,
+                'input': tool_args,
+                'output': output
+            }
+        except asyncio.TimeoutError:
+            logger.error(f"工具 {tool_name} 调用超时: {timeout}秒")
+            return {
+                'tool_name': tool_name,
+                'input': tool_args,
+                'error': f'工具 {tool_name} 执行超时（{timeout}秒）'
+            }
+        except Exception as e:
+            logger.error(f"工具 {tool_name} 调用失败: {e}", exc_info=True)
+            return {
+                'tool_name': tool_name,
+                'input': tool_args,
+                'error': str(e)
+            }
+    
+    def _is_serial_tool(self, tool_name: str) -> bool:
+        tool_name = (tool_name or '').lower()
+        return any(keyword in tool_name for keyword in self.SERIAL_TOOL_KEYWORDS)
     
     def _find_tool(self, tool_name: str):
         """查找工具"""
-        for tool in self.tools:
-            if tool.name == tool_name:
-                return tool
-        return None
+        return self.tool_dict.get(tool_name)
     
     def _extract_tool_call_payload(self, tool_call: Any) -> Tuple[str, Dict[str, Any]]:
         """兼容不同格式的工具调用负载"""
@@ -531,11 +572,13 @@ class AgentOrchestrator:
         
         return (name or ''), (args or {})
     
-    async def _invoke_tool(self, tool, tool_args: Dict[str, Any]) -> Any:
-        """统一处理同步与异步工具"""
-        # 优先使用异步方法
-        if hasattr(tool, 'ainvoke'):
-            return await tool.ainvoke(tool_args)
+    async def _invoke_tool(self, tool, tool_args: Dict[str, Any], timeout: int = None) -> Any:
+        """统一处理同步与异步工具，同步工具放到共享线程池执行，不阻塞事件循环"""
+        timeout = timeout or self.tool_timeout
+        
+        # 只有同步实现的工具（如 StructuredTool 只传了 func）直接在线程池中调用 invoke
+        if hasattr(tool, 'ainvoke') and not self._is_sync_tool(tool):
+            return await asyncio.wait_for(tool.ainvoke(tool_args), timeout=timeout)
         
         # 同步方法
         invoke_callable = getattr(tool, 'invoke', None)
@@ -544,7 +587,12 @@ class AgentOrchestrator:
         if not invoke_callable:
             raise AttributeError(f'工具 {getattr(tool, "name", str(tool))} 缺少 invoke/ainvoke 实现')
         
-        return await asyncio.to_thread(invoke_callable, tool_args)
+        return await ExecutorService.run(invoke_callable, (tool_args,), timeout=timeout)
+    
+    @staticmethod
+    def _is_sync_tool(tool) -> bool:
+        """有同步函数、没有协程函数的工具"""
+        return getattr(tool, 'func', None) is not None and getattr(tool, 'coroutine', None) is None
     
     def _summarize_tool_results(self, tool_results: List[Dict]) -> str:
         """
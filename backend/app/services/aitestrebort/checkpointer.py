@@ -3,16 +3,20 @@ LangGraph Checkpointer 集成模块
 提供统一的checkpointer工厂函数，支持SQLite持久化
 """
 import os
+import time
+import asyncio
 import logging
 from pathlib import Path
 from contextlib import asynccontextmanager, contextmanager
-from typing import Optional, List
+from typing import Optional, List, Set, Tuple
 import aiosqlite
 import sqlite3
 
 from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from langgraph.checkpoint.sqlite import SqliteSaver
 
+from utils.util.executor_util import ExecutorService
+
 logger = logging.getLogger(__name__)
 
 # 默认的checkpointer数据库路径
@@ -34,14 +38,220 @@ def get_checkpoint_db_path() -> str:
     db_file = Path(db_path)
     db_file.parent.mkdir(parents=True, exist_ok=True)
     
-    logger.info(f"Using checkpoint database: {db_path}")
     return db_path
 
 
+class TrackedSqliteSaver(AsyncSqliteSaver):
+    """ 记录写入过 checkpoint 的 thread，压缩时只处理这些 thread，不用每次都扫描全表 """
+
+    def __init__(self, conn: aiosqlite.Connection, **kwargs):
+        if not hasattr(conn, "is_alive"):  # aiosqlite 0.22 起连接不再是线程对象，没有 is_alive，建表时会报错
+            conn.is_alive = lambda: conn._connection is not None
+        super().__init__(conn, **kwargs)
+        self.written_threads: Set[Tuple[str, str]] = set()
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        result = await super().aput(config, checkpoint, metadata, new_versions)
+        configurable = config["configurable"]
+        self.written_threads.add((str(configurable["thread_id"]), configurable.get("checkpoint_ns", "")))
+        return result
+
+
+class CheckpointStore:
+    """ checkpoint 存储
+    - 每个进程共用一个数据库连接和 checkpointer，不再每次使用都打开连接、建表
+    - WAL 模式，多个 worker 可以同时读，写入时按 busy_timeout 秒等待其他 worker 的写锁，不会直接报 database is locked
+    - 后台每 compact_interval 秒压缩一次：每个 thread 只保留最近 keep_latest 个 checkpoint 及其 writes
+      只处理上次压缩后有写入的 thread（进程启动后第一次压缩检查全表），在线程池中用单独的连接分批删除，不阻塞对话读写
+    - 每 vacuum_interval 秒回收一次删除后的空闲页（incremental vacuum），并截断 WAL 文件
+      增量回收要求数据库是 auto_vacuum=INCREMENTAL 模式，新数据库建表前设置，已有数据库在服务启动时（prepare）切换，
+      切换需要完整 VACUUM 重建一次，期间独占写锁，超过 convert_max_mb 的数据库不在线切换，需要停服后离线执行
+    - 多个 worker 同一时间只有一个在压缩
+    """
+    keep_latest = 20
+    busy_timeout = 30
+    compact_interval = 600
+    vacuum_interval = 86400
+    convert_max_mb = 64
+    _conn: Optional[aiosqlite.Connection] = None
+    _saver: Optional[TrackedSqliteSaver] = None
+    _loop = None
+    _lock: Optional[asyncio.Lock] = None
+    _compact_task: Optional[asyncio.Task] = None
+    _full_compacted = False
+    _vacuum_time = 0
+
+    @classmethod
+    def configure(cls, keep_latest=20, busy_timeout=30, compact_interval=600, vacuum_interval=86400, convert_max_mb=64,
+                  **kwargs):
+        cls.keep_latest, cls.busy_timeout = max(int(keep_latest), 1), float(busy_timeout)
+        cls.compact_interval, cls.vacuum_interval = max(int(compact_interval), 1), int(vacuum_interval)
+        cls.convert_max_mb = float(convert_max_mb)
+
+    @classmethod
+    async def prepare(cls):
+        """ 服务启动时、开始提供服务前调用，把已有数据库切换为增量回收模式 """
+        from app.models.config.config import Config
+        cls.configure(**await Config.get_checkpoint_conf())
+        await ExecutorService.run(
+            cls.convert_db, (get_checkpoint_db_path(), cls.convert_max_mb, cls.busy_timeout), timeout=3600)
+
+    @staticmethod
+    def convert_db(db_path: str, convert_max_mb: float, busy_timeout: float) -> bool:
+        """ 把数据库切换为增量回收模式，返回是否已是增量回收模式
+        完整 VACUUM 期间独占写锁，其他 worker 只会等 busy_timeout 秒，所以只切换不超过 convert_max_mb 的数据库
+        多个 worker 同时启动时，拿到压缩锁的那个切换，其他的等它切换完再继续启动
+        """
+        import portalocker
+
+        if not os.path.exists(db_path):
+            return False  # 新数据库在 get_saver 建表前设置
+        with portalocker.Lock(f"{db_path}.compact.lock", timeout=3600):
+            conn = sqlite3.connect(db_path, timeout=busy_timeout)
+            try:
+                if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                    return True
+                size_mb = os.path.getsize(db_path) / 1024 / 1024
+                if size_mb > convert_max_mb:
+                    logger.warning(
+                        f"Checkpoint database {db_path} is {size_mb:.0f}MB, skip converting to incremental vacuum online, "
+                        f"stop the service and run: sqlite3 {db_path} 'PRAGMA auto_vacuum=INCREMENTAL; VACUUM;'")
+                    return False
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+                logger.info(f"Converted checkpoint database {db_path} to incremental vacuum")
+                return True
+            finally:
+                conn.close()
+
+    @classmethod
+    async def get_saver(cls) -> TrackedSqliteSaver:
+        """ 获取本进程共用的 checkpointer，事件循环变了则重新创建 """
+        loop = asyncio.get_running_loop()
+        if cls._saver is not None and cls._loop is loop:
+            return cls._saver
+        if cls._lock is None or cls._loop is not loop:
+            cls._lock, cls._loop, cls._saver, cls._conn, cls._compact_task = asyncio.Lock(), loop, None, None, None
+        async with cls._lock:
+            if cls._saver is None:
+                from app.models.config.config import Config
+                cls.configure(**await Config.get_checkpoint_conf())
+                db_path = get_checkpoint_db_path()
+                conn = await aiosqlite.connect(db_path, timeout=cls.busy_timeout)
+                await conn.execute("PRAGMA auto_vacuum=INCREMENTAL")  # 只对还没建表的新数据库生效，已有数据库在 prepare 中切换
+                await conn.execute("PRAGMA journal_mode=WAL")
+                await conn.execute("PRAGMA synchronous=NORMAL")  # WAL 模式下足够安全，提交时不用每次都刷盘
+                saver = TrackedSqliteSaver(conn)
+                await saver.setup()
+                cls._conn, cls._saver = conn, saver
+                cls._vacuum_time = time.time() + cls.vacuum_interval
+                cls._compact_task = asyncio.create_task(cls.compact_loop())
+                logger.info(f"Checkpoint store initialized with {db_path}")
+        return cls._saver
+
+    @classmethod
+    async def execute(cls, sql: str, params=(), fetch: bool = False):
+        """ 在共用的连接上执行SQL，和 checkpointer 的读写互斥 """
+        saver = await cls.get_saver()
+        async with saver.lock:
+            cursor = await saver.conn.execute(sql, params)
+            rows = await cursor.fetchall() if fetch else cursor.rowcount
+            await cursor.close()
+            if not fetch:
+                await saver.conn.commit()
+            return rows
+
+    @classmethod
+    async def compact_loop(cls):
+        while True:
+            await asyncio.sleep(cls.compact_interval)
+            try:
+                await cls.compact()
+            except Exception as e:
+                logger.error(f"Compact checkpoints failed: {e}", exc_info=True)
+
+    @classmethod
+    async def compact(cls) -> int:
+        """ 压缩 checkpoint，返回删除的 checkpoint 数，其他 worker 正在压缩时跳过 """
+        saver = await cls.get_saver()
+        threads, saver.written_threads = list(saver.written_threads), set()
+        if not cls._full_compacted:
+            threads = None  # 检查全表
+        vacuum = time.time() >= cls._vacuum_time
+        deleted_count = await ExecutorService.run(
+            cls.compact_db, (get_checkpoint_db_path(), threads, cls.keep_latest, vacuum, cls.busy_timeout), timeout=3600)
+        if deleted_count is None:  # 其他 worker 正在压缩，下次再处理
+            saver.written_threads.update(threads or [])
+            return 0
+        cls._full_compacted = True
+        if vacuum:
+            cls._vacuum_time = time.time() + cls.vacuum_interval
+        return deleted_count
+
+    @staticmethod
+    def compact_db(db_path: str, threads: Optional[List[Tuple[str, str]]], keep_latest: int, vacuum: bool,
+                   busy_timeout: float) -> Optional[int]:
+        """ 删除每个 thread 最近 keep_latest 个之前的 checkpoint 和 writes，返回删除数，拿不到压缩锁时返回 None """
+        import portalocker
+
+        try:
+            lock = portalocker.Lock(f"{db_path}.compact.lock", fail_when_locked=True)
+            lock.acquire()
+        except portalocker.exceptions.LockException:
+            return None
+
+        conn = sqlite3.connect(db_path, timeout=busy_timeout)
+        try:
+            if threads is None:
+                threads = conn.execute(
+                    "SELECT thread_id, checkpoint_ns FROM checkpoints GROUP BY thread_id, checkpoint_ns HAVING count(*) > ?",
+                    (keep_latest,)
+                ).fetchall()
+            deleted_count = 0
+            for thread_id, checkpoint_ns in threads:
+                with conn:  # 每个 thread 一个事务，写锁只持有很短的时间
+                    row = conn.execute(
+                        "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                        "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+                        (thread_id, checkpoint_ns, keep_latest - 1)
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    params = (thread_id, checkpoint_ns, row[0])
+                    deleted_count += conn.execute(
+                        "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?", params
+                    ).rowcount
+                    conn.execute(
+                        "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?", params)
+            if deleted_count:
+                logger.info(f"Compacted {deleted_count} checkpoints of {len(threads)} threads")
+
+            if vacuum:
+                # 不在这里完整 VACUUM，会长时间独占写锁，还不是增量回收模式的数据库只截断 WAL 文件
+                if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                    conn.execute("PRAGMA incremental_vacuum")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                logger.info("Vacuumed checkpoint database")
+            return deleted_count
+        finally:
+            conn.close()
+            lock.release()
+
+    @classmethod
+    async def close(cls):
+        """ 服务关闭时释放连接 """
+        if cls._compact_task is not None:
+            cls._compact_task.cancel()
+        if cls._conn is not None:
+            await cls._conn.close()
+        cls._conn = cls._saver = cls._loop = cls._lock = cls._compact_task = None
+
+
 @asynccontextmanager
 async def get_async_checkpointer():
     """
     异步上下文管理器：获取异步checkpointer实例
+    本进程共用同一个实例和连接，退出时不关闭连接
     
     使用方式：
         async with get_async_checkpointer() as checkpointer:
@@ -51,13 +261,7 @@ async def get_async_checkpointer():
     Yields:
         AsyncSqliteSaver实例
     """
-    db_path = get_checkpoint_db_path()
-    
-    # 使用AsyncSqliteSaver.from_conn_string创建实例（它返回一个context manager）
-    async with AsyncSqliteSaver.from_conn_string(db_path) as checkpointer:
-        logger.debug(f"Async checkpointer initialized with {db_path}")
-        yield checkpointer
-        logger.debug("Async checkpointer connection closed")
+    yield await CheckpointStore.get_saver()
 
 
 @contextmanager
@@ -92,18 +296,11 @@ async def delete_checkpoints_by_thread_id(thread_id: str) -> int:
     Returns:
         删除的记录数
     """
-    db_path = get_checkpoint_db_path()
+    deleted_count = await CheckpointStore.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+    await CheckpointStore.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
     
-    async with aiosqlite.connect(db_path) as conn:
-        cursor = await conn.execute(
-            "DELETE FROM checkpoints WHERE thread_id = ?",
-            (thread_id,)
-        )
-        deleted_count = cursor.rowcount
-        await conn.commit()
-        
-        logger.info(f"Deleted {deleted_count} checkpoints for thread_id: {thread_id}")
-        return deleted_count
+    logger.info(f"Deleted {deleted_count} checkpoints for thread_id: {thread_id}")
+    return deleted_count
 
 
 async def delete_checkpoints_batch(thread_ids: List[str]) -> int:
@@ -119,19 +316,15 @@ async def delete_checkpoints_batch(thread_ids: List[str]) -> int:
     if not thread_ids:
         return 0
     
-    db_path = get_checkpoint_db_path()
+    placeholders = ",".join("?" * len(thread_ids))
+    deleted_count = await CheckpointStore.execute(
+        f"DELETE FROM checkpoints WHERE thread_id IN ({placeholders})",
+        thread_ids
+    )
+    await CheckpointStore.execute(f"DELETE FROM writes WHERE thread_id IN ({placeholders})", thread_ids)
     
-    async with aiosqlite.connect(db_path) as conn:
-        placeholders = ",".join("?" * len(thread_ids))
-        cursor = await conn.execute(
-            f"DELETE FROM checkpoints WHERE thread_id IN ({placeholders})",
-            thread_ids
-        )
-        deleted_count = cursor.rowcount
-        await conn.commit()
-        
-        logger.info(f"Batch deleted {deleted_count} checkpoints for {len(thread_ids)} thread_ids")
-        return deleted_count
+    logger.info(f"Batch deleted {deleted_count} checkpoints for {len(thread_ids)} thread_ids")
+    return deleted_count
 
 
 async def check_history_exists(thread_id: str) -> bool:
@@ -144,19 +337,15 @@ async def check_history_exists(thread_id: str) -> bool:
     Returns:
         是否存在历史记录
     """
-    db_path = get_checkpoint_db_path()
+    rows = await CheckpointStore.execute(
+        "SELECT 1 FROM checkpoints WHERE thread_id = ? LIMIT 1",
+        (thread_id,),
+        fetch=True
+    )
     
-    async with aiosqlite.connect(db_path) as conn:
-        cursor = await conn.execute(
-            "SELECT COUNT(*) FROM checkpoints WHERE thread_id = ?",
-            (thread_id,)
-        )
-        row = await cursor.fetchone()
-        count = row[0] if row else 0
-        
-        exists = count > 0
-        logger.debug(f"Thread {thread_id} has {count} checkpoints (exists: {exists})")
-        return exists
+    exists = len(rows) > 0
+    logger.debug(f"Thread {thread_id} has checkpoints: {exists}")
+    return exists
 
 
 async def get_thread_ids_by_prefix(prefix: str) -> List[str]:
@@ -170,18 +359,15 @@ async def get_thread_ids_by_prefix(prefix: str) -> List[str]:
     Returns:
         thread_id列表
     """
-    db_path = get_checkpoint_db_path()
+    rows = await CheckpointStore.execute(
+        "SELECT DISTINCT thread_id FROM checkpoints WHERE thread_id LIKE ?",
+        (f"{prefix}%",),
+        fetch=True
+    )
+    thread_ids = [row[0] for row in rows]
     
-    async with aiosqlite.connect(db_path) as conn:
-        cursor = await conn.execute(
-            "SELECT DISTINCT thread_id FROM checkpoints WHERE thread_id LIKE ?",
-            (f"{prefix}%",)
-        )
-        rows = await cursor.fetchall()
-        thread_ids = [row[0] for row in rows]
-        
-        logger.debug(f"Found {len(thread_ids)} thread_ids with prefix: {prefix}")
-        return thread_ids
+    logger.debug(f"Found {len(thread_ids)} thread_ids with prefix: {prefix}")
+    return thread_ids
 
 
 async def get_checkpoint_stats() -> dict:
@@ -193,31 +379,29 @@ async def get_checkpoint_stats() -> dict:
     """
     db_path = get_checkpoint_db_path()
     
-    async with aiosqlite.connect(db_path) as conn:
-        # 总记录数
-        cursor = await conn.execute("SELECT COUNT(*) FROM checkpoints")
-        row = await cursor.fetchone()
-        total_checkpoints = row[0] if row else 0
-        
-        # 唯一thread数
-        cursor = await conn.execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints")
-        row = await cursor.fetchone()
-        unique_threads = row[0] if row else 0
-        
-        # 数据库文件大小
-        db_file = Path(db_path)
-        file_size = db_file.stat().st_size if db_file.exists() else 0
-        
-        stats = {
-            "total_checkpoints": total_checkpoints,
-            "unique_threads": unique_threads,
-            "database_size_bytes": file_size,
-            "database_size_mb": round(file_size / (1024 * 1024), 2),
-            "database_path": db_path
-        }
-        
-        logger.info(f"Checkpoint stats: {stats}")
-        return stats
+    # 总记录数
+    rows = await CheckpointStore.execute("SELECT COUNT(*) FROM checkpoints", fetch=True)
+    total_checkpoints = rows[0][0] if rows else 0
+    
+    # 唯一thread数
+    rows = await CheckpointStore.execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints", fetch=True)
+    unique_threads = rows[0][0] if rows else 0
+    
+    # 数据库文件大小，包括还没有合并到主文件的 WAL
+    file_size = sum(
+        Path(path).stat().st_size for path in (db_path, f"{db_path}-wal") if Path(path).exists()
+    )
+    
+    stats = {
+        "total_checkpoints": total_checkpoints,
+        "unique_threads": unique_threads,
+        "database_size_bytes": file_size,
+        "database_size_mb": round(file_size / (1024 * 1024), 2),
+        "database_path": db_path
+    }
+    
+    logger.info(f"Checkpoint stats: {stats}")
+    return stats
 
 
 def cleanup_old_checkpoints(days: int = 30) -> int:
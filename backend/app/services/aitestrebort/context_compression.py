@@ -2,6 +2,8 @@
 上下文压缩模块
 用于管理长对话的上下文，防止超出Token限制
 """
+import re
+import math
 import logging
 from typing import List, Dict, Optional, Any
 from dataclasses import dataclass
@@ -9,6 +11,9 @@ from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, System
 
 logger = logging.getLogger(__name__)
 
+# 中日韩文字及全角标点，估算时按1个Token计
+CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
 
 @dataclass
 class CompressionSettings:
@@ -19,45 +24,116 @@ class CompressionSettings:
     summary_max_tokens: int = 2000  # 摘要的最大Token数
 
 
+class TokenCounter:
+    """
+    Token计数器
+    使用与模型系列匹配的本地分词器（tiktoken）计数，分词器不可用时（未安装、离线加载不到词表）按字符估算：
+    中日韩文字1个字符1个Token，其他字符4个字符1个Token
+    """
+    # 模型名称前缀 -> tiktoken 编码，按顺序匹配
+    # 其他模型系列（DeepSeek、通义千问、GLM、Claude等）没有公开的 tiktoken 词表，使用词表大小最接近的 o200k_base
+    model_encodings = [
+        (("gpt-4o", "gpt-4.1", "gpt-4.5", "gpt-5", "o1", "o3", "o4"), "o200k_base"),
+        (("gpt-4", "gpt-3.5", "text-embedding"), "cl100k_base"),
+    ]
+    default_encoding = "o200k_base"
+    heuristic_encoding = "heuristic"
+    message_overhead = 4  # 每条消息的角色、分隔符等固定开销
+    _encoding_dict: Dict[str, Any] = {}  # {编码名称: 分词器，加载失败为 None，不再重复加载}
+
+    def __init__(self, model_name: Optional[str] = None, load_encoding: bool = True):
+        """
+        Args:
+            model_name: 模型名称
+            load_encoding: 分词器还没有加载时是否加载，第一次加载可能需要下载词表，为 False 时直接按字符估算
+        """
+        encoding_name = self.get_encoding_name(model_name)
+        if load_encoding or encoding_name in self._encoding_dict:
+            self.encoding = self.load_encoding(encoding_name)
+        else:
+            self.encoding = None
+        self.encoding_name = encoding_name if self.encoding is not None else self.heuristic_encoding
+
+    @classmethod
+    def get_encoding_name(cls, model_name: Optional[str]) -> str:
+        model_name = (model_name or "").lower().rsplit("/", 1)[-1]  # 去掉 openai/ 之类的前缀
+        for prefix_list, encoding_name in cls.model_encodings:
+            if model_name.startswith(prefix_list):
+                return encoding_name
+        return cls.default_encoding
+
+    @classmethod
+    def load_encoding(cls, encoding_name: str):
+        if encoding_name not in cls._encoding_dict:
+            try:
+                import tiktoken
+                cls._encoding_dict[encoding_name] = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                logger.warning(f"加载分词器 {encoding_name} 失败，按字符数估算Token: {e}")
+                cls._encoding_dict[encoding_name] = None
+        return cls._encoding_dict[encoding_name]
+
+    @staticmethod
+    def get_text(content) -> str:
+        """ 消息内容转为文本，多模态消息只取文本部分 """
+        if isinstance(content, str):
+            return content
+        return "".join(
+            item if isinstance(item, str) else item.get("text", "")
+            for item in content or [] if isinstance(item, (str, dict))
+        )
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        cjk_count = len(CJK_PATTERN.findall(text))
+        return cjk_count + math.ceil((len(text) - cjk_count) / 4)
+
+    def count_message(self, message: BaseMessage) -> int:
+        """ 单条消息的Token数，计数结果缓存在消息的 additional_kwargs 中，分词器相同时不再重复计数 """
+        kwargs = message.additional_kwargs
+        if kwargs.get("token_encoding") != self.encoding_name or "token_count" not in kwargs:
+            kwargs["token_count"] = self.count_text(self.get_text(message.content))
+            kwargs["token_encoding"] = self.encoding_name
+        return kwargs["token_count"] + self.message_overhead
+
+
 class ConversationCompressor:
     """
     对话压缩器
     当对话历史接近Token限制时，自动压缩旧消息为摘要
     """
     
-    def __init__(self, settings: CompressionSettings, llm=None):
+    def __init__(self, settings: CompressionSettings, llm=None, token_counter: Optional[TokenCounter] = None):
         """
         初始化压缩器
         
         Args:
             settings: 压缩配置
             llm: LLM实例，用于生成摘要
+            token_counter: Token计数器，不传则按 llm 的模型创建
         """
         self.settings = settings
         self.llm = llm
-        self._token_counter = None
+        self._token_counter = token_counter or TokenCounter(getattr(llm, "model_name", None))
     
     def estimate_tokens(self, messages: List[BaseMessage]) -> int:
         """
-        估算消息列表的Token数量
-        使用简单的字符数估算：中文约1.5字符/token，英文约4字符/token
+        计算消息列表的Token数量
+        使用模型对应的分词器计数，每条消息的计数结果会缓存，重复计算时只计数新增的消息
         
         Args:
             messages: 消息列表
             
         Returns:
-            估算的Token数量
+            Token数量
         """
-        total_chars = 0
-        for msg in messages:
-            content = msg.content if hasattr(msg, 'content') else str(msg)
-            total_chars += len(content)
-        
-        # 简单估算：平均2字符/token
-        estimated_tokens = total_chars // 2
+        total_tokens = sum(self._token_counter.count_message(msg) for msg in messages)
         
-        logger.debug(f"Estimated tokens: {estimated_tokens} (from {total_chars} chars)")
-        return estimated_tokens
+        logger.debug(f"Counted tokens: {total_tokens} ({self._token_counter.encoding_name})")
+        return total_tokens
     
     def should_compress(self, messages: List[BaseMessage]) -> bool:
         """
@@ -255,7 +331,8 @@ def create_compressor(
     llm=None,
     max_context_tokens: int = 128000,
     trigger_ratio: float = 0.6,
-    preserve_recent_messages: int = 8
+    preserve_recent_messages: int = 8,
+    token_counter: Optional[TokenCounter] = None
 ) -> ConversationCompressor:
     """
     创建对话压缩器的工厂函数
@@ -265,6 +342,7 @@ def create_compressor(
         max_context_tokens: 最大上下文Token数
         trigger_ratio: 触发压缩的比例
         preserve_recent_messages: 保留最近的消息数量
+        token_counter: Token计数器
         
     Returns:
         ConversationCompressor实例
@@ -275,4 +353,4 @@ def create_compressor(
         preserve_recent_messages=preserve_recent_messages
     )
     
-    return ConversationCompressor(settings, llm)
+    return ConversationCompressor(settings, llm, token_counter)
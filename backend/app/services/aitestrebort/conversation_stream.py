@@ -20,8 +20,9 @@ from app.models.aitestrebort.project import (
 )
 
 # 导入上下文压缩和checkpointer
-from .context_compression import create_compressor
+from .context_compression import create_compressor, TokenCounter
 from .checkpointer import get_async_checkpointer
+from utils.util.executor_util import ExecutorService
 
 logger = logging.getLogger(__name__)
 
@@ -133,6 +134,12 @@ async def send_message_stream(request: Request, conversation_id: int, message_da
                 })
                 return
             
+            # Token计数器，第一次使用时加载分词器词表，加载不了则按字符估算
+            try:
+                token_counter = await ExecutorService.run(TokenCounter, (llm_config.model_name,), timeout=10)
+            except Exception:
+                token_counter = TokenCounter(llm_config.model_name, load_encoding=False)
+            
             # 加载历史消息
             use_checkpointer = message_data.get('use_checkpointer', False)  # 默认禁用checkpointer
             
@@ -187,30 +194,31 @@ async def send_message_stream(request: Request, conversation_id: int, message_da
                                         messages.extend(history_messages)
                                     else:
                                         logger.info("No history in checkpointer, loading from database")
-                                        await _load_messages_from_db(conversation, messages)
+                                        await _load_messages_from_db(conversation, messages, token_counter)
                                 else:
-                                    await _load_messages_from_db(conversation, messages)
+                                    await _load_messages_from_db(conversation, messages, token_counter)
                             else:
                                 logger.info("No checkpoint found, loading from database")
-                                await _load_messages_from_db(conversation, messages)
+                                await _load_messages_from_db(conversation, messages, token_counter)
                         except AttributeError as e:
                             # 处理 'Connection' object has no attribute 'is_alive' 错误
                             logger.warning(f"Checkpointer attribute error: {e}, loading from database")
-                            await _load_messages_from_db(conversation, messages)
+                            await _load_messages_from_db(conversation, messages, token_counter)
                             
                 except Exception as e:
                     logger.warning(f"Failed to load from checkpointer: {e}, falling back to database")
-                    await _load_messages_from_db(conversation, messages)
+                    await _load_messages_from_db(conversation, messages, token_counter)
             else:
                 # 直接从数据库加载
-                await _load_messages_from_db(conversation, messages)
+                await _load_messages_from_db(conversation, messages, token_counter)
             
             # 7. 上下文压缩检查
             compressor = create_compressor(
                 llm=llm,
                 max_context_tokens=llm_config.context_limit,
                 trigger_ratio=0.6,
-                preserve_recent_messages=8
+                preserve_recent_messages=8,
+                token_counter=token_counter
             )
             
             # 估算当前token数
@@ -278,7 +286,9 @@ async def send_message_stream(request: Request, conversation_id: int, message_da
             ai_message = await aitestrebortMessage.create(
                 conversation=conversation,
                 role='assistant',
-                content=ai_content
+                content=ai_content,
+                tokens_used=token_counter.count_text(ai_content),
+                metadata={"token_encoding": token_counter.encoding_name}
             )
             
             # 11. 保存到checkpointer（如果启用）
@@ -333,13 +343,15 @@ async def send_message_stream(request: Request, conversation_id: int, message_da
     )
 
 
-async def _load_messages_from_db(conversation, messages):
+async def _load_messages_from_db(conversation, messages, token_counter: TokenCounter = None):
     """
     从数据库加载历史消息的辅助方法
+    消息的Token数保存在 tokens_used 中，分词器相同时直接使用，没有计数过的消息计数后保存
     
     Args:
         conversation: 对话对象
         messages: 消息列表（会被修改）
+        token_counter: Token计数器
     """
     from langchain_core.messages import HumanMessage, AIMessage
     
@@ -347,8 +359,26 @@ async def _load_messages_from_db(conversation, messages):
         conversation=conversation
     ).order_by('create_time').limit(20)
     
+    counted_messages = []
     for msg in history_messages:
         if msg.role == 'user':
-            messages.append(HumanMessage(content=msg.content))
+            message_class = HumanMessage
         elif msg.role == 'assistant':
-            messages.append(AIMessage(content=msg.content))
+            message_class = AIMessage
+        else:
+            continue
+        additional_kwargs = {}
+        if token_counter and msg.tokens_used is not None \
+                and (msg.metadata or {}).get("token_encoding") == token_counter.encoding_name:
+            additional_kwargs = {"token_count": msg.tokens_used, "token_encoding": token_counter.encoding_name}
+        message = message_class(content=msg.content, additional_kwargs=additional_kwargs)
+        messages.append(message)
+        
+        if token_counter and not additional_kwargs:
+            token_counter.count_message(message)
+            msg.tokens_used = message.additional_kwargs["token_count"]
+            msg.metadata = {**(msg.metadata or {}), "token_encoding": token_counter.encoding_name}
+            counted_messages.append(msg)
+    
+    if counted_messages:
+        await aitestrebortMessage.bulk_update(counted_messages, fields=["tokens_used", "metadata"])
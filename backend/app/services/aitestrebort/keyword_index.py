@@ -0,0 +1,179 @@
+"""
+知识库关键词索引
+基于 SQLite FTS5 的倒排索引，BM25 排序，用于向量检索不可用时的降级检索和混合检索的关键词部分
+"""
+import os
+import re
+import sqlite3
+import logging
+from collections import Counter
+from typing import List, Dict, Tuple, Set
+
+from utils.util.file_util import KNOWLEDGE_INDEX_ADDRESS
+
+logger = logging.getLogger(__name__)
+
+# 连续的中文，或连续的英文字母、数字
+TOKEN_PATTERN = re.compile(r'[\u4e00-\u9fff]+|[a-z0-9]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    分词，中文按二元组切分（"接口测试" -> "接口", "口测", "测试"），英文、数字按单词切分并转小写
+    不依赖分词词典，建索引和查询用同一套规则即可匹配
+    """
+    tokens = []
+    for word in TOKEN_PATTERN.findall((text or "").lower()):
+        if len(word) > 1 and '\u4e00' <= word[0] <= '\u9fff':
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+class KeywordIndex:
+    """知识库关键词索引
+
+    - 每个知识库一个 SQLite 文件，存放在 knowledge_index 目录，重启后不需要重建
+    - 文档处理完成时增量写入该文档的分块，文档删除时删除该文档的分块，知识库删除时删除整个文件
+    - 查询只读倒排索引，不再把知识库的所有分块加载到内存中逐个匹配
+    - 超过 max_df_ratio 的分块都包含的词（如测试知识库中的"测试"）区分度很低，查询时忽略，不用给几乎所有分块打分
+      查询的词都很常见时，只在前 max_candidates 个命中的分块中排序
+    - WAL 模式，多个 worker 可以同时读，写入时互相等待
+    """
+    busy_timeout = 30  # 其他 worker 正在写入时的等待时间（秒）
+    max_df_ratio = 0.2
+    max_candidates = 1000
+    schema = """
+        CREATE TABLE IF NOT EXISTS chunk (id INTEGER PRIMARY KEY, chunk_id TEXT UNIQUE, document_id TEXT);
+        CREATE INDEX IF NOT EXISTS chunk_document_id ON chunk (document_id);
+        CREATE VIRTUAL TABLE IF NOT EXISTS chunk_index USING fts5 (tokens);
+        CREATE TABLE IF NOT EXISTS term (term TEXT PRIMARY KEY, df INTEGER) WITHOUT ROWID;
+    """
+
+    def __init__(self, knowledge_base_id: str, index_path: str = KNOWLEDGE_INDEX_ADDRESS):
+        self.knowledge_base_id = str(knowledge_base_id)
+        self.db_path = os.path.join(index_path, f"kb_{self.knowledge_base_id}.db")
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self.schema)
+        return conn
+
+    @staticmethod
+    def _delete_where(conn: sqlite3.Connection, where: str, params: list) -> None:
+        """ 按分块表的条件删除，索引按 rowid 删除，同时减去词的文档数 """
+        row_ids = [row for row in conn.execute(f"SELECT id FROM chunk WHERE {where}", params)]
+        if not row_ids:
+            return
+        df_counter = Counter()
+        for row_id in row_ids:
+            for (tokens,) in conn.execute("SELECT tokens FROM chunk_index WHERE rowid = ?", row_id):
+                df_counter.update(set(tokens.split()))
+        conn.executemany("UPDATE term SET df = df - ? WHERE term = ?", [(df, term) for term, df in df_counter.items()])
+        conn.execute("DELETE FROM term WHERE df <= 0")
+        conn.executemany("DELETE FROM chunk_index WHERE rowid = ?", row_ids)
+        conn.executemany("DELETE FROM chunk WHERE id = ?", row_ids)
+
+    def add_chunks(self, document_id: str, chunks: List[Tuple[str, str]]) -> None:
+        """
+        写入文档的分块，已有的该文档分块先删除
+
+        Args:
+            document_id: 文档ID
+            chunks: [(分块ID, 分块内容)]
+        """
+        conn = self.connect()
+        try:
+            with conn:
+                self._delete_where(conn, "document_id = ?", [str(document_id)])
+                df_counter = Counter()
+                for chunk_id, content in chunks:
+                    self._delete_where(conn, "chunk_id = ?", [str(chunk_id)])
+                    tokens = tokenize(content)
+                    df_counter.update(set(tokens))
+                    row_id = conn.execute(
+                        "INSERT INTO chunk (chunk_id, document_id) VALUES (?, ?)", (str(chunk_id), str(document_id))
+                    ).lastrowid
+                    conn.execute("INSERT INTO chunk_index (rowid, tokens) VALUES (?, ?)", (row_id, " ".join(tokens)))
+                conn.executemany(
+                    "INSERT INTO term (term, df) VALUES (?, ?) ON CONFLICT (term) DO UPDATE SET df = df + excluded.df",
+                    list(df_counter.items())
+                )
+        finally:
+            conn.close()
+        logger.info(f"Indexed {len(chunks)} chunks of document {document_id}")
+
+    def delete_document(self, document_id: str) -> None:
+        """删除文档的所有分块"""
+        if not os.path.exists(self.db_path):
+            return
+        conn = self.connect()
+        try:
+            with conn:
+                self._delete_where(conn, "document_id = ?", [str(document_id)])
+        finally:
+            conn.close()
+
+    def delete_chunks(self, chunk_ids: List[str]) -> None:
+        """按分块ID删除"""
+        conn = self.connect()
+        try:
+            with conn:
+                for chunk_id in chunk_ids:
+                    self._delete_where(conn, "chunk_id = ?", [chunk_id])
+        finally:
+            conn.close()
+
+    def drop(self) -> None:
+        """删除整个索引，知识库删除时调用"""
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def get_chunk_ids(self) -> Set[str]:
+        """获取索引中所有分块的ID，用于和数据库中的分块对比"""
+        conn = self.connect()
+        try:
+            return {row[0] for row in conn.execute("SELECT chunk_id FROM chunk")}
+        finally:
+            conn.close()
+
+    def get_query_tokens(self, conn: sqlite3.Connection, tokens: Set[str]) -> Tuple[List[str], bool]:
+        """ 去掉区分度太低的词，返回 (查询的词, 是否都是常见词) """
+        total = conn.execute("SELECT count(*) FROM chunk").fetchone()[0]
+        df_dict = dict(conn.execute(
+            f"SELECT term, df FROM term WHERE term IN ({','.join('?' * len(tokens))})", list(tokens)))
+        query_tokens = [token for token, df in df_dict.items() if df <= total * self.max_df_ratio]
+        return (query_tokens, False) if query_tokens else (list(df_dict), True)
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict[str, float]]:
+        """
+        BM25 检索
+
+        Args:
+            query: 查询文本
+            top_k: 返回结果数量
+
+        Returns:
+            [{"chunk_id": 分块ID, "score": BM25分数}]，按分数从高到低
+        """
+        tokens = set(tokenize(query))
+        if not tokens or not os.path.exists(self.db_path):
+            return []
+        conn = self.connect()
+        try:
+            query_tokens, all_common = self.get_query_tokens(conn, tokens)
+            if not query_tokens:
+                return []
+            hit_sql = "SELECT rowid, bm25(chunk_index) AS rank FROM chunk_index WHERE chunk_index MATCH ?"
+            hit_sql += " LIMIT ?" if all_common else " ORDER BY rank LIMIT ?"
+            rows = conn.execute(
+                f"SELECT chunk.chunk_id, hit.rank FROM ({hit_sql}) AS hit "
+                f"JOIN chunk ON chunk.id = hit.rowid ORDER BY hit.rank LIMIT ?",
+                (" OR ".join(f'"{token}"' for token in query_tokens), self.max_candidates if all_common else top_k, top_k)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [{"chunk_id": chunk_id, "score": -rank} for chunk_id, rank in rows]  # bm25() 越小越相关
@@ -4,6 +4,7 @@ aitestrebort 知识库管理服务
 """
 import os
 import time
+import asyncio
 import logging
 from typing import Optional, List, Dict, Any
 from fastapi import Request, Depends, UploadFile, File
@@ -16,6 +17,8 @@ from app.models.aitestrebort.knowledge import (
     aitestrebortKnowledgeQuery, aitestrebortKnowledgeConfig
 )
 from .vector_store import VectorStoreManager, KnowledgeBaseService, DocumentProcessor
+from .qdrant_manager import QdrantManager
+from .keyword_index import KeywordIndex
 from utils.logs.log import logger
 
 
@@ -384,6 +387,10 @@ async def delete_knowledge_base(request: Request, project_id: int, kb_id: str):
         # 获取知识库
         kb = await aitestrebortKnowledgeBase.get(id=kb_id, project=project)
         
+        # 删除向量集合
+        await asyncio.to_thread(QdrantManager.from_collection(f"kb_{kb.id}").drop_collection)
+        await asyncio.to_thread(KeywordIndex(str(kb.id)).drop)
+        
         # 删除知识库（级联删除文档和分块）
         await kb.delete()
         
@@ -656,6 +663,7 @@ async def query_knowledge_base(request: Request, project_id: int, kb_id: str, qu
         top_k = query_data.get('top_k', 5)
         score_threshold = query_data.get('score_threshold', 0.3)
         use_rag = query_data.get('use_rag', False)  # 是否使用 RAG 生成回答
+        hybrid = query_data.get('hybrid')  # 是否使用混合检索，不传则按 knowledge_search_conf 配置
         
         if not query_text:
             return request.app.fail(msg="查询内容不能为空")
@@ -760,7 +768,8 @@ async def query_knowledge_base(request: Request, project_id: int, kb_id: str, qu
                 score_threshold=score_threshold,
                 system_prompt=query_data.get('system_prompt'),
                 prompt_template=query_data.get('prompt_template', 'default'),
-                llm_config=llm_config
+                llm_config=llm_config,
+                hybrid=hybrid
             )
             
             # 保存查询日志
@@ -797,7 +806,8 @@ async def query_knowledge_base(request: Request, project_id: int, kb_id: str, qu
             search_results = await kb_service.search_knowledge(
                 query=query_text,
                 top_k=top_k,
-                score_threshold=score_threshold
+                score_threshold=score_threshold,
+                hybrid=hybrid
             )
             logger.info(f"Search completed, found {len(search_results)} results")
             
@@ -1076,7 +1086,9 @@ async def delete_document(request: Request, project_id: int, kb_id: str, doc_id:
         if doc.file_path and os.path.exists(doc.file_path):
             os.remove(doc.file_path)
         
-        # TODO: 从向量存储中删除
+        # 从向量存储中删除
+        await asyncio.to_thread(QdrantManager.from_collection(f"kb_{kb.id}").delete_by_document_id, str(doc.id))
+        await asyncio.to_thread(KeywordIndex(str(kb.id)).delete_document, str(doc.id))
         
         # 删除数据库记录（会级联删除分块）
         await doc.delete()
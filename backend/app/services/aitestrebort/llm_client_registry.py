@@ -0,0 +1,177 @@
+"""
+LLM 客户端注册表
+对话、用例生成、需求评审等共用 ChatOpenAI 实例和 http 连接，不再每次调用都新建
+"""
+import asyncio
+import hashlib
+import logging
+import time
+import weakref
+from typing import Dict, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI
+from tortoise.signals import post_save, post_delete
+
+from app.models.aitestrebort.project import aitestrebortLLMConfig
+
+logger = logging.getLogger(__name__)
+
+
+class LLMClientRegistry:
+    """ LLM 客户端注册表
+    - 按 (配置ID, 配置版本, 温度) 缓存 ChatOpenAI 实例，同一配置的后续调用直接复用，不再重复清理密钥、地址和打印日志
+    - 配置版本取配置的修改时间和连接参数，配置修改后版本变化，旧版本的实例立即移除；配置保存、删除时也会主动失效
+    - 同一个 base_url 的实例共用 http 连接池，连接保持 keepalive_expiry 秒，对话时不用重新建立连接、TLS握手
+    - 空闲超过 idle_timeout 秒的实例会从缓存中移除，连接池要等所有用到它的实例都被回收后才会关闭，
+      长时间持有实例的调用方（用例生成器、智能体编排）不受影响，配置失效时正在使用旧实例的调用也不受影响
+    """
+    idle_timeout = 600
+    max_connections = 100
+    keepalive_expiry = 120
+    _client_dict: Dict[tuple, list] = {}  # {(配置ID, 配置版本, 温度): [llm, base_url, 最后使用时间]}
+    _http_dict: Dict[str, list] = {}  # {base_url: [同步连接池, 异步连接池, 最后使用时间, [用到连接池的实例的弱引用]]}
+    _close_task_set = set()  # 关闭中的异步连接池，保留引用，避免任务被回收
+    _invalidate_listener_list = []  # 配置保存、删除时还要通知的其他缓存，如 LLMService
+    _loop = None
+
+    @classmethod
+    def configure(cls, idle_timeout=600, max_connections=100, keepalive_expiry=120, **kwargs):
+        cls.idle_timeout, cls.max_connections, cls.keepalive_expiry = \
+            int(idle_timeout), max(int(max_connections), 1), float(keepalive_expiry)
+
+    @staticmethod
+    def get_version(llm_config) -> str:
+        """ 配置版本，修改时间 + 连接参数摘要，通过 update 语句修改的配置不会更新修改时间，连接参数变了也能识别 """
+        params = f'{llm_config.model_name}|{llm_config.api_key}|{llm_config.base_url}'
+        update_time = getattr(llm_config, "update_time", None)
+        return f'{update_time.isoformat() if update_time else ""}:{hashlib.sha256(params.encode()).hexdigest()[:16]}'
+
+    @staticmethod
+    def clean_api_key(api_key):
+        """ 移除密钥可能带有的 Bearer 前缀 """
+        if api_key and api_key.startswith("Bearer "):
+            logger.warning(f"API密钥包含'Bearer '前缀，已自动移除")
+            return api_key[7:].strip()
+        return api_key
+
+    @staticmethod
+    def clean_base_url(base_url):
+        """ 移除 base_url 可能带有的端点路径，并确保以 /v1 结尾（OpenAI兼容API通常需要，DeepSeek也需要） """
+        if not base_url:
+            return base_url
+        original_base_url = base_url
+        for endpoint in ['/chat/completions', '/v1/chat/completions', '/completions']:
+            if base_url.endswith(endpoint):
+                base_url = base_url[:-len(endpoint)]
+                logger.warning(f"base_url包含端点路径'{endpoint}'，已自动移除。原URL: {original_base_url}, 新URL: {base_url}")
+                break
+        if not base_url.endswith('/v1') and not base_url.endswith('/compatible-mode/v1'):
+            base_url = base_url.rstrip('/') + '/v1'
+            logger.info(f"base_url已自动添加/v1路径: {original_base_url} -> {base_url}")
+        return base_url
+
+    @classmethod
+    def check_loop(cls):
+        """ 异步连接池绑定在创建时的事件循环上，事件循环变了则全部重新创建 """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if cls._loop is not loop:
+            if cls._loop is not None:
+                cls._client_dict, cls._http_dict = {}, {}
+            cls._loop = loop
+
+    @classmethod
+    def get_http_clients(cls, base_url) -> Tuple[httpx.Client, httpx.AsyncClient]:
+        if base_url not in cls._http_dict:
+            limits = httpx.Limits(max_connections=cls.max_connections, keepalive_expiry=cls.keepalive_expiry)
+            cls._http_dict[base_url] = [httpx.Client(limits=limits), httpx.AsyncClient(limits=limits), 0, []]
+        return cls._http_dict[base_url][0], cls._http_dict[base_url][1]
+
+    @classmethod
+    def get(cls, llm_config, temperature: float = 0.7) -> ChatOpenAI:
+        """ 获取配置对应的 LLM 实例，没有则创建 """
+        cls.check_loop()
+        cls.evict_idle()
+        key = (getattr(llm_config, "id", None), cls.get_version(llm_config), round(float(temperature), 1))
+        item = cls._client_dict.get(key)
+        if item is None:
+            for old_key in [old for old in cls._client_dict if key[0] is not None and old[0] == key[0] and old[1] != key[1]]:
+                cls._client_dict.pop(old_key)  # 同一配置的旧版本
+            item = cls._client_dict[key] = [*cls.create(llm_config, key[2]), 0]
+        item[2] = cls._http_dict[item[1]][2] = time.monotonic()
+        return item[0]
+
+    @classmethod
+    def create(cls, llm_config, temperature: float) -> Tuple[ChatOpenAI, str]:
+        """ 创建 LLM 实例，统一使用OpenAI兼容格式，返回 (实例, base_url) """
+        model_identifier = llm_config.model_name or "gpt-3.5-turbo"
+        api_key, base_url = cls.clean_api_key(llm_config.api_key), cls.clean_base_url(llm_config.base_url)
+        http_client, http_async_client = cls.get_http_clients(base_url)
+        logger.info(f"创建LLM实例 - 模型: {model_identifier}, base_url: {base_url}, 温度: {temperature}")
+        llm = ChatOpenAI(
+            model=model_identifier,
+            temperature=temperature,
+            api_key=api_key,
+            base_url=base_url,
+            http_client=http_client,
+            http_async_client=http_async_client
+        )
+        cls._http_dict[base_url][3].append(weakref.ref(llm))
+        return llm, base_url
+
+    @classmethod
+    def add_invalidate_listener(cls, listener):
+        """ 注册配置保存、删除时的回调，参数为配置ID """
+        cls._invalidate_listener_list.append(listener)
+
+    @classmethod
+    def invalidate(cls, config_id):
+        """ 移除配置的所有实例，配置修改、删除时调用，连接池空闲超时后再关闭，不影响正在进行的调用 """
+        for key in [key for key in cls._client_dict if key[0] == config_id]:
+            cls._client_dict.pop(key)
+        for listener in cls._invalidate_listener_list:
+            listener(config_id)
+
+    @classmethod
+    def evict_idle(cls):
+        """ 移除空闲超时的实例，关闭空闲超时且用到它的实例都已被回收的连接池
+        实例从缓存中移除后，调用方可能还持有并继续使用，所以不能按缓存判断连接池是否还在用
+        """
+        expire_time = time.monotonic() - cls.idle_timeout
+        for key in [key for key, item in cls._client_dict.items() if item[2] < expire_time]:
+            cls._client_dict.pop(key)
+        for base_url, item in list(cls._http_dict.items()):
+            item[3] = [llm_ref for llm_ref in item[3] if llm_ref() is not None]
+            if not item[3] and item[2] < expire_time:
+                cls.close_http_clients(*cls._http_dict.pop(base_url)[:2])
+
+    @classmethod
+    def close_http_clients(cls, http_client, http_async_client):
+        http_client.close()
+        try:
+            task = asyncio.get_running_loop().create_task(http_async_client.aclose())
+        except RuntimeError:
+            return  # 没有运行中的事件循环，连接随对象回收
+        cls._close_task_set.add(task)
+        task.add_done_callback(cls._close_task_set.discard)
+
+    @classmethod
+    async def close_all(cls):
+        """ 服务关闭时释放所有连接 """
+        http_dict, cls._client_dict, cls._http_dict = cls._http_dict, {}, {}
+        for http_client, http_async_client, _, _ in http_dict.values():
+            http_client.close()
+            await http_async_client.aclose()
+
+
+@post_save(aitestrebortLLMConfig)
+async def on_llm_config_save(sender, instance, created, using_db, update_fields):
+    LLMClientRegistry.invalidate(instance.id)
+
+
+@post_delete(aitestrebortLLMConfig)
+async def on_llm_config_delete(sender, instance, using_db):
+    LLMClientRegistry.invalidate(instance.id)
@@ -6,6 +6,8 @@ import asyncio
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 
+from tortoise.expressions import F
+
 from app.models.aitestrebort.orchestrator import (
     OrchestratorTask, AgentTask, AgentStep, AgentBlackboard
 )
@@ -19,6 +21,7 @@ from app.schemas.aitestrebort.orchestrator import (
     BlackboardUpdateRequest, BlackboardQueryRequest, BlackboardQueryResponse,
     BatchTaskUpdateRequest, TaskProgressResponse
 )
+from app.tools.db_compatibility import DatabaseCompatibility
 
 logger = logging.getLogger(__name__)
 
@@ -109,6 +112,7 @@ class OrchestratorService:
             # 更新任务状态
             await OrchestratorTask.filter(id=task_id).update(
                 status="executing",
+                current_step=0,
                 started_at=datetime.now()
             )
             
@@ -130,189 +134,158 @@ class OrchestratorService:
             logger.error(f"Execute orchestrator task failed: {e}")
             raise
     
+    # 任务步骤及其依赖的步骤，依赖都完成的步骤立即开始，相互没有依赖的步骤并发执行
+    TASK_STEPS = [
+        {"step": 1, "name": "需求分析", "depends": []},
+        {"step": 2, "name": "知识库检索", "depends": []},
+        {"step": 3, "name": "生成执行计划", "depends": [1, 2]},
+        {"step": 4, "name": "执行任务", "depends": []},
+        {"step": 5, "name": "生成结果", "depends": [3, 4]},
+    ]
+
+    @staticmethod
+    async def run_task_graph(steps: List[Dict[str, Any]], run_step, on_event=None) -> Dict[int, Any]:
+        """
+        按依赖关系执行步骤
+
+        Args:
+            steps: [{"step": 步骤编号, "name": 步骤名称, "depends": [依赖的步骤编号]}]
+            run_step: async (step, inputs) -> 步骤结果，inputs 为 {依赖的步骤编号: 步骤结果}
+            on_event: async (step, status, result) -> None，步骤开始、完成、失败时调用，status: running/completed/failed
+
+        Returns:
+            {步骤编号: 步骤结果}，任一步骤失败则取消其余步骤并抛出该步骤的异常
+        """
+        step_dict = {step["step"]: step for step in steps}
+        for step in steps:
+            for depend in step["depends"]:
+                if depend not in step_dict:
+                    raise ValueError(f"步骤 {step['step']} 依赖的步骤 {depend} 不存在")
+        visited, stack = set(), []
+
+        def check_cycle(step_id):
+            if step_id in stack:
+                raise ValueError(f"步骤之间存在循环依赖: {stack[stack.index(step_id):] + [step_id]}")
+            if step_id not in visited:
+                stack.append(step_id)
+                for depend_id in step_dict[step_id]["depends"]:
+                    check_cycle(depend_id)
+                stack.pop()
+                visited.add(step_id)
+
+        for step_id in step_dict:
+            check_cycle(step_id)
+
+        async def run(step):
+            inputs = {depend: await tasks[depend] for depend in step["depends"]}
+            if on_event:
+                await on_event(step, "running", None)
+            try:
+                result = await run_step(step, inputs)
+            except Exception as e:
+                if on_event:
+                    await on_event(step, "failed", str(e))
+                raise
+            if on_event:
+                await on_event(step, "completed", result)
+            return result
+
+        tasks = {step_id: asyncio.create_task(run(step)) for step_id, step in step_dict.items()}
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return {step_id: task.result() for step_id, task in tasks.items()}
+
+    @staticmethod
+    async def _run_task_step(task: OrchestratorTask, llm_service, step: Dict[str, Any], inputs: Dict[int, Any]):
+        """执行单个步骤，返回 (需要更新到任务上的字段, 结果说明)"""
+        match step["step"]:
+            case 1:
+                requirement_analysis = await llm_service.analyze_requirement(task.requirement)
+                return {"requirement_analysis": requirement_analysis}, "需求分析完成"
+            case 2:
+                # 模拟知识库检索
+                knowledge_docs = [
+                    {
+                        "title": "相关技术文档",
+                        "type": "技术规范",
+                        "relevance": 0.85,
+                        "content": "相关的技术实现说明"
+                    }
+                ]
+                return {"knowledge_docs": knowledge_docs}, f"检索到{len(knowledge_docs)}个相关文档"
+            case 3:
+                name_dict = {item["step"]: item["name"] for item in OrchestratorService.TASK_STEPS}
+                execution_plan = {
+                    "steps": [
+                        {
+                            "name": item["name"],
+                            "depends": [name_dict[depend] for depend in item["depends"]],
+                            "status": "completed" if item["step"] in inputs else
+                            "running" if item["step"] == step["step"] else "pending"
+                        }
+                        for item in OrchestratorService.TASK_STEPS
+                    ],
+                    "estimated_time": "10-15分钟"
+                }
+                return {"execution_plan": execution_plan}, "执行计划生成完成"
+            case 4:
+                # 使用AI生成测试用例
+                test_cases = await llm_service.generate_test_cases(task.requirement)
+                return {"testcases": test_cases}, f"生成了{len(test_cases)}个测试用例"
+            case _:
+                return {}, "任务执行完成"
+
+    @staticmethod
+    async def _append_task_history(task_id: int, *records: Dict[str, Any]):
+        """追加执行历史，只写入新增的记录"""
+        await DatabaseCompatibility.append_json_array(
+            OrchestratorTask._meta.db_table, "execution_history", task_id, list(records))
+
     @staticmethod
     async def _execute_task_async(
         task_id: int,
         execution_request: TaskExecutionRequest
     ):
-        """异步执行任务"""
+        """异步执行任务，按 TASK_STEPS 的依赖关系执行，总耗时取决于最长的依赖链"""
         try:
             task = await OrchestratorTask.get(id=task_id)
-            
+
             # 使用AI服务进行需求分析
             from app.services.ai.llm_service import get_llm_service
-            
+
             llm_service = await get_llm_service()
-            
-            # 步骤1: 需求分析
-            await OrchestratorTask.filter(id=task_id).update(
-                current_step=1,
-                execution_history=task.execution_history + [
-                    {
-                        "step": 1,
-                        "name": "需求分析",
-                        "status": "running",
-                        "timestamp": datetime.now().isoformat()
-                    }
-                ]
-            )
-            
-            # 使用AI分析需求
-            requirement_analysis = await llm_service.analyze_requirement(task.requirement)
-            
-            await OrchestratorTask.filter(id=task_id).update(
-                requirement_analysis=requirement_analysis,
-                execution_history=task.execution_history + [
-                    {
-                        "step": 1,
-                        "name": "需求分析",
-                        "status": "completed",
-                        "timestamp": datetime.now().isoformat(),
-                        "result": "需求分析完成"
-                    }
-                ]
-            )
-            
-            await asyncio.sleep(2)
-            
-            # 步骤2: 知识库检索
-            await OrchestratorTask.filter(id=task_id).update(
-                current_step=2,
-                execution_history=task.execution_history + [
-                    {
-                        "step": 2,
-                        "name": "知识库检索",
-                        "status": "running",
-                        "timestamp": datetime.now().isoformat()
-                    }
-                ]
-            )
-            
-            # 模拟知识库检索
-            knowledge_docs = [
-                {
-                    "title": "相关技术文档",
-                    "type": "技术规范",
-                    "relevance": 0.85,
-                    "content": "相关的技术实现说明"
+
+            async def run_step(step, inputs):
+                return await OrchestratorService._run_task_step(task, llm_service, step, inputs)
+
+            async def on_event(step, status, result):
+                record = {
+                    "step": step["step"],
+                    "name": step["name"],
+                    "status": status,
+                    "timestamp": datetime.now().isoformat()
                 }
-            ]
-            
-            await OrchestratorTask.filter(id=task_id).update(
-                knowledge_docs=knowledge_docs,
-                execution_history=task.execution_history + [
-                    {
-                        "step": 2,
-                        "name": "知识库检索",
-                        "status": "completed",
-                        "timestamp": datetime.now().isoformat(),
-                        "result": f"检索到{len(knowledge_docs)}个相关文档"
-                    }
-                ]
-            )
-            
-            await asyncio.sleep(2)
-            
-            # 步骤3: 生成执行计划
-            await OrchestratorTask.filter(id=task_id).update(
-                current_step=3,
-                execution_history=task.execution_history + [
-                    {
-                        "step": 3,
-                        "name": "生成执行计划",
-                        "status": "running",
-                        "timestamp": datetime.now().isoformat()
-                    }
-                ]
-            )
-            
-            execution_plan = {
-                "steps": [
-                    {"name": "需求分析", "status": "completed"},
-                    {"name": "知识库检索", "status": "completed"},
-                    {"name": "生成执行计划", "status": "running"},
-                    {"name": "执行任务", "status": "pending"},
-                    {"name": "生成结果", "status": "pending"}
-                ],
-                "estimated_time": "10-15分钟"
-            }
-            
-            await OrchestratorTask.filter(id=task_id).update(
-                execution_plan=execution_plan,
-                execution_history=task.execution_history + [
-                    {
-                        "step": 3,
-                        "name": "生成执行计划",
-                        "status": "completed",
-                        "timestamp": datetime.now().isoformat(),
-                        "result": "执行计划生成完成"
-                    }
-                ]
-            )
-            
-            await asyncio.sleep(2)
-            
-            # 步骤4: 执行任务（生成测试用例）
-            await OrchestratorTask.filter(id=task_id).update(
-                current_step=4,
-                execution_history=task.execution_history + [
-                    {
-                        "step": 4,
-                        "name": "执行任务",
-                        "status": "running",
-                        "timestamp": datetime.now().isoformat()
-                    }
-                ]
-            )
-            
-            # 使用AI生成测试用例
-            test_cases = await llm_service.generate_test_cases(task.requirement)
-            
-            await OrchestratorTask.filter(id=task_id).update(
-                testcases=test_cases,
-                execution_history=task.execution_history + [
-                    {
-                        "step": 4,
-                        "name": "执行任务",
-                        "status": "completed",
-                        "timestamp": datetime.now().isoformat(),
-                        "result": f"生成了{len(test_cases)}个测试用例"
-                    }
-                ]
-            )
-            
-            await asyncio.sleep(2)
-            
-            # 步骤5: 生成结果
-            await OrchestratorTask.filter(id=task_id).update(
-                current_step=5,
-                execution_history=task.execution_history + [
-                    {
-                        "step": 5,
-                        "name": "生成结果",
-                        "status": "running",
-                        "timestamp": datetime.now().isoformat()
-                    }
-                ]
-            )
-            
-            await asyncio.sleep(1)
-            
-            # 完成任务
-            await OrchestratorTask.filter(id=task_id).update(
+                if status == "completed":
+                    fields, record["result"] = result
+                    # 已完成的步骤数作为当前步骤
+                    await OrchestratorTask.filter(id=task_id).update(current_step=F("current_step") + 1, **fields)
+                elif status == "failed":
+                    record["error"] = result
+                await OrchestratorService._append_task_history(task_id, record)
+
+            await OrchestratorService.run_task_graph(OrchestratorService.TASK_STEPS, run_step, on_event)
+
+            # 完成任务，执行过程中被取消的保持取消状态
+            await OrchestratorTask.filter(id=task_id, status="executing").update(
                 status="completed",
-                completed_at=datetime.now(),
-                execution_history=task.execution_history + [
-                    {
-                        "step": 5,
-                        "name": "生成结果",
-                        "status": "completed",
-                        "timestamp": datetime.now().isoformat(),
-                        "result": "任务执行完成"
-                    }
-                ]
+                completed_at=datetime.now()
             )
-            
+
         except Exception as e:
             logger.error(f"Execute task async failed: {e}")
             await OrchestratorTask.filter(id=task_id).update(
@@ -343,7 +316,9 @@ class OrchestratorService:
             }
             
             progress = progress_map.get(task.status, 0.0)
-            total_steps = 5  # 总步骤数
+            total_steps = len(OrchestratorService.TASK_STEPS)  # 总步骤数
+            if task.status == "executing":  # 按已完成的步骤数计算
+                progress = round(task.current_step * 100 / total_steps, 1)
             
             # 估算剩余时间
             estimated_time = None
@@ -358,7 +333,7 @@ class OrchestratorService:
                 current_step=task.current_step,
                 total_steps=total_steps,
                 estimated_time=estimated_time,
-                last_activity=task.updated_at or task.created_at
+                last_activity=task.completed_at or task.started_at or task.created_at
             )
             
         except Exception as e:
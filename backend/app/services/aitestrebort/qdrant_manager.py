@@ -4,8 +4,11 @@ Qdrant 向量数据库管理器
 """
 import os
 import logging
-import hashlib
-from typing import List, Dict, Any, Optional
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Iterator, Set, Tuple
 from qdrant_client import QdrantClient
 from qdrant_client.models import (
     Distance,
@@ -17,11 +20,30 @@ from langchain_qdrant import QdrantVectorStore
 from langchain_core.documents import Document as LangChainDocument
 from langchain.embeddings.base import Embeddings
 
+from utils.util.file_util import QDRANT_ADDRESS
+
 logger = logging.getLogger(__name__)
 
 
 class QdrantManager:
-    """Qdrant 向量数据库管理器"""
+    """Qdrant 向量数据库管理器
+
+    存储模式（按优先级）：
+    1. 远程服务：配置了 QDRANT_URL
+    2. 本地持久化：QDRANT_PATH，默认为 qdrant_data 目录，每个集合单独一个目录，重启后数据不丢失
+       qdrant本地模式同一个目录同一时间只能被一个客户端打开（打开时会把集合全部加载到内存），多个worker之间用文件锁排队，
+       拿到目录的进程保持客户端打开，连续的检索不用重复加载，空闲 idle_release 秒或者占用超过 max_hold 秒后关闭，让给其他worker；
+       多worker部署、检索频繁时建议使用远程服务
+    3. 内存模式：QDRANT_PATH 配置为 :memory:，进程内共用一个客户端，重启后数据丢失（开发测试用）
+    """
+    lock_timeout = 60  # 本地模式等待其他worker释放目录的超时时间（秒）
+    idle_release = 3  # 本地模式客户端空闲多久后关闭（秒）
+    max_hold = 30  # 本地模式一个进程最多连续占用目录多久（秒），超过后用完即关闭
+    _memory_client = None
+    _thread_lock_dict = {}
+    _local_client_dict = {}  # {本地目录: [客户端, 文件锁, 打开时间, 最后使用时间]}
+    _release_thread = None
+    _lock = threading.Lock()
     
     def __init__(
         self,
@@ -29,7 +51,9 @@ class QdrantManager:
         embeddings: Embeddings,
         qdrant_url: Optional[str] = None,
         qdrant_api_key: Optional[str] = None,
-        vector_size: int = 1536  # OpenAI ada-002 默认维度
+        vector_size: int = 1536,  # OpenAI ada-002 默认维度
+        qdrant_path: Optional[str] = None,
+        ensure_collection: bool = True
     ):
         """
         初始化 Qdrant 管理器
@@ -37,13 +61,16 @@ class QdrantManager:
         Args:
             collection_name: 集合名称
             embeddings: 嵌入模型
-            qdrant_url: Qdrant 服务地址（默认使用内存模式）
+            qdrant_url: Qdrant 服务地址
             qdrant_api_key: Qdrant API Key
             vector_size: 向量维度
+            qdrant_path: 本地持久化目录，没有服务地址时使用，为空或 :memory: 则使用内存模式
+            ensure_collection: 是否确保集合存在，只做删除操作时不需要
         """
         self.collection_name = collection_name
         self.embeddings = embeddings
         self.vector_size = vector_size
+        self.client, self.local_path = None, None
         
         # 初始化 Qdrant 客户端
         if qdrant_url:
@@ -54,56 +81,168 @@ class QdrantManager:
                 timeout=60
             )
             logger.info(f"Connected to Qdrant server at {qdrant_url}")
+        elif qdrant_path and qdrant_path != ":memory:":
+            # 使用本地持久化模式，使用时才打开
+            self.local_path = os.path.join(qdrant_path, collection_name)
+            logger.info(f"Using Qdrant local mode at {self.local_path}")
         else:
             # 使用本地内存模式（开发测试用）
-            self.client = QdrantClient(":memory:")
+            self.client = self.get_memory_client()
             logger.info("Using Qdrant in-memory mode")
         
         # 确保集合存在
-        self._ensure_collection()
+        if ensure_collection:
+            self._ensure_collection()
+
+    @classmethod
+    def from_collection(cls, collection_name: str) -> "QdrantManager":
+        """ 只做删除操作时使用，不需要嵌入模型，也不创建集合 """
+        return cls(collection_name, embeddings=None, ensure_collection=False, **cls.get_storage_conf())
+
+    @staticmethod
+    def get_storage_conf() -> Dict[str, Optional[str]]:
+        """ 从环境变量获取存储配置 """
+        return {
+            "qdrant_url": os.getenv('QDRANT_URL', None),
+            "qdrant_api_key": os.getenv('QDRANT_API_KEY', None),
+            "qdrant_path": os.getenv('QDRANT_PATH', QDRANT_ADDRESS)
+        }
+
+    @classmethod
+    def get_memory_client(cls) -> QdrantClient:
+        with cls._lock:
+            if cls._memory_client is None:
+                cls._memory_client = QdrantClient(":memory:")
+            return cls._memory_client
+
+    @property
+    def is_persistent(self) -> bool:
+        return self.local_path is not None or self.client is not self._memory_client
+
+    @contextmanager
+    def get_client(self) -> Iterator[QdrantClient]:
+        """ 获取客户端，本地持久化模式下先拿到目录的锁再打开，用完不立即关闭，由 release_idle_clients 关闭并释放锁 """
+        if self.local_path is None:
+            yield self.client
+            return
+
+        with self.get_thread_lock(self.local_path):
+            item = self._local_client_dict.get(self.local_path)
+            if item is None:
+                import portalocker  # 只有本地模式才需要，portalocker 导入时会检查目录是否可写
+                file_lock = portalocker.Lock(f"{self.local_path}.lock", timeout=self.lock_timeout)
+                file_lock.acquire()
+                try:
+                    client = QdrantClient(path=self.local_path)
+                except Exception:
+                    file_lock.release()
+                    raise
+                item = self._local_client_dict[self.local_path] = [client, file_lock, time.monotonic(), 0]
+                self.start_release_thread()
+            try:
+                yield item[0]
+            finally:
+                item[3] = time.monotonic()
+                if item[3] - item[2] > self.max_hold:  # 占用太久了，让给其他worker
+                    self.close_local_client(self.local_path)
+
+    @classmethod
+    def close_local_client(cls, local_path):
+        """ 关闭本地模式客户端并释放目录的锁，调用时需持有该目录的线程锁 """
+        client, file_lock, _, _ = cls._local_client_dict.pop(local_path)
+        try:
+            client.close()
+        finally:
+            file_lock.release()
+
+    @classmethod
+    def start_release_thread(cls):
+        with cls._lock:
+            if cls._release_thread is None:
+                cls._release_thread = threading.Thread(target=cls.release_idle_clients, daemon=True)
+                cls._release_thread.start()
+
+    @classmethod
+    def release_idle_clients(cls):
+        """ 后台线程，关闭空闲超时的本地模式客户端，没有打开的客户端了就退出 """
+        while True:
+            time.sleep(1)
+            with cls._lock:
+                if not cls._local_client_dict:
+                    cls._release_thread = None
+                    return
+            for local_path in list(cls._local_client_dict):
+                thread_lock = cls.get_thread_lock(local_path)
+                if not thread_lock.acquire(blocking=False):
+                    continue  # 正在使用
+                try:
+                    item = cls._local_client_dict.get(local_path)
+                    if item and time.monotonic() - item[3] > cls.idle_release:
+                        cls.close_local_client(local_path)
+                except Exception as error:
+                    logger.error(f"关闭本地向量库客户端失败: {error}")
+                finally:
+                    thread_lock.release()
+
+    @classmethod
+    def close_all(cls):
+        """ 服务关闭时释放本地模式的目录 """
+        for local_path in list(cls._local_client_dict):
+            with cls.get_thread_lock(local_path):
+                if local_path in cls._local_client_dict:
+                    cls.close_local_client(local_path)
+
+    @classmethod
+    def get_thread_lock(cls, local_path) -> threading.Lock:
+        """ 同一个进程内的多个线程也需要排队，文件锁对同一个进程不互斥 """
+        with cls._lock:
+            return cls._thread_lock_dict.setdefault(local_path, threading.Lock())
     
     def _ensure_collection(self):
         """确保集合存在，不存在则创建"""
         try:
-            # 检查集合是否存在
-            collections = self.client.get_collections().collections
-            collection_names = [col.name for col in collections]
-            
-            if self.collection_name not in collection_names:
-                # 创建集合
-                self.client.create_collection(
-                    collection_name=self.collection_name,
-                    vectors_config=VectorParams(
-                        size=self.vector_size,
-                        distance=Distance.COSINE
+            with self.get_client() as client:
+                if not client.collection_exists(self.collection_name):
+                    # 创建集合
+                    client.create_collection(
+                        collection_name=self.collection_name,
+                        vectors_config=VectorParams(
+                            size=self.vector_size,
+                            distance=Distance.COSINE
+                        )
                     )
-                )
-                logger.info(f"Created collection: {self.collection_name}")
-            else:
-                logger.info(f"Collection already exists: {self.collection_name}")
+                    logger.info(f"Created collection: {self.collection_name}")
+                else:
+                    logger.info(f"Collection already exists: {self.collection_name}")
                 
         except Exception as e:
             logger.error(f"Failed to ensure collection: {e}")
             raise
     
-    def get_vector_store(self) -> QdrantVectorStore:
+    def get_vector_store(self, client: QdrantClient) -> QdrantVectorStore:
         """
         获取 LangChain 的 QdrantVectorStore 实例
         
+        Args:
+            client: 通过 get_client 获取的客户端
+            
         Returns:
             QdrantVectorStore 实例
         """
         return QdrantVectorStore(
-            client=self.client,
+            client=client,
             collection_name=self.collection_name,
-            embedding=self.embeddings
+            embedding=self.embeddings,
+            validate_collection_config=False  # 校验时会调一次嵌入服务，集合由 _ensure_collection 保证
         )
     
     def add_documents(
         self,
         documents: List[LangChainDocument],
         document_id: str,
-        batch_size: int = 100
+        batch_size: int = 100,
+        ids: Optional[List[str]] = None,
+        vectors: Optional[List[List[float]]] = None
     ) -> List[str]:
         """
         添加文档到向量存储
@@ -112,12 +251,13 @@ class QdrantManager:
             documents: LangChain 文档列表
             document_id: 文档ID（用于元数据）
             batch_size: 批处理大小
+            ids: 向量ID列表，传分块ID，重复添加时覆盖而不是新增，启动时也能按分块ID对比数据是否一致
+            vectors: 已经生成好的向量，和 documents 一一对应，传了则不再调用嵌入服务
             
         Returns:
             向量ID列表
         """
         try:
-            vector_store = self.get_vector_store()
             vector_ids = []
             
             # 为每个文档添加元数据
@@ -126,11 +266,27 @@ class QdrantManager:
                     doc.metadata = {}
                 doc.metadata['document_id'] = document_id
             
-            # 批量添加文档
+            # 先生成向量，再打开客户端写入，本地模式下不会因为等待嵌入服务而长时间占用目录锁
             for i in range(0, len(documents), batch_size):
                 batch = documents[i:i + batch_size]
-                ids = vector_store.add_documents(batch)
-                vector_ids.extend(ids)
+                batch_ids = ids[i:i + batch_size] if ids else [str(uuid.uuid4()) for _ in batch]
+                if vectors is None:
+                    batch_vectors = self.embeddings.embed_documents([doc.page_content for doc in batch])
+                else:
+                    batch_vectors = vectors[i:i + batch_size]
+                with self.get_client() as client:
+                    client.upsert(
+                        collection_name=self.collection_name,
+                        points=[
+                            PointStruct(
+                                id=point_id,
+                                vector=vector,
+                                payload={"page_content": doc.page_content, "metadata": doc.metadata}
+                            )
+                            for point_id, vector, doc in zip(batch_ids, batch_vectors, batch)
+                        ]
+                    )
+                vector_ids.extend(batch_ids)
                 logger.info(f"Added batch {i//batch_size + 1}: {len(batch)} documents")
             
             logger.info(f"Successfully added {len(documents)} documents to Qdrant")
@@ -160,17 +316,19 @@ class QdrantManager:
             搜索结果列表
         """
         try:
-            vector_store = self.get_vector_store()
-            
-            # 执行搜索
-            if filter_dict:
-                results = vector_store.similarity_search_with_score(
-                    query,
-                    k=k,
-                    filter=filter_dict
-                )
-            else:
-                results = vector_store.similarity_search_with_score(query, k=k)
+            query_vector = self.embeddings.embed_query(query)
+            with self.get_client() as client:
+                vector_store = self.get_vector_store(client)
+                
+                # 执行搜索
+                if filter_dict:
+                    results = vector_store.similarity_search_with_score_by_vector(
+                        query_vector,
+                        k=k,
+                        filter=filter_dict
+                    )
+                else:
+                    results = vector_store.similarity_search_with_score_by_vector(query_vector, k=k)
             
             # 格式化结果
             formatted_results = []
@@ -201,19 +359,22 @@ class QdrantManager:
         """
         try:
             # 使用过滤条件删除
-            self.client.delete(
-                collection_name=self.collection_name,
-                points_selector=models.FilterSelector(
-                    filter=models.Filter(
-                        must=[
-                            models.FieldCondition(
-                                key="metadata.document_id",
-                                match=models.MatchValue(value=document_id)
-                            )
-                        ]
+            with self.get_client() as client:
+                if not client.collection_exists(self.collection_name):
+                    return True
+                client.delete(
+                    collection_name=self.collection_name,
+                    points_selector=models.FilterSelector(
+                        filter=models.Filter(
+                            must=[
+                                models.FieldCondition(
+                                    key="metadata.document_id",
+                                    match=models.MatchValue(value=document_id)
+                                )
+                            ]
+                        )
                     )
                 )
-            )
             logger.info(f"Deleted vectors for document: {document_id}")
             return True
             
@@ -229,7 +390,8 @@ class QdrantManager:
             集合信息字典
         """
         try:
-            info = self.client.get_collection(self.collection_name)
+            with self.get_client() as client:
+                info = client.get_collection(self.collection_name)
             return {
                 'name': info.config.params.vectors.size,
                 'vectors_count': info.vectors_count,
@@ -248,10 +410,107 @@ class QdrantManager:
             是否成功
         """
         try:
-            self.client.delete_collection(self.collection_name)
+            self.drop_collection()
             self._ensure_collection()
             logger.info(f"Cleared collection: {self.collection_name}")
             return True
         except Exception as e:
             logger.error(f"Failed to clear collection: {e}")
             return False
+
+    def drop_collection(self) -> bool:
+        """
+        删除集合，知识库删除时调用
+        
+        Returns:
+            是否成功
+        """
+        try:
+            with self.get_client() as client:
+                if client.collection_exists(self.collection_name):
+                    client.delete_collection(self.collection_name)
+            logger.info(f"Deleted collection: {self.collection_name}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to delete collection: {e}")
+            return False
+
+    def get_point_ids(self, batch_size: int = 1000) -> Tuple[Set[str], Dict[str, Optional[str]]]:
+        """
+        获取集合中所有向量的ID，用于和数据库中的分块对比
+        升级前写入的向量ID是随机生成的，不是分块ID，元数据中也没有 chunk_id，单独返回
+        
+        Returns:
+            (向量ID集合, {升级前的向量ID: 文档ID})
+        """
+        point_ids, legacy_dict, offset = set(), {}, None
+        with self.get_client() as client:
+            if not client.collection_exists(self.collection_name):
+                return point_ids, legacy_dict
+            while True:
+                points, offset = client.scroll(
+                    collection_name=self.collection_name,
+                    limit=batch_size,
+                    offset=offset,
+                    with_payload=["metadata"],
+                    with_vectors=False
+                )
+                for point in points:
+                    metadata = (point.payload or {}).get("metadata") or {}
+                    if metadata.get("chunk_id"):
+                        point_ids.add(str(point.id))
+                    else:
+                        legacy_dict[str(point.id)] = metadata.get("document_id")
+                if offset is None:
+                    return point_ids, legacy_dict
+
+    def delete_points(self, point_ids: List[str]) -> None:
+        """
+        按向量ID删除
+        
+        Args:
+            point_ids: 向量ID列表
+        """
+        with self.get_client() as client:
+            client.delete(
+                collection_name=self.collection_name,
+                points_selector=models.PointIdsList(points=point_ids)
+            )
+
+    def get_vectors_by_hash(self, content_hashes: List[str], embedding_model: str,
+                            batch_size: int = 500) -> Dict[str, List[float]]:
+        """
+        按分块内容的哈希查已有的向量，内容相同的分块不需要重新向量化
+        
+        Args:
+            content_hashes: 分块内容的哈希列表
+            embedding_model: 嵌入模型标识，只复用同一个模型生成的向量
+            
+        Returns:
+            {内容哈希: 向量}
+        """
+        vector_dict = {}
+        with self.get_client() as client:
+            if not client.collection_exists(self.collection_name):
+                return vector_dict
+            for i in range(0, len(content_hashes), batch_size):
+                batch = content_hashes[i:i + batch_size]
+                query_filter = models.Filter(must=[
+                    models.FieldCondition(key="metadata.embedding_model", match=models.MatchValue(value=embedding_model)),
+                    models.FieldCondition(key="metadata.content_hash", match=models.MatchAny(any=batch))
+                ])
+                offset = None
+                while True:
+                    points, offset = client.scroll(
+                        collection_name=self.collection_name,
+                        scroll_filter=query_filter,
+                        limit=batch_size,
+                        offset=offset,
+                        with_payload=["metadata"],
+                        with_vectors=True
+                    )
+                    for point in points:
+                        vector_dict[point.payload["metadata"]["content_hash"]] = point.vector
+                    if offset is None:
+                        break
+        return vector_dict
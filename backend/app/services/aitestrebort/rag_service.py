@@ -201,7 +201,8 @@ class RAGService:
         score_threshold: float = 0.3,
         system_prompt: Optional[str] = None,
         prompt_template: str = 'default',
-        llm_config: Optional[Dict[str, Any]] = None
+        llm_config: Optional[Dict[str, Any]] = None,
+        hybrid: Optional[bool] = None
     ) -> Dict[str, Any]:
         """
         执行 RAG 查询（非流式）
@@ -213,6 +214,7 @@ class RAGService:
             system_prompt: 系统提示词（优先级最高）
             prompt_template: Prompt 模板类型（default/technical/testing/concise）
             llm_config: LLM 配置
+            hybrid: 是否使用混合检索，不传则按配置
             
         Returns:
             查询结果
@@ -225,7 +227,8 @@ class RAGService:
             context_chunks = await self.kb_service.search_knowledge(
                 query=query_text,
                 top_k=top_k,
-                score_threshold=score_threshold
+                score_threshold=score_threshold,
+                hybrid=hybrid
             )
             retrieval_time = time.time() - retrieval_start
             
@@ -3,6 +3,7 @@
 """
 import logging
 import asyncio
+import hashlib
 from typing import List, Dict, Any, Optional
 from uuid import UUID
 from datetime import datetime
@@ -17,6 +18,7 @@ from app.schemas.aitestrebort.requirements import (
     ReviewRequest, ReviewProgressResponse
 )
 from app.services.aitestrebort.requirements_service import generate_id
+from app.models.config.config import Config
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +26,9 @@ logger = logging.getLogger(__name__)
 class RequirementReviewService:
     """需求评审服务类"""
     
+    # 专项分析类型，按此顺序展示
+    ANALYSIS_TYPES = ["completeness", "consistency", "testability", "feasibility", "clarity"]
+    
     @staticmethod
     async def start_review(
         review_request: ReviewRequest,
@@ -85,39 +90,24 @@ class RequirementReviewService:
             document = await RequirementDocument.get(id=review_report.document_id)
             modules = await RequirementModule.filter(document_id=document.id).all()
             
-            # 执行5个专项分析
+            # 并发执行5个专项分析，每完成一项就保存，重新评审时已完成的不再分析
             analyses = {}
             
             if review_request.review_type == "comprehensive":
-                # 完整性分析
-                completeness_result = await RequirementReviewService._analyze_completeness(
-                    document, modules
-                )
-                analyses["completeness"] = completeness_result
-                
-                # 一致性分析
-                consistency_result = await RequirementReviewService._analyze_consistency(
-                    document, modules
-                )
-                analyses["consistency"] = consistency_result
-                
-                # 可测性分析
-                testability_result = await RequirementReviewService._analyze_testability(
-                    document, modules
-                )
-                analyses["testability"] = testability_result
+                save_lock = asyncio.Lock()
                 
-                # 可行性分析
-                feasibility_result = await RequirementReviewService._analyze_feasibility(
-                    document, modules
-                )
-                analyses["feasibility"] = feasibility_result
+                async def save_analysis(analysis_type, result, finished_analyses):
+                    async with save_lock:
+                        await ReviewReport.filter(id=review_id).update(
+                            specialized_analyses=dict(finished_analyses),
+                            **{f"{analysis_type}_score": result.get("score", 0)}
+                        )
                 
-                # 清晰度分析
-                clarity_result = await RequirementReviewService._analyze_clarity(
-                    document, modules
+                analyses = await RequirementReviewService.run_analyses(
+                    document, modules,
+                    finished=review_report.specialized_analyses,
+                    on_finish=save_analysis
                 )
-                analyses["clarity"] = clarity_result
             
             # 生成综合评审结果
             await RequirementReviewService._generate_review_summary(
@@ -138,6 +128,85 @@ class RequirementReviewService:
                 error_message=str(e)
             )
     
+    @staticmethod
+    async def run_analyses(
+        document: RequirementDocument,
+        modules: List[RequirementModule],
+        finished: Optional[Dict[str, Any]] = None,
+        on_finish=None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        并发执行专项分析，同时执行的数量和单项超时时间见 requirement_review_conf 配置
+        
+        Args:
+            finished: 之前已完成的分析结果，status 为 completed 且文档、模块内容没有变化的不再重新分析
+            on_finish: 每项分析完成后调用 on_finish(分析类型, 分析结果, 已完成的所有结果)，用于及时保存
+            
+        Returns:
+            {分析类型: 分析结果}，分析结果的 status 为 completed / failed
+        """
+        conf = await Config.get_requirement_review_conf()
+        semaphore = asyncio.Semaphore(max(int(conf.get("concurrency", 5)), 1))
+        timeout = conf.get("timeout", 180)
+        content_hash = RequirementReviewService.get_content_hash(document, modules)
+        analyses = {
+            analysis_type: result for analysis_type, result in (finished or {}).items()
+            if analysis_type in RequirementReviewService.ANALYSIS_TYPES and result.get("status") == "completed"
+            and result.get("content_hash") == content_hash
+        }
+        
+        async def run(analysis_type):
+            analyze = getattr(RequirementReviewService, f"_analyze_{analysis_type}")
+            async with semaphore:
+                try:
+                    result = await asyncio.wait_for(analyze(document, modules), timeout=timeout)
+                    result["status"] = "failed" if result.get("error") else "completed"
+                except asyncio.TimeoutError:
+                    logger.error(f"{analysis_type}分析超时: {timeout}秒")
+                    result = RequirementReviewService._get_failed_result(f"AI分析超时（{timeout}秒）")
+                except Exception as e:
+                    logger.error(f"{analysis_type}分析失败: {e}")
+                    result = RequirementReviewService._get_failed_result(str(e))
+            result["content_hash"] = content_hash
+            analyses[analysis_type] = result
+            if on_finish:
+                try:
+                    await on_finish(analysis_type, result, analyses)
+                except Exception as e:
+                    logger.error(f"保存{analysis_type}分析结果失败: {e}")
+        
+        await asyncio.gather(*[
+            run(analysis_type) for analysis_type in RequirementReviewService.ANALYSIS_TYPES
+            if analysis_type not in analyses
+        ])
+        return {analysis_type: analyses[analysis_type] for analysis_type in RequirementReviewService.ANALYSIS_TYPES}
+    
+    @staticmethod
+    def get_content_hash(document: RequirementDocument, modules: List[RequirementModule]) -> str:
+        """文档和模块内容的摘要，内容变了之前的分析结果就不能再复用"""
+        parts = [document.title or "", document.description or "", document.content or ""]
+        for module in sorted(modules, key=lambda module: (module.order_num or 0, str(module.id))):
+            parts.extend([str(module.id), module.title or "", module.content or ""])
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def _get_failed_result(error_message: str) -> Dict[str, Any]:
+        """分析失败时的结果，带 error 字段，重新评审时会重新分析"""
+        return {
+            "score": 0,
+            "overall_score": 0,
+            "issues": [{
+                "title": "AI分析服务不可用",
+                "description": f"AI分析过程中发生错误: {error_message}",
+                "priority": "high",
+                "suggestion": "请检查LLM配置并确保AI服务正常运行"
+            }],
+            "strengths": [],
+            "recommendations": ["请检查LLM配置并确保AI服务正常运行"],
+            "error": error_message,
+            "status": "failed"
+        }
+    
     @staticmethod
     async def _call_llm_analysis(
         document: RequirementDocument,
@@ -235,18 +304,7 @@ class RequirementReviewService:
                 
         except Exception as e:
             logger.error(f"{analysis_type}分析失败: {e}")
-            return {
-                "score": 0,
-                "overall_score": 0,
-                "issues": [{
-                    "title": "AI分析服务不可用",
-                    "description": f"AI分析过程中发生错误: {str(e)}",
-                    "priority": "high",
-                    "suggestion": "请检查LLM配置并确保AI服务正常运行"
-                }],
-                "strengths": [],
-                "recommendations": ["请检查LLM配置并确保AI服务正常运行"]
-            }
+            return RequirementReviewService._get_failed_result(str(e))
     
     @staticmethod
     async def _analyze_completeness(
@@ -521,17 +579,26 @@ class RequirementReviewService:
             }
             
             progress = progress_map.get(review.status, 0.0)
+            current_step = f"正在执行{review.review_type}评审"
             
             # 估算剩余时间
             estimated_time = None
             if review.status == "reviewing":
                 estimated_time = 300  # 5分钟
+                # 按已完成的专项分析计算进度
+                finished = [
+                    analysis_type for analysis_type in RequirementReviewService.ANALYSIS_TYPES
+                    if analysis_type in (review.specialized_analyses or {})
+                ]
+                if finished:
+                    progress = len(finished) * 100.0 / len(RequirementReviewService.ANALYSIS_TYPES)
+                    current_step = f"已完成专项分析: {', '.join(finished)}"
             
             return ReviewProgressResponse(
                 document_id=review.document_id,
                 status=review.status,
                 progress=progress,
-                current_step=f"正在执行{review.review_type}评审",
+                current_step=current_step,
                 estimated_time=estimated_time
             )
             
@@ -4,6 +4,7 @@
 from typing import List, Optional, Dict, Any, Tuple
 from fastapi import HTTPException, UploadFile
 import uuid
+import asyncio
 import os
 import logging
 import re
@@ -827,11 +828,24 @@ class RequirementService:
             'failed': {'status': 'failed', 'progress': 0, 'message': '评审失败'}
         }
         
-        return progress_map.get(review.status, {
+        progress = dict(progress_map.get(review.status, {
             'status': 'unknown',
             'progress': 0,
             'message': '未知状态'
-        })
+        }))
+        
+        # 全面评审中，按已完成的专项分析计算进度
+        finished = [key for key in (review.specialized_analyses or {}) if key.endswith('_analysis')]
+        if review.status == 'in_progress' and finished:
+            progress['progress'] = len(finished) * 100 // 5  # 共5项专项分析
+            progress['message'] = f"已完成专项分析: {', '.join(key[:-len('_analysis')] for key in finished)}"
+        
+        progress.update(
+            document_id=str(review.document_id),
+            current_step=progress['message'],
+            finished_analyses=finished
+        )
+        return progress
     
     async def get_review_issues(self, review_id: uuid.UUID) -> List[ReviewIssue]:
         """获取评审问题列表"""
@@ -1547,10 +1561,24 @@ class RequirementReviewService:
             
             logger.info(f"开始评审文档: {document.title}")
             
+            # 上一次评审中已完成的专项分析，文档和模块内容没有变化时直接复用（见 RequirementReviewService.run_analyses）
+            finished_analyses = await self._get_finished_analyses(document, review_report.id)
+            save_lock = asyncio.Lock()
+            
+            async def save_analysis(analysis_type, result, analyses):
+                """每完成一项专项分析就保存，前端可以先展示已完成的部分"""
+                async with save_lock:
+                    await ReviewReport.filter(id=review_report.id).update(
+                        specialized_analyses={f"{key}_analysis": value for key, value in analyses.items()},
+                        **{f"{analysis_type}_score": result.get("score", 0)}
+                    )
+            
             # 执行AI分析
             analysis_result = await self.review_engine.analyze_document_comprehensive(
                 document, 
-                analysis_options
+                analysis_options,
+                finished_analyses=finished_analyses,
+                on_finish=save_analysis
             )
             
             # 更新评审报告
@@ -1566,8 +1594,12 @@ class RequirementReviewService:
             review_report.status = 'completed'
             await review_report.save()
             
-            # 更新文档状态
-            document.status = 'review_completed'
+            # 更新文档状态，有专项分析失败时保持评审中，可以再次评审，只重新执行失败的部分
+            failed_analyses = [
+                analysis_type for analysis_type, analysis in analysis_result.get('specialized_analyses', {}).items()
+                if isinstance(analysis, dict) and analysis.get('status') == 'failed'
+            ]
+            document.status = 'reviewing' if failed_analyses else 'review_completed'
             await document.save()
             
             logger.info(f"评审完成: {document.title}, 总体评分: {review_report.completion_score}")
@@ -1585,6 +1617,19 @@ class RequirementReviewService:
             
             raise
     
+    @staticmethod
+    async def _get_finished_analyses(document: RequirementDocument, exclude_report_id: str) -> dict:
+        """获取该文档上一次全面评审中已完成的专项分析 {分析类型: 结果}，是否复用由 run_analyses 按内容摘要判断"""
+        last_report = await ReviewReport.filter(
+            document_id=document.id, review_type='comprehensive'
+        ).exclude(id=exclude_report_id).order_by('-created_at').first()
+        if not last_report or not last_report.specialized_analyses:
+            return {}
+        return {
+            key[:-len('_analysis')]: value for key, value in last_report.specialized_analyses.items()
+            if key.endswith('_analysis') and isinstance(value, dict) and value.get('status') == 'completed'
+        }
+    
     async def _update_review_report(self, review_report: ReviewReport, analysis_result: dict):
         """更新评审报告"""
         review_report.overall_rating = analysis_result.get('overall_rating', 'average')
@@ -1767,8 +1812,18 @@ class RequirementReviewEngine:
                 ]
             }
     
-    async def analyze_document_comprehensive(self, document: RequirementDocument, analysis_options: dict = None) -> dict:
-        """全面分析文档（基于模块）"""
+    async def analyze_document_comprehensive(
+        self,
+        document: RequirementDocument,
+        analysis_options: dict = None,
+        finished_analyses: dict = None,
+        on_finish=None
+    ) -> dict:
+        """
+        全面分析文档（基于模块）
+        finished_analyses: 之前已完成的专项分析 {分析类型: 结果}，不再重新分析
+        on_finish: 每项专项分析完成后的回调，见 RequirementReviewService.run_analyses
+        """
         try:
             # 获取文档的模块
             modules = await RequirementModule.filter(document=document).all()
@@ -1779,28 +1834,13 @@ class RequirementReviewEngine:
             from app.services.aitestrebort.requirements_review import RequirementReviewService
             from app.services.aitestrebort.requirements_service import generate_id
             
-            # 执行各项专项分析
-            analyses = {}
-            
-            # 完整性分析
-            completeness_result = await RequirementReviewService._analyze_completeness(document, modules)
-            analyses["completeness_analysis"] = completeness_result
-            
-            # 一致性分析
-            consistency_result = await RequirementReviewService._analyze_consistency(document, modules)
-            analyses["consistency_analysis"] = consistency_result
-            
-            # 可测性分析
-            testability_result = await RequirementReviewService._analyze_testability(document, modules)
-            analyses["testability_analysis"] = testability_result
-            
-            # 可行性分析
-            feasibility_result = await RequirementReviewService._analyze_feasibility(document, modules)
-            analyses["feasibility_analysis"] = feasibility_result
-            
-            # 清晰度分析
-            clarity_result = await RequirementReviewService._analyze_clarity(document, modules)
-            analyses["clarity_analysis"] = clarity_result
+            # 并发执行各项专项分析，之前已完成的不再分析
+            specialized_analyses = await RequirementReviewService.run_analyses(
+                document, modules, finished=finished_analyses, on_finish=on_finish
+            )
+            analyses = {
+                f"{analysis_type}_analysis": result for analysis_type, result in specialized_analyses.items()
+            }
             
             # 计算综合评分
             scores = []
@@ -4,6 +4,7 @@
 """
 import os
 import time
+import asyncio
 import hashlib
 import logging
 import json
@@ -30,8 +31,14 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document as LangChainDocument
 from langchain.embeddings.base import Embeddings
 import requests
+import threading
 import uuid
+from array import array
+from collections import OrderedDict
 
+from app.models.config.config import Config
+from utils.util.file_util import KNOWLEDGE_INDEX_ADDRESS
+from .keyword_index import KeywordIndex
 from .qdrant_manager import QdrantManager
 
 logger = logging.getLogger(__name__)
@@ -143,13 +150,40 @@ class OllamaEmbeddings(Embeddings):
             self.embeddings_url = f"{self.base_url}/api/embeddings"
         else:
             self.embeddings_url = self.base_url
+        # 批量嵌入端点 /api/embed，一次请求嵌入多条文本，旧版本Ollama没有这个端点时逐条请求
+        self.batch_url = self.embeddings_url[:-len('/api/embeddings')] + '/api/embed'
+        self.batch_supported = True
             
         logger.info(f"OllamaEmbeddings initialized: {self.embeddings_url}, model: {self.model}")
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """嵌入多个文档"""
+        if self.batch_supported:
+            embeddings = self._embed_batch(texts)
+            if embeddings is not None:
+                return embeddings
         return [self.embed_query(text) for text in texts]
     
+    def _embed_batch(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """调用Ollama批量嵌入API，端点不存在时返回None"""
+        response = requests.post(
+            self.batch_url,
+            json={"model": self.model, "input": texts},
+            timeout=120
+        )
+        if response.status_code == 404 and 'model' not in response.text:
+            logger.info(f"Ollama batch embedding API not supported, fallback to {self.embeddings_url}")
+            self.batch_supported = False
+            return None
+        response.raise_for_status()
+        
+        # Ollama返回格式: {"embeddings": [[0.1, 0.2, ...], ...]}
+        embeddings = response.json().get("embeddings")
+        if not embeddings or len(embeddings) != len(texts):
+            raise ValueError(f"Ollama API响应格式不正确，'embeddings'字段缺失或数量不一致")
+        logger.info(f"Successfully embedded {len(texts)} texts, dimension: {len(embeddings[0])}")
+        return embeddings
+    
     def embed_query(self, text: str) -> List[float]:
         """嵌入单个查询"""
         return self._embed_text(text)
@@ -523,6 +557,128 @@ class DocumentProcessor:
             return {}
 
 
+class EmbeddingCache:
+    """
+    进程内的向量缓存，按 (模型, 文本sha256) 缓存，占用的内存超过 max_bytes 时淘汰最久未使用的
+    重复上传的文档、多个文档中相同的段落（页眉页脚、声明等）不会重复向量化
+    向量按 float32 数组存储，每个 worker 都有一份，1024维的向量每条约4KB，默认64MB约1.5万条
+    """
+    max_bytes = 64 * 1024 * 1024
+    entry_overhead = 200  # 每条缓存除向量外的内存占用（键、数组对象等），估算值
+    _cache = OrderedDict()
+    _size = 0
+    _lock = threading.Lock()
+    
+    @staticmethod
+    def get_text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def get_model_key(embeddings: Embeddings) -> str:
+        """ 嵌入服务+模型名，换了模型的向量不能复用 """
+        model_name = getattr(embeddings, 'model_name', None) or getattr(embeddings, 'model', '')
+        return f"{type(embeddings).__name__}:{getattr(embeddings, 'embeddings_url', '')}:{model_name}"
+    
+    @classmethod
+    def get_entry_size(cls, vector: array) -> int:
+        return vector.itemsize * len(vector) + cls.entry_overhead
+    
+    @classmethod
+    def get_many(cls, model_key: str, text_hashes) -> Dict[str, List[float]]:
+        with cls._lock:
+            vector_dict = {}
+            for text_hash in text_hashes:
+                vector = cls._cache.get((model_key, text_hash))
+                if vector is not None:
+                    cls._cache.move_to_end((model_key, text_hash))
+                    vector_dict[text_hash] = vector.tolist()
+            return vector_dict
+    
+    @classmethod
+    def set_many(cls, model_key: str, vector_dict: Dict[str, List[float]]):
+        with cls._lock:
+            for text_hash, vector in vector_dict.items():
+                vector = array('f', vector)
+                old_vector = cls._cache.pop((model_key, text_hash), None)
+                if old_vector is not None:
+                    cls._size -= cls.get_entry_size(old_vector)
+                cls._cache[(model_key, text_hash)] = vector
+                cls._size += cls.get_entry_size(vector)
+            while cls._cache and cls._size > cls.max_bytes:
+                _, vector = cls._cache.popitem(last=False)
+                cls._size -= cls.get_entry_size(vector)
+
+
+class BatchEmbedder:
+    """
+    文档入库时的批量向量化
+    - 每个分块只向量化一次，先查进程内缓存，再查向量库中内容相同的分块，都没有的才调嵌入服务
+    - 相同内容的分块只请求一次
+    - 每次请求 batch_size 条文本，最多同时发 concurrency 个请求
+    """
+    batch_size = 32
+    concurrency = 4
+    
+    @classmethod
+    def configure(cls, batch_size=32, concurrency=4, cache_mb=64, **kwargs):
+        cls.batch_size, cls.concurrency = max(int(batch_size), 1), max(int(concurrency), 1)
+        EmbeddingCache.max_bytes = max(int(float(cache_mb) * 1024 * 1024), 0)
+    
+    @classmethod
+    async def embed_texts(cls, embeddings: Embeddings, texts: List[str], lookup=None):
+        """
+        批量向量化
+        
+        Args:
+            embeddings: 嵌入模型
+            texts: 文本列表
+            lookup: 缓存中没有时，按 (文本哈希列表, 模型) 从向量库查已有向量的同步方法，返回 {文本哈希: 向量}
+            
+        Returns:
+            (向量列表, 文本哈希列表)，和 texts 一一对应
+        """
+        model_key = EmbeddingCache.get_model_key(embeddings)
+        text_hashes = [EmbeddingCache.get_text_hash(text) for text in texts]
+        vector_dict = EmbeddingCache.get_many(model_key, set(text_hashes))
+        missing_dict = {text_hash: text for text_hash, text in zip(text_hashes, texts) if text_hash not in vector_dict}
+        cache_count = len(vector_dict)
+        
+        if missing_dict and lookup:
+            try:
+                found_dict = await asyncio.to_thread(lookup, list(missing_dict), model_key)
+            except Exception as e:
+                logger.warning(f"Failed to lookup existing vectors: {e}")
+                found_dict = {}
+            EmbeddingCache.set_many(model_key, found_dict)
+            vector_dict.update(found_dict)
+            missing_dict = {text_hash: text for text_hash, text in missing_dict.items() if text_hash not in found_dict}
+        
+        if missing_dict:
+            semaphore = asyncio.Semaphore(cls.concurrency)
+            missing_items = list(missing_dict.items())
+            
+            async def embed_batch(batch):
+                async with semaphore:
+                    vectors = await asyncio.to_thread(embeddings.embed_documents, [text for _, text in batch])
+                if len(vectors) != len(batch):
+                    raise ValueError(f"嵌入服务返回的向量数量不正确: {len(vectors)} != {len(batch)}")
+                batch_dict = {text_hash: vector for (text_hash, _), vector in zip(batch, vectors)}
+                EmbeddingCache.set_many(model_key, batch_dict)
+                return batch_dict
+            
+            for batch_dict in await asyncio.gather(*[
+                embed_batch(missing_items[i:i + cls.batch_size])
+                for i in range(0, len(missing_items), cls.batch_size)
+            ]):
+                vector_dict.update(batch_dict)
+        
+        logger.info(
+            f"Embedded {len(texts)} texts: {cache_count} from cache, "
+            f"{len(set(text_hashes)) - cache_count - len(missing_dict)} from vector store, {len(missing_dict)} requested"
+        )
+        return [vector_dict[text_hash] for text_hash in text_hashes], text_hashes
+
+
 class VectorStoreManager:
     """
     向量存储管理器
@@ -659,6 +815,7 @@ class KnowledgeBaseService:
     """
     知识库服务
     """
+    _check_task: Optional[asyncio.Task] = None  # 启动时的一致性检查任务，保留引用，服务关闭时取消
     
     def __init__(self, knowledge_base_id: str):
         self.knowledge_base_id = knowledge_base_id
@@ -682,17 +839,13 @@ class KnowledgeBaseService:
             # 获取全局配置
             global_config = await aitestrebortKnowledgeConfig.first()
             
-            # Qdrant 配置（从环境变量或全局配置获取）
-            qdrant_url = os.getenv('QDRANT_URL', None)
-            qdrant_api_key = os.getenv('QDRANT_API_KEY', None)
-            
             # 集合名称使用知识库ID
             collection_name = f"kb_{self.knowledge_base_id}"
             
             # 自动检测向量维度
             try:
                 # 生成一个测试嵌入来获取实际维度
-                test_embedding = self.embeddings.embed_query("test")
+                test_embedding = (await BatchEmbedder.embed_texts(self.embeddings, ["test"]))[0][0]
                 vector_size = len(test_embedding)
                 logger.info(f"Detected embedding dimension: {vector_size}")
             except Exception as e:
@@ -709,12 +862,12 @@ class KnowledgeBaseService:
                     elif 'mxbai' in global_config.model_name.lower():
                         vector_size = 1024  # mxbai-embed-large
             
+            # Qdrant 存储配置从环境变量获取：QDRANT_URL、QDRANT_API_KEY、QDRANT_PATH
             self.qdrant_manager = QdrantManager(
                 collection_name=collection_name,
                 embeddings=self.embeddings,
-                qdrant_url=qdrant_url,
-                qdrant_api_key=qdrant_api_key,
-                vector_size=vector_size
+                vector_size=vector_size,
+                **QdrantManager.get_storage_conf()
             )
             logger.info(f"Qdrant manager initialized for KB: {self.knowledge_base_id}, vector_size: {vector_size}")
             
@@ -804,42 +957,70 @@ class KnowledgeBaseService:
             chunks = self.processor.split_documents(langchain_docs)
             logger.info(f"Created {len(chunks)} chunks")
             
+            # 向量化，每个分块只向量化一次，内容没变的分块直接复用已有的向量
+            # 没有向量库时向量没有地方存，不需要向量化
+            vectors, text_hashes = [], [EmbeddingCache.get_text_hash(chunk.page_content) for chunk in chunks]
+            if self.qdrant_manager:
+                logger.info(f"Embedding {len(chunks)} chunks...")
+                BatchEmbedder.configure(**await Config.get_embedding_conf())
+                vectors, text_hashes = await BatchEmbedder.embed_texts(
+                    self.embeddings,
+                    [chunk.page_content for chunk in chunks],
+                    lookup=self.qdrant_manager.get_vectors_by_hash
+                )
+            
             # 删除旧的分块
             old_chunks = await aitestrebortDocumentChunk.filter(document=document).count()
             if old_chunks > 0:
                 logger.info(f"Deleting {old_chunks} old chunks")
                 await aitestrebortDocumentChunk.filter(document=document).delete()
             
-            # 创建新的分块并向量化
-            logger.info(f"Creating and embedding {len(chunks)} chunks...")
-            for i, chunk in enumerate(chunks):
-                if i % 10 == 0:
-                    logger.info(f"Processing chunk {i+1}/{len(chunks)}")
-                
-                # 生成嵌入（embed_query是同步方法，不需要await）
-                embedding = self.embeddings.embed_query(chunk.page_content)
-                embedding_hash = hashlib.md5(str(embedding).encode()).hexdigest()
-                
-                # 保存分块
-                await aitestrebortDocumentChunk.create(
+            # 创建新的分块，分块ID同时作为向量ID，嵌入哈希为分块内容的哈希
+            logger.info(f"Creating {len(chunks)} chunks...")
+            chunk_ids = [str(uuid.uuid4()) for _ in chunks]
+            await aitestrebortDocumentChunk.bulk_create([
+                aitestrebortDocumentChunk(
+                    id=chunk_id,
+                    vector_id=chunk_id,
                     document=document,
                     chunk_index=i,
                     content=chunk.page_content,
-                    embedding_hash=embedding_hash,
+                    embedding_hash=text_hash,
                     start_index=chunk.metadata.get('start_index'),
                     end_index=chunk.metadata.get('end_index'),
                     page_number=chunk.metadata.get('page')
                 )
+                for i, (chunk, chunk_id, text_hash) in enumerate(zip(chunks, chunk_ids, text_hashes))
+            ], batch_size=500)
+            
+            logger.info(f"All chunks created successfully")
             
-            logger.info(f"All chunks created and embedded successfully")
+            # 写入关键词索引
+            try:
+                await asyncio.to_thread(
+                    KeywordIndex(self.knowledge_base_id).add_chunks,
+                    str(document.id),
+                    [(chunk_id, chunk.page_content) for chunk_id, chunk in zip(chunk_ids, chunks)]
+                )
+            except Exception as e:
+                logger.error(f"Failed to update keyword index: {e}")
+                # 启动时的一致性检查会补上
             
             # 存储到 Qdrant 向量数据库
             if self.qdrant_manager:
                 try:
                     logger.info("Storing vectors to Qdrant...")
-                    vector_ids = self.qdrant_manager.add_documents(
+                    model_key = EmbeddingCache.get_model_key(self.embeddings)
+                    for chunk, chunk_id, text_hash in zip(chunks, chunk_ids, text_hashes):
+                        chunk.metadata.update(chunk_id=chunk_id, content_hash=text_hash, embedding_model=model_key)
+                    # 本地模式可能要等其他worker释放目录，放到线程中执行，不阻塞事件循环
+                    await asyncio.to_thread(self.qdrant_manager.delete_by_document_id, str(document.id))  # 删除重新处理前的向量
+                    vector_ids = await asyncio.to_thread(
+                        self.qdrant_manager.add_documents,
                         documents=chunks,
-                        document_id=str(document.id)
+                        document_id=str(document.id),
+                        ids=chunk_ids,
+                        vectors=vectors
                     )
                     logger.info(f"Successfully stored {len(vector_ids)} vectors to Qdrant")
                 except Exception as e:
@@ -879,11 +1060,194 @@ class KnowledgeBaseService:
                 'chunks_count': 0
             }
     
+    async def check_consistency(self, migrate_legacy: bool = False) -> Dict[str, int]:
+        """
+        对比数据库中的分块和向量库中的向量（向量ID即分块ID）
+        只重新向量化已处理完成的文档缺少的分块，补充成功后再删除分块已不存在的向量，不需要重新导入文档
+        正在处理的文档已经写入了分块和向量，只是还没改为完成状态，它的向量不算多余的
+        升级前写入的向量ID不是分块ID，migrate_legacy 为 False 时保留并继续用于检索，不重新向量化这些文档，
+        为 True 时重新向量化这些文档，成功后删除旧向量
+        
+        Returns:
+            分块总数、补充的向量数、删除的向量数、未迁移的旧向量数
+        """
+        from app.models.aitestrebort.knowledge import aitestrebortDocumentChunk
+        
+        # 先取向量再取分块，处理文档时先写分块再写向量，取到的向量对应的分块一定能取到
+        point_ids, legacy_dict = await asyncio.to_thread(self.qdrant_manager.get_point_ids)
+        chunk_list = await aitestrebortDocumentChunk.filter(
+            document__knowledge_base_id=self.knowledge_base_id
+        ).values("id", "document_id", "chunk_index", "content", "start_index", "end_index", "page_number",
+                 "document__status")
+        chunk_dict = {str(chunk["id"]): chunk for chunk in chunk_list}
+        
+        # 分块已不存在的向量，等缺少的向量补充完再删除，补充失败时保留原有向量
+        orphan_ids = [point_id for point_id in point_ids if point_id not in chunk_dict]
+        document_ids = {str(chunk["document_id"]) for chunk in chunk_list}
+        legacy_document_ids = set()
+        for point_id, document_id in legacy_dict.items():
+            if document_id not in document_ids:
+                orphan_ids.append(point_id)  # 文档已删除
+            elif migrate_legacy:
+                orphan_ids.append(point_id)
+            else:
+                legacy_document_ids.add(document_id)
+        if legacy_document_ids:
+            logger.warning(
+                f"Knowledge base {self.knowledge_base_id} has vectors of {len(legacy_document_ids)} documents written "
+                f"before upgrade, keep using them; set embedding_conf.migrate_legacy_vectors to true to re-embed them")
+        
+        # 按文档分组补充缺少的向量
+        missing_dict = {}
+        for chunk_id, chunk in chunk_dict.items():
+            document_id = str(chunk["document_id"])
+            if chunk["document__status"] == 'completed' and chunk_id not in point_ids \
+                    and document_id not in legacy_document_ids:
+                missing_dict.setdefault(document_id, []).append(chunk)
+        if missing_dict:
+            BatchEmbedder.configure(**await Config.get_embedding_conf())
+        model_key = EmbeddingCache.get_model_key(self.embeddings)
+        for document_id, missing_chunks in missing_dict.items():
+            vectors, text_hashes = await BatchEmbedder.embed_texts(
+                self.embeddings,
+                [chunk["content"] for chunk in missing_chunks],
+                lookup=self.qdrant_manager.get_vectors_by_hash
+            )
+            documents = [LangChainDocument(
+                page_content=chunk["content"],
+                metadata={
+                    "chunk_id": str(chunk["id"]), "start_index": chunk["start_index"],
+                    "end_index": chunk["end_index"], "page": chunk["page_number"],
+                    "content_hash": text_hash, "embedding_model": model_key
+                }
+            ) for chunk, text_hash in zip(missing_chunks, text_hashes)]
+            await asyncio.to_thread(
+                self.qdrant_manager.add_documents, documents, document_id,
+                ids=[str(chunk["id"]) for chunk in missing_chunks], vectors=vectors
+            )
+        
+        if orphan_ids:
+            await asyncio.to_thread(self.qdrant_manager.delete_points, orphan_ids)
+        
+        result = {
+            "total": len(chunk_dict),
+            "added": sum(len(missing_chunks) for missing_chunks in missing_dict.values()),
+            "deleted": len(orphan_ids),
+            "legacy": len(legacy_dict) - sum(1 for point_id in orphan_ids if point_id in legacy_dict)
+        }
+        logger.info(f"Knowledge base {self.knowledge_base_id} consistency check: {result}")
+        return result
+    
+    async def sync_keyword_index(self) -> Dict[str, int]:
+        """
+        对比数据库中的分块和关键词索引，补充已处理完成的文档缺少的分块，删除已不存在的分块
+        正在处理的文档已经写入了分块和索引，不算多余的；升级前已处理的文档也会在这里建立索引
+        
+        Returns:
+            分块总数、补充的分块数、删除的分块数
+        """
+        from app.models.aitestrebort.knowledge import aitestrebortDocumentChunk
+        
+        keyword_index = KeywordIndex(self.knowledge_base_id)
+        index_ids = await asyncio.to_thread(keyword_index.get_chunk_ids)  # 和向量一样，先取索引再取分块
+        chunk_list = await aitestrebortDocumentChunk.filter(
+            document__knowledge_base_id=self.knowledge_base_id
+        ).values_list("id", "document_id", "document__status")
+        chunk_dict = {str(chunk_id): str(document_id) for chunk_id, document_id, _ in chunk_list}
+        completed_ids = {str(chunk_id) for chunk_id, _, status in chunk_list if status == 'completed'}
+        
+        # 按文档补充，同一个文档的分块一起重建
+        missing_ids = completed_ids - index_ids
+        for document_id in {chunk_dict[chunk_id] for chunk_id in missing_ids}:
+            chunk_list = await aitestrebortDocumentChunk.filter(document_id=document_id).values_list("id", "content")
+            await asyncio.to_thread(
+                keyword_index.add_chunks, str(document_id),
+                [(str(chunk_id), content) for chunk_id, content in chunk_list]
+            )
+        
+        orphan_ids = list(index_ids - chunk_dict.keys())
+        if orphan_ids:
+            await asyncio.to_thread(keyword_index.delete_chunks, orphan_ids)
+        
+        result = {"total": len(chunk_dict), "added": len(missing_ids), "deleted": len(orphan_ids)}
+        logger.info(f"Knowledge base {self.knowledge_base_id} keyword index check: {result}")
+        return result
+    
+    @classmethod
+    def start_check(cls):
+        """ 服务启动时在后台检查所有知识库 """
+        if cls._check_task is None or cls._check_task.done():
+            cls._check_task = asyncio.create_task(cls.check_all_consistency())
+            cls._check_task.add_done_callback(cls._on_check_done)
+    
+    @staticmethod
+    def _on_check_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Knowledge base consistency check failed: {task.exception()}", exc_info=task.exception())
+    
+    @classmethod
+    async def stop_check(cls):
+        """ 服务关闭时取消还没完成的检查 """
+        if cls._check_task is not None:
+            cls._check_task.cancel()
+            cls._check_task = None
+    
+    @staticmethod
+    def get_deploy_id() -> str:
+        """ 本次部署的标识，gunicorn 的 worker 重启后父进程（master）不变，只有重新部署才会变 """
+        import sys
+        return str(os.getppid() if "gunicorn" in sys.modules else os.getpid())
+    
+    @classmethod
+    async def check_all_consistency(cls):
+        """
+        服务启动时检查所有启用的知识库，多个worker只有一个会执行，全部检查成功后记录部署标识，
+        同一次部署中 worker 重启不再重复检查
+        内存模式下没有需要恢复的向量，只检查关键词索引
+        """
+        import portalocker
+        from app.models.aitestrebort.knowledge import aitestrebortKnowledgeBase
+        
+        storage_conf = QdrantManager.get_storage_conf()
+        migrate_legacy = bool((await Config.get_embedding_conf()).get("migrate_legacy_vectors", False))
+        check_vector = storage_conf["qdrant_url"] or storage_conf["qdrant_path"] not in (None, "", ":memory:")
+        try:
+            lock = portalocker.Lock(
+                os.path.join(KNOWLEDGE_INDEX_ADDRESS, "consistency_check.lock"), fail_when_locked=True)
+            lock.acquire()
+        except portalocker.exceptions.LockException:
+            return  # 其他worker正在检查
+        
+        deploy_id, marker_path = cls.get_deploy_id(), os.path.join(KNOWLEDGE_INDEX_ADDRESS, "consistency_check.done")
+        try:
+            if os.path.exists(marker_path):
+                with open(marker_path, encoding="utf-8") as file:
+                    if file.read().strip() == deploy_id:
+                        return  # 本次部署已经检查过
+            all_checked = True
+            for knowledge_base_id in await aitestrebortKnowledgeBase.filter(is_active=True).values_list("id", flat=True):
+                try:
+                    service = cls(str(knowledge_base_id))
+                    await service.sync_keyword_index()
+                    if check_vector:
+                        await service.initialize()
+                        if service.qdrant_manager:
+                            await service.check_consistency(migrate_legacy)
+                except Exception as e:
+                    logger.error(f"Failed to check knowledge base {knowledge_base_id}: {e}")
+                    all_checked = False
+            if all_checked:  # 有检查失败的，worker 重启时再检查一次
+                with open(marker_path, "w", encoding="utf-8") as file:
+                    file.write(deploy_id)
+        finally:
+            lock.release()
+    
     async def search_knowledge(
         self,
         query: str,
         top_k: int = 5,
-        score_threshold: float = 0.1
+        score_threshold: float = 0.1,
+        hybrid: Optional[bool] = None
     ) -> List[Dict[str, Any]]:
         """
         搜索知识库（使用 Qdrant 向量检索）
@@ -892,17 +1256,22 @@ class KnowledgeBaseService:
             query: 查询文本
             top_k: 返回结果数量
             score_threshold: 相似度阈值
+            hybrid: 是否同时使用关键词检索，合并两路结果，不传则按 knowledge_search_conf 配置
             
         Returns:
             搜索结果列表
         """
-        import asyncio
-        
         try:
+            if hybrid is None:
+                hybrid = (await Config.get_knowledge_search_conf()).get("hybrid", False)
+            
             if not self.qdrant_manager:
-                logger.warning("Qdrant manager not initialized, falling back to database search")
+                logger.warning("Qdrant manager not initialized, falling back to keyword search")
                 return await self._fallback_search(query, top_k, score_threshold)
             
+            if hybrid:
+                return await self.hybrid_search(query, top_k, score_threshold)
+            
             logger.info(f"开始Qdrant向量检索，query: {query[:50]}...")
             
             # 使用 asyncio.to_thread 避免阻塞事件循环
@@ -917,12 +1286,12 @@ class KnowledgeBaseService:
                 return results
             except Exception as search_error:
                 logger.error(f"Qdrant检索失败: {search_error}")
-                # 降级到数据库搜索
+                # 降级到关键词检索
                 return await self._fallback_search(query, top_k, score_threshold)
             
         except Exception as e:
             logger.error(f"Failed to search knowledge: {e}", exc_info=True)
-            # 降级到数据库搜索
+            # 降级到关键词检索
             return await self._fallback_search(query, top_k, score_threshold)
     
     async def _fallback_search(
@@ -932,7 +1301,7 @@ class KnowledgeBaseService:
         score_threshold: float = 0.1
     ) -> List[Dict[str, Any]]:
         """
-        降级搜索（使用数据库文本匹配）
+        降级搜索（使用关键词索引）
         
         Args:
             query: 查询文本
@@ -942,85 +1311,89 @@ class KnowledgeBaseService:
         Returns:
             搜索结果列表
         """
-        from app.models.aitestrebort.knowledge import aitestrebortDocumentChunk
-        
         try:
-            # 获取所有分块
-            chunks = await aitestrebortDocumentChunk.filter(
-                document__knowledge_base_id=self.knowledge_base_id,
-                document__status='completed'
-            ).prefetch_related('document').all()
-            
-            logger.info(f"Found {len(chunks)} chunks to search")
-            
-            if not chunks:
-                logger.warning("No chunks found in knowledge base")
-                return []
-            
-            # 改进的文本匹配（支持分词）
-            logger.info("Performing improved text matching")
-            results = []
-            
-            # 分词查询
-            import re
-            query_lower = query.lower()
-            # 提取中文字符和英文单词
-            chinese_chars = re.findall(r'[\u4e00-\u9fff]+', query)
-            english_words = re.findall(r'[a-zA-Z]+', query_lower)
-            
-            query_terms = chinese_chars + english_words
-            if not query_terms:
-                query_terms = [query_lower]
-            
-            logger.info(f"Query terms: {query_terms}, score_threshold: {score_threshold}")
-            
-            matched_count = 0
-            for chunk in chunks:
-                content_lower = chunk.content.lower()
-                
-                # 计算匹配度
-                match_count = 0
-                total_match_length = 0
-                for term in query_terms:
-                    term_lower = term.lower()
-                    if term_lower in content_lower:
-                        match_count += 1
-                        # 计算匹配长度占比
-                        total_match_length += len(term)
-                
-                # 如果至少匹配一个词，就加入结果
-                if match_count > 0:
-                    # 改进的评分算法：考虑匹配词数和匹配长度
-                    term_match_score = match_count / len(query_terms)
-                    length_match_score = total_match_length / len(query)
-                    score = (term_match_score * 0.7 + length_match_score * 0.3)
-                    
-                    matched_count += 1
-                    
-                    # 应用相似度阈值
-                    if score >= score_threshold:
-                        results.append({
-                            'content': chunk.content,
-                            'score': score,
-                            'metadata': {
-                                'document_id': str(chunk.document.id),
-                                'document_title': chunk.document.title,
-                                'chunk_index': chunk.chunk_index
-                            }
-                        })
-                    else:
-                        logger.debug(f"Chunk score {score:.2f} below threshold {score_threshold}")
-            
-            logger.info(f"Matched {matched_count} chunks, {len(results)} passed threshold")
-            
-            # 按分数排序
-            results.sort(key=lambda x: x['score'], reverse=True)
-            
-            logger.info(f"Search completed, found {len(results)} matching chunks")
-            
-            # 返回前top_k个结果
-            return results[:top_k]
-            
+            return await self.keyword_search(query, top_k, score_threshold)
         except Exception as e:
             logger.error(f"Fallback search failed: {e}")
             return []
+    
+    async def keyword_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        score_threshold: float = 0.1
+    ) -> List[Dict[str, Any]]:
+        """
+        关键词检索，BM25 排序
+        
+        Args:
+            query: 查询文本
+            top_k: 返回结果数量
+            score_threshold: 相似度阈值，分数为 BM25 分数除以最高分，第一条为 1
+            
+        Returns:
+            搜索结果列表
+        """
+        from app.models.aitestrebort.knowledge import aitestrebortDocumentChunk
+        
+        hits = await asyncio.to_thread(KeywordIndex(self.knowledge_base_id).search, query, top_k)
+        if not hits:
+            return []
+        
+        # 只查命中的分块
+        chunk_dict = {str(chunk.id): chunk for chunk in await aitestrebortDocumentChunk.filter(
+            id__in=[hit["chunk_id"] for hit in hits],
+            document__status='completed'
+        ).prefetch_related('document')}
+        
+        results, top_score = [], hits[0]["score"] or 1
+        for hit in hits:
+            chunk, score = chunk_dict.get(hit["chunk_id"]), hit["score"] / top_score
+            if chunk is None or score < score_threshold:
+                continue
+            results.append({
+                'content': chunk.content,
+                'score': score,
+                'metadata': {
+                    'document_id': str(chunk.document.id),
+                    'document_title': chunk.document.title,
+                    'chunk_index': chunk.chunk_index,
+                    'chunk_id': hit["chunk_id"]
+                }
+            })
+        
+        logger.info(f"Keyword search completed, found {len(results)} matching chunks")
+        return results
+    
+    async def hybrid_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        score_threshold: float = 0.1,
+        rrf_k: int = 60
+    ) -> List[Dict[str, Any]]:
+        """
+        混合检索，向量检索和关键词检索同时进行，按 RRF（倒数排名融合）合并排序
+        
+        Args:
+            query: 查询文本
+            top_k: 返回结果数量
+            score_threshold: 相似度阈值，两路检索各自过滤
+            rrf_k: RRF 平滑常数
+            
+        Returns:
+            搜索结果列表，score 为向量检索的相似度（只有关键词命中的为关键词分数），rrf_score 为融合分数
+        """
+        vector_results, keyword_results = await asyncio.gather(
+            asyncio.to_thread(
+                self.qdrant_manager.similarity_search, query=query, k=top_k * 2, score_threshold=score_threshold),
+            self.keyword_search(query, top_k * 2, score_threshold)
+        )
+        
+        result_dict = {}
+        for results in (vector_results, keyword_results):
+            for rank, result in enumerate(results):
+                key = result['metadata'].get('chunk_id') or result['content']
+                result_dict.setdefault(key, {**result, 'rrf_score': 0})['rrf_score'] += 1 / (rrf_k + rank + 1)
+        
+        return sorted(result_dict.values(), key=lambda x: x['rrf_score'], reverse=True)[:top_k]
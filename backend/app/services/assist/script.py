@@ -1,5 +1,4 @@
 import importlib
-import sys
 import types
 import traceback
 
@@ -41,6 +40,7 @@ async def debug_script(request: Request, form: schema.DebugScriptForm):
     # 动态导入脚本
     try:
         import_path = f'script_list.{name}'
+        Script.clear_script_cache()  # 要重新加载模块，已编译的函数不再可用
         func_list = importlib.reload(importlib.import_module(import_path))
         module_functions_dict = {
             name: item for name, item in vars(func_list).items() if isinstance(item, types.FunctionType)
@@ -62,7 +62,7 @@ async def debug_script(request: Request, form: schema.DebugScriptForm):
             "script": FileUtil.get_func_data_by_script_name(f'{form.env}_{script.name}')
         })
     except Exception as e:
-        sys.stdout = sys.__stdout__  # 恢复输出到console
+        RedirectPrintLogToMemory.redirect_to_default()  # 恢复输出到console
         error_data = "\n".join("{}".format(traceback.format_exc()).split("↵"))
         request.app.logger.error(error_data)
         return request.app.fail(msg="语法错误，请检查", result={
@@ -89,6 +89,7 @@ async def change_script(request: Request, form: schema.EditScriptForm):
     save_func_permissions = await Config.get_save_func_permissions()
     await form.validate_request(request.state.user, save_func_permissions)
     await Script.filter(id=form.id).update(**form.get_update_data(request.state.user.id))
+    Script.clear_script_cache()
     return request.app.put_success()
 
 
@@ -114,4 +115,5 @@ async def delete_script(request: Request, form: schema.DeleteScriptForm):
             raise ValueError(f'{name}【{project["name"]}】已引用此脚本文件，请先解除依赖再删除')
 
     await script.model_delete()
+    Script.clear_script_cache()
     return request.app.delete_success()
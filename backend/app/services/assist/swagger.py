@@ -1,8 +1,9 @@
 import json
 import os.path
 
-import requests
+import httpx
 from fastapi import Request, Depends
+from tortoise.expressions import Q
 
 from utils.logs.log import logger
 from ...models.assist.model_factory import SwaggerPullLog
@@ -12,52 +13,50 @@ from app.schemas.enums import DataStatusEnum
 from ...schemas.assist import swagger as schema
 
 
-def get_swagger_data(swagger_addr):
+async def get_swagger_data(swagger_addr):
     """ 获取swagger数据 """
     try:
-        # 添加超时设置和更好的错误处理
-        response = requests.get(swagger_addr, verify=False, timeout=30)
-        response.raise_for_status()  # 如果状态码不是200会抛出HTTPError
+        async with httpx.AsyncClient(verify=False) as client:
+            response = await client.get(swagger_addr, timeout=30)
+        response.raise_for_status()  # 如果状态码不是200会抛出HTTPStatusError
         return response.json()
-    except requests.exceptions.ConnectionError:
-        raise requests.exceptions.ConnectionError(f"无法连接到Swagger服务：{swagger_addr}")
-    except requests.exceptions.Timeout:
-        raise requests.exceptions.Timeout(f"请求Swagger服务超时：{swagger_addr}")
-    except requests.exceptions.HTTPError as e:
-        raise requests.exceptions.HTTPError(f"HTTP请求错误：{e.response.status_code} - {e.response.reason}")
+    except httpx.TimeoutException:
+        raise httpx.TimeoutException(f"请求Swagger服务超时：{swagger_addr}")
+    except httpx.TransportError:
+        raise httpx.ConnectError(f"无法连接到Swagger服务：{swagger_addr}")
+    except httpx.HTTPStatusError as e:
+        raise httpx.HTTPStatusError(
+            f"HTTP请求错误：{e.response.status_code} - {e.response.reason_phrase}", request=e.request, response=e.response)
     except json.JSONDecodeError:
         raise json.JSONDecodeError("返回的数据不是有效的JSON格式", "", 0)
 
 
-async def get_parsed_module(module_dict, project_id, controller_name, controller_tags, options):
-    """ 获取已解析的模块 """
-
-    # 已解析，则直接返回
-    if controller_name in module_dict:
-        return module_dict.get(controller_name)
-
-    # 已拉取过，则直接从数据库获取
-    module = await ApiModule.filter(project_id=project_id, controller=controller_name).first()
-    if module:
-        if 'controller_name' in options:  # 用户选择了要跟新模块名字
-            await module.model_update({
-                "controller": controller_name,
-                "name": controller_tags.get(controller_name, controller_name)
-            })
-
-        module_dict[module.controller] = module
-        return module
-
-    # 未拉取过，则先解析并保存，再返回
-    module = await ApiModule.model_create({
-        "project_id": project_id,
-        "controller": controller_name,
-        "name": controller_tags.get(controller_name, controller_name),  # 有tag就用tag，没有就用controller名字
-        # "num": ApiModule.get_insert_num(project_id=project_id)
-    })
-    module_dict[module.controller] = module
-
-    return module
+async def get_project_module_dict(project_id, controller_name_list, controller_tags, options):
+    """ 一次查出服务下所有的模块，没有的批量新增，用户选择了更新模块名字的批量更新，返回 {controller: module} """
+    module_dict = {}
+    for module in await ApiModule.filter(project_id=project_id).order_by("id"):
+        module_dict.setdefault(module.controller, module)
+
+    add_module_list = [
+        ApiModule(project_id=project_id, controller=controller_name, name=controller_tags.get(controller_name, controller_name))
+        for controller_name in controller_name_list if controller_name not in module_dict
+    ]  # 有tag就用tag，没有就用controller名字
+    if add_module_list:
+        await ApiModule.bulk_create(add_module_list, batch_size=500)
+        add_controller_list = [module.controller for module in add_module_list]
+        for module in await ApiModule.filter(project_id=project_id, controller__in=add_controller_list).order_by("id"):
+            module_dict.setdefault(module.controller, module)
+
+    if 'controller_name' in options:  # 用户选择了要更新模块名字
+        change_module_list = []
+        for controller_name in controller_name_list:
+            module, name = module_dict[controller_name], controller_tags.get(controller_name, controller_name)
+            if module.name != name:
+                module.name = name
+                change_module_list.append(module)
+        if change_module_list:
+            await ApiModule.bulk_update(change_module_list, fields=["name"], batch_size=500)
+    return module_dict
 
 
 def get_request_body_type(content_type):
@@ -73,13 +72,13 @@ def get_request_body_type(content_type):
 def assert_is_update(api_msg, options):
     """ 判断参数是否需要更新 """
     header_update, params_update, data_json_update, data_form_update = False, False, False, False
-    if "headers" in options and (api_msg.headers is None or api_msg.headers[0]["key"] is None):
+    if "headers" in options and (not api_msg.headers or api_msg.headers[0]["key"] is None):
         header_update = True
-    if "query" in options and (api_msg.params is None or api_msg.params[0]["key"] is None):
+    if "query" in options and (not api_msg.params or api_msg.params[0]["key"] is None):
         params_update = True
     if "json" in options and (api_msg.data_json is None or not api_msg.data_json):
         data_json_update = True
-    if "form" in options and (api_msg.data_form is None or api_msg.data_form[0]["key"] is None):
+    if "form" in options and (not api_msg.data_form or api_msg.data_form[0]["key"] is None):
         data_form_update = True
     return header_update, params_update, data_json_update, data_form_update
 
@@ -312,23 +311,25 @@ def list_to_dict(data: list):
 
 
 def parse_openapi3_args(db_api, swagger_api, data_models, options):
-    """ 解析 openapi3 的参数 """
+    """ 解析 openapi3 的参数，和 swagger2 一样，只填充用户选择了的、且接口上还为空的部分，不覆盖用户维护过的数据 """
     headers, query, json_data, form_data, response_template = [], [], {}, [], {}
+    update_header, update_params, update_data_json, update_data_form = assert_is_update(db_api, options)
+    update_response = "response" in options and not db_api.response
 
     swagger_headers_dict, swagger_query_dict = parse_openapi3_parameters(swagger_api.get("parameters", []))
-    if "headers" in options:  # 请求头
+    if update_header:  # 请求头
         headers = dict_to_list(merge_dict(list_to_dict(db_api.headers), swagger_headers_dict))
-    if "query" in options:  # 查询字符串参数
+    if update_params:  # 查询字符串参数
         query = dict_to_list(merge_dict(list_to_dict(db_api.params), swagger_query_dict))
 
     swagger_request_body_content = swagger_api.get("requestBody", {}).get("content", {})
     swagger_json_data, swagger_form_data = parse_openapi3_request_body(swagger_request_body_content, data_models)
-    if "json" in options:  # json参数
+    if update_data_json:  # json参数
         json_data = merge_data_json(db_api.data_json, swagger_json_data)
-    if "form" in options:  # form-data参数
+    if update_data_form:  # form-data参数
         form_data = dict_to_list(merge_dict(list_to_dict(db_api.data_form), swagger_form_data))
 
-    if "response" in options:  # 响应
+    if update_response:  # 响应
         ref_model = \
             swagger_api.get("responses",
                             {}).get("200",
@@ -336,9 +337,12 @@ def parse_openapi3_args(db_api, swagger_api, data_models, options):
                                             {}).get("*/*", {}).get("schema", {}).get("$ref", "").split("/")[-1]  # 数据模型
         response_template = parse_openapi3_response(ref_model, data_models)
 
-    # 更新api数据
-    db_api.headers, db_api.params, db_api.data_json, db_api.data_form = headers, query, json_data, form_data
-    db_api.response = response_template
+    # 更新api数据，只更新用户选择了的、为空的部分
+    update_obj(db_api, "headers", headers, update_header)
+    update_obj(db_api, "params", query, update_params)
+    update_obj(db_api, "data_json", json_data, update_data_json)
+    update_obj(db_api, "data_form", form_data, update_data_form)
+    update_obj(db_api, "response", response_template, update_response)
 
 
 async def get_pull_swagger_log_list(request: Request, form: schema.GetPullLogListForm = Depends()):
@@ -355,24 +359,24 @@ async def get_pull_swagger_log(request: Request, form: schema.GetPullLogForm = D
 async def pull_swagger(request: Request, form: schema.SwaggerPullForm):
     """ 根据指定服务的swagger拉取所有数据 """
     # options: ['controller_name', 'api_name', 'headers', 'query', 'json', 'form', 'response']
-    options, module_dict = form.options, {}
+    options = form.options
     project = await ApiProject.validate_is_exist("服务不存在", id=form.project_id)
     pull_log = await SwaggerPullLog.model_create({"project_id": project.id, "pull_args": options}, request.state.user)
     swagger_data = {}
     try:
-        swagger_data = get_swagger_data(project.swagger)  # swagger数据
+        swagger_data = await get_swagger_data(project.swagger)  # swagger数据
         status = swagger_data.get("status")
         if status and status >= 400:
             await pull_log.pull_fail(project, swagger_data)
             error_msg = swagger_data.get("message", swagger_data.get("error", "未知错误"))
             return request.app.fail(f"Swagger数据拉取失败！\n错误原因：{error_msg}\n状态码：{status}\n\n请检查：\n1. Swagger地址是否正确\n2. 服务是否正常运行\n3. 网络连接是否正常")
-    except requests.exceptions.ConnectionError as error:
-        await pull_log.pull_fail(project, swagger_data)
-        return request.app.fail(f"Swagger数据拉取失败！\n错误原因：无法连接到Swagger服务\n\n请检查：\n1. Swagger地址是否正确\n2. 服务是否正常运行\n3. 网络连接是否正常\n\n技术详情：{str(error)}")
-    except requests.exceptions.Timeout as error:
+    except httpx.TimeoutException as error:
         await pull_log.pull_fail(project, swagger_data)
         return request.app.fail(f"Swagger数据拉取失败！\n错误原因：请求超时\n\n请检查：\n1. 服务响应是否过慢\n2. 网络连接是否稳定\n\n技术详情：{str(error)}")
-    except requests.exceptions.HTTPError as error:
+    except httpx.TransportError as error:
+        await pull_log.pull_fail(project, swagger_data)
+        return request.app.fail(f"Swagger数据拉取失败！\n错误原因：无法连接到Swagger服务\n\n请检查：\n1. Swagger地址是否正确\n2. 服务是否正常运行\n3. 网络连接是否正常\n\n技术详情：{str(error)}")
+    except httpx.HTTPStatusError as error:
         await pull_log.pull_fail(project, swagger_data)
         return request.app.fail(f"Swagger数据拉取失败！\n错误原因：HTTP请求错误\n\n请检查：\n1. Swagger地址是否正确\n2. 服务是否返回有效的Swagger文档\n\n技术详情：{str(error)}")
     except json.JSONDecodeError as error:
@@ -383,74 +387,143 @@ async def pull_swagger(request: Request, form: schema.SwaggerPullForm):
         return request.app.fail(f"Swagger数据拉取失败！\n错误原因：{str(error)}\n\n请检查：\n1. Swagger地址格式是否正确（如：http://localhost:8080/v2/api-docs）\n2. 目标服务是否正常运行\n3. 网络连接是否正常\n4. Swagger文档格式是否符合规范")
     await pull_log.pull_success(project)
 
-    # 解析已有的controller描述
-    controller_tags = {tag["name"]: tag.get("description", tag["name"]) for tag in swagger_data.get("tags", [])}
+    swagger_file = os.path.join(SWAGGER_FILE_ADDRESS, f"{project.id}.json")
+    last_swagger_data = get_last_swagger_data(swagger_file)
+    diff_count = await import_swagger_data(project.id, swagger_data, options, last_swagger_data)
+    request.app.logger.info(f"swagger数据导入完成：{diff_count}")
+
+    # 同步完成后，保存原始数据，下次拉取时用于判断swagger上有哪些变化
+    FileUtil.delete_file(swagger_file)
+    FileUtil.save_file(swagger_file, swagger_data)
+
+    return request.app.success(
+        f'数据拉取并更新完成，新增接口{diff_count["add"]}个，更新接口{diff_count["change"]}个，未变化接口{diff_count["unchanged"]}个')
+
+
+def get_api_key(method, addr):
+    """ 接口的唯一标识，请求方式+地址，地址中的路径参数（swagger上为{xx}，测试平台上可能改成了$xx）统一替换为{} """
+    return method.upper(), "/".join("{}" if "{" in part or "$" in part else part for part in addr.split("/"))
+
+
+swagger_update_fields = [
+    "name", "status", "module_id", "body_type", "headers", "params", "data_json", "data_form", "response"
+]  # 拉取swagger时可能会更新的已有接口的字段
+
+
+def get_last_swagger_data(swagger_file):
+    """ 上次拉取时保存的swagger数据，没有或者读取失败则返回None """
+    if not os.path.exists(swagger_file):
+        return None
+    try:
+        with open(swagger_file, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except Exception as error:
+        logger.warning(f"读取上次拉取的swagger数据失败：{error}")
+        return None
+
 
-    add_api_list = []
-    for api_addr, api_data in swagger_data["paths"].items():
+def get_swagger_api_list(swagger_data):
+    """ 解析swagger上的接口，[(接口地址, 请求方式, 接口数据, controller名字, 接口属性)]
+    接口属性为swagger决定的接口状态、请求参数类型
+    """
+    api_list = []
+    for api_addr, api_data in swagger_data.get("paths", {}).items():
         for api_method, swagger_api in api_data.items():
-            # 处理模块
             controller_name = swagger_api.get("tags")[0] if swagger_api.get("tags") else "默认分组"
-            module = await get_parsed_module(module_dict, project.id, controller_name, controller_tags, options)
-
-            # 处理接口
-            request.app.logger.info(f"解析接口地址：{api_addr}")
-            request.app.logger.info(f"解析接口数据：{swagger_api}")
-            # 处理 deprecated 字段，将布尔值转换为对应的枚举值
-            deprecated = swagger_api.get("deprecated", False)
-            status = DataStatusEnum.DISABLE if deprecated else DataStatusEnum.ENABLE
-            
-            api_template = {
-                "status": status,
-                "project_id": project.id,
-                "module_id": module.id,
-                "method": api_method.upper(),
-                "addr": api_addr,
-                "body_type": "json"
+            # swagger2和openapi3格式不一样，请求数据类型的位置不一样
+            if "2" in swagger_data.get("swagger", ""):  # swagger2
+                content_type = swagger_api.get("consumes", ["json"])[0]
+            else:  # openapi 3
+                content_type = list(swagger_api.get("requestBody", {}).get("content", {"application/json": ""}).keys())[0]
+            api_attrs = {
+                # 处理 deprecated 字段，将布尔值转换为对应的枚举值
+                "status": DataStatusEnum.DISABLE if swagger_api.get("deprecated", False) else DataStatusEnum.ENABLE,
+                "body_type": get_request_body_type(content_type)
             }
+            api_list.append((api_addr, api_method, swagger_api, controller_name, api_attrs))
+    return api_list
 
-            # 根据接口地址 获取/实例化 接口对象
-            if "{" in api_addr:  # URL中可能有参数化"/XxXx/xx/{batchNo}"
-                split_api_addr = api_addr.split("{")[0]
-                db_api = await ApiMsg.filter(addr__icontains=split_api_addr, module_id=module.id).first() or ApiMsg()
-                if db_api.id and "$" in db_api.addr:  # 已经在测试平台修改过接口地址的路径参数
-                    api_msg_addr_split = db_api.addr.split("$")
-                    api_msg_addr_split[0] = split_api_addr
-                    api_template["addr"] = "$".join(api_msg_addr_split)
-            else:
-                db_api = await ApiMsg.filter(addr=api_addr, module_id=module.id).first() or ApiMsg()
 
-            # swagger2和openapi3格式不一样，处理方法不一样
-            if "2" in swagger_data.get("swagger", ""):  # swagger2
-                content_type = swagger_api.get("consumes", ["json"])[0]  # 请求数据类型
-                parse_swagger2_args(db_api, swagger_api, swagger_data, options)  # 处理参数
-            # elif "3" in swagger_data.get("openapi", ""):  # openapi 3
-            else:  # openapi 3
-                content_types = swagger_api.get("requestBody", {}).get("content", {"application/json": ""})
-                content_type = list(content_types.keys())[0]
-                data_models = swagger_data.get("components", {}).get("schemas", {})
-                parse_openapi3_args(db_api, swagger_api, data_models, options)  # 处理参数
+def get_api_snapshot(db_api):
+    """ 接口会被swagger更新的字段的快照，用于判断是否有变化 """
+    return {field: json.dumps(getattr(db_api, field), ensure_ascii=False, sort_keys=True, default=str)
+            for field in swagger_update_fields}
 
-            # 处理请求参数类型
-            api_template["body_type"] = get_request_body_type(content_type)
 
-            # 新的接口则赋值
+async def import_swagger_data(project_id, swagger_data, options, last_swagger_data=None, batch_size=500):
+    """ 把swagger数据导入到服务下
+    1、一次查出服务下所有的模块、接口，按 请求方式+地址 和swagger上的接口对比
+    2、在内存中算出新增、有变化、无变化的接口，新增的批量插入，有变化的只批量更新变化的字段，无变化的不操作
+    3、已有接口的状态、所属模块、请求参数类型用户可能改过，只有swagger上这些数据和上次拉取时（last_swagger_data）相比有变化了才更新，
+       参数只填充用户选择了的、且接口上还为空的部分
+    """
+    # 解析已有的controller描述
+    controller_tags = {tag["name"]: tag.get("description", tag["name"]) for tag in swagger_data.get("tags", [])}
+    swagger_api_list = get_swagger_api_list(swagger_data)
+    last_api_dict = {
+        get_api_key(api_method, api_addr): (controller_name, api_attrs)
+        for api_addr, api_method, _, controller_name, api_attrs in get_swagger_api_list(last_swagger_data or {})
+    }
+    module_dict = await get_project_module_dict(
+        project_id, list(dict.fromkeys(item[3] for item in swagger_api_list)), controller_tags, options)
+
+    # 服务下已有的接口
+    module_id_list = [module.id for module in module_dict.values()]
+    db_api_dict = {}
+    for db_api in await ApiMsg.filter(Q(project_id=project_id) | Q(module_id__in=module_id_list)).order_by("id"):
+        if db_api.addr and db_api.method:
+            db_api_dict.setdefault(get_api_key(db_api.method, db_api.addr), db_api)
+
+    add_api_list, change_api_dict, change_field_set, unchanged_count = [], {}, set(), 0
+    for api_addr, api_method, swagger_api, controller_name, api_attrs in swagger_api_list:
+        module = module_dict[controller_name]
+
+        # 根据 请求方式+地址 获取/实例化 接口对象
+        api_key = get_api_key(api_method, api_addr)
+        db_api = db_api_dict.pop(api_key, None) or ApiMsg()  # 取出后不再参与匹配，避免多个swagger接口匹配到同一个接口
+        snapshot = get_api_snapshot(db_api) if db_api.id else None
+
+        # swagger2和openapi3格式不一样，处理方法不一样
+        if "2" in swagger_data.get("swagger", ""):  # swagger2
+            parse_swagger2_args(db_api, swagger_api, swagger_data, options)  # 处理参数
+        # elif "3" in swagger_data.get("openapi", ""):  # openapi 3
+        else:  # openapi 3
+            data_models = swagger_data.get("components", {}).get("schemas", {})
+            parse_openapi3_args(db_api, swagger_api, data_models, options)  # 处理参数
+
+        if db_api.id is None:  # 没有id，则为新增
+            api_template = {
+                "project_id": project_id,
+                "module_id": module.id,
+                "method": api_method.upper(),
+                "addr": api_addr,
+                "name": swagger_api.get("summary", "接口未命名"),
+                **api_attrs
+            }
             for key, value in api_template.items():
-                if hasattr(db_api, key):
+                setattr(db_api, key, value)
+            add_api_list.append(db_api)
+            continue
+
+        # 已有的接口，只同步swagger上有变化的状态、所属模块、请求参数类型，没有上次拉取的数据则不更新
+        last_controller_name, last_api_attrs = last_api_dict.get(api_key, (None, None))
+        if last_api_attrs is not None:
+            for key, value in api_attrs.items():
+                if value != last_api_attrs[key]:
                     setattr(db_api, key, value)
-
-            if db_api.id is None:  # 没有id，则为新增
-                db_api.name = swagger_api.get("summary", "接口未命名")
-                add_api_list.append(db_api)
-            else:
-                if 'api_name' in options:  # 用户选择了要更新接口名字
-                    db_api.name = swagger_api.get("summary", "接口未命名")
-
-    await ApiMsg.bulk_create(add_api_list)  # 批量插入接口
-
-    # 同步完成后，保存原始数据
-    swagger_file = os.path.join(SWAGGER_FILE_ADDRESS, f"{project.id}.json")
-    FileUtil.delete_file(swagger_file)
-    FileUtil.save_file(swagger_file, swagger_data)
-
-    return request.app.success("数据拉取并更新完成")
+            if controller_name != last_controller_name:
+                db_api.module_id = module.id
+        if 'api_name' in options:  # 用户选择了要更新接口名字
+            db_api.name = swagger_api.get("summary", "接口未命名")
+        change_field_list = [field for field, value in get_api_snapshot(db_api).items() if value != snapshot[field]]
+        if change_field_list:
+            change_api_dict[db_api.id] = db_api
+            change_field_set.update(change_field_list)
+        else:
+            unchanged_count += 1
+
+    if add_api_list:
+        await ApiMsg.bulk_create(add_api_list, batch_size=batch_size)  # 批量插入接口
+    if change_api_dict:
+        await ApiMsg.bulk_update(list(change_api_dict.values()), fields=list(change_field_set), batch_size=batch_size)
+    return {"add": len(add_api_list), "change": len(change_api_dict), "unchanged": unchanged_count}
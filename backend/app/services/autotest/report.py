@@ -1,4 +1,5 @@
 from fastapi import Request, BackgroundTasks, Depends
+from fastapi.responses import FileResponse
 
 from app.schemas.enums import ApiCaseSuiteTypeEnum, ReceiveTypeEnum, SendReportTypeEnum
 from utils.message.send_report import send_report
@@ -138,6 +139,15 @@ async def get_report_step_img(request: Request, form: schema.GetReportStepImgFor
     return request.app.get_success({"data": data, "total": 1 if data else 0})
 
 
+async def get_report_step_img_file(request: Request, form: schema.GetReportStepImgForm = Depends()):
+    """ 直接返回截图文件，旧报告的base64文本截图仍然走 get_report_step_img """
+    file_path = FileUtil.get_report_step_img_path(
+        form.report_id, form.report_step_id, form.img_type, request.app.test_type)
+    if file_path is None or file_path.endswith(".txt"):
+        return request.app.fail("截图不存在")
+    return FileResponse(file_path)
+
+
 async def get_report_status(request: Request, form: schema.GetReportStatusForm = Depends()):
     model = ApiReport if request.app.test_type == "api" else AppReport if request.app.test_type == "app" else UiReport
     data = await model.select_is_all_status_by_batch_id(form.batch_id, [form.process, form.status])
@@ -86,21 +86,29 @@ async def disable_task(request: Request, form: schema.GetTaskForm):
 
 
 async def run_task(request: Request, form: schema.RunTaskForm, background_tasks: BackgroundTasks):
+    user_id = await User.get_run_user_id(request)
+    data = await trigger_task(request.app.test_type, form, user_id, background_tasks.add_task)
+    return request.app.trigger_success(data)
+
+
+async def trigger_task(test_type, form: schema.RunTaskForm, user_id, add_task):
+    """ 生成报告并把用例运行加到 add_task 中，接口触发和定时任务队列触发共用
+    add_task: 接收运行函数（parse_and_run），由调用方决定在后台运行还是等待运行完毕
+    """
     task_model, case_runner, project_model, suite_model, case_model, step_model, report_model = ApiTask, RunApiCase, ApiProject, ApiCaseSuite, ApiCase, ApiStep, ApiReport
-    if request.app.test_type == "app":
+    if test_type == "app":
         task_model, case_runner, project_model, suite_model, case_model, step_model, report_model = AppTask, RunUiCase, AppProject, AppCaseSuite, AppCase, AppStep, AppReport
-    elif request.app.test_type == "ui":
+    elif test_type == "ui":
         task_model, case_runner, project_model, suite_model, case_model, step_model, report_model = UiTask, RunUiCase, UiProject, UiCaseSuite, UiCase, UiStep, UiReport
 
     task = await task_model.validate_is_exist("任务不存在", id=form.id_list[0])
     case_id_list = await suite_model.get_case_id(case_model, task.project_id, task.suite_ids, task.case_ids)
-    user_id = await User.get_run_user_id(request)
     batch_id = report_model.get_batch_id(user_id)
     env_list = form.env_list or task.env_list
 
     # 如果是app自动化测试，需要获取设备数据
     appium_config = {}
-    if request.app.test_type == "app":
+    if test_type == "app":
         server_id = form.server_id or task.conf["server_id"]
         phone_id = form.phone_id or task.conf["phone_id"]
         no_reset = form.no_reset or task.conf["no_reset"]
@@ -125,13 +133,13 @@ async def run_task(request: Request, form: schema.RunTaskForm, background_tasks:
         )
 
         # 后台任务运行测试
-        background_tasks.add_task(case_runner(
+        add_task(case_runner(
             report_id=report.id, case_id_list=case_id_list, is_async=form.is_async, env_code=env_code, env_name=env["name"],
-            browser=form.browser or task.conf["browser"], task_dict=dict(task), temp_variables=form.temp_variables, run_type=request.app.test_type,
+            browser=form.browser or task.conf["browser"], task_dict=dict(task), temp_variables=form.temp_variables, run_type=test_type,
             extend={}, appium_config=appium_config
         ).parse_and_run)
 
-    return request.app.trigger_success({
+    return {
         "batch_id": batch_id,
         "report_id": report.id if len(env_list) == 1 else None
-    })
+    }
@@ -1,5 +1,6 @@
 import datetime
 import asyncio
+import time
 import copy
 import json
 
@@ -7,7 +8,9 @@ import httpx
 from fastapi import Request, Depends
 
 from ...schemas.system import job as schema
-from ...schemas.enums import ReceiveTypeEnum, DataStatusEnum
+from ...schemas.enums import ReceiveTypeEnum, DataStatusEnum, TriggerTypeEnum
+from ...schemas.autotest.task import RunTaskForm
+from ..autotest.task import trigger_task
 from ...models.assist.hits import Hits
 from ...models.autotest.case import ApiCase, UiCase, AppCase
 from ...models.autotest.page import ApiMsg
@@ -15,11 +18,13 @@ from ...models.autotest.project import ApiProject, ApiProjectEnv, UiProject, App
 from ...models.autotest.step import ApiStep, UiStep, AppStep
 from ...models.autotest.suite import ApiCaseSuite, UiCaseSuite, AppCaseSuite
 from ...models.autotest.task import ApiTask, UiTask, AppTask
-from ...models.system.model_factory import ApschedulerJobs, JobRunLog
+from ...models.system.model_factory import ApschedulerJobs, JobRunLog, TaskRunQueue, User
+from ...models.config.config import Config
 from ...models.config.model_factory import BusinessLine
 from ...models.autotest.model_factory import ApiProject as Project, ApiReport, ApiReportCase, ApiReportStep, \
     UiReport, UiReportCase, UiReportStep, AppReport, AppReportCase, AppReportStep
 from utils.util.file_util import FileUtil
+from utils.logs.log import logger
 from utils.message.send_report import send_business_stage_count
 from app.configs.config import job_server_host
 
@@ -97,6 +102,9 @@ class JobFuncs:
         await AppReportCase.filter(report_id__in=delete_report_id).delete()
         await AppReportStep.filter(report_id__in=delete_report_id).delete()
 
+        # 清理已经执行完的定时任务触发记录
+        await TaskRunQueue.filter(status__in=[2, 3, 4], create_time__lt=time_point).delete()
+
     @classmethod
     async def cron_clear_step(cls):
         """
@@ -267,6 +275,89 @@ class JobFuncs:
             await run_log.run_success(business_template)
 
 
+class TaskDispatcher:
+    """ 定时任务触发队列的消费者，每个worker启动时都会启动，从 TaskRunQueue 领取任务直接在进程内执行
+    - 同时执行的任务数不超过 max_concurrency，执行满了就不再领取，留给其他worker
+    - 触发后超过 misfire_grace_time 秒还没被领取的任务不再执行
+    - 执行中的任务每 lease_timeout / 3 秒续租一次，超过 lease_timeout 秒没有续租的（worker已退出）放回队列
+    - 执行完超过 keep_days 天的记录定时清理
+    """
+    max_concurrency = 10
+    poll_interval = 1
+    misfire_grace_time = 600
+    lease_timeout = 300
+    keep_days = 7
+    maintain_interval = 3600  # 清理记录的间隔，秒
+    _loop_task = None
+    _running_dict = {}  # {执行中的任务: 队列id}
+
+    @classmethod
+    def configure(cls, max_concurrency=10, poll_interval=1, misfire_grace_time=600, lease_timeout=300, keep_days=7,
+                  **kwargs):
+        cls.max_concurrency, cls.poll_interval, cls.misfire_grace_time = \
+            max(int(max_concurrency), 1), max(float(poll_interval), 0.1), int(misfire_grace_time)
+        cls.lease_timeout, cls.keep_days = max(int(lease_timeout), 30), max(int(keep_days), 1)
+
+    @classmethod
+    def start(cls):
+        if cls._loop_task is None:
+            cls._loop_task = asyncio.create_task(cls.consume_loop())
+
+    @classmethod
+    async def stop(cls):
+        if cls._loop_task is not None:
+            cls._loop_task.cancel()
+            cls._loop_task = None
+
+    @classmethod
+    async def consume_loop(cls):
+        try:
+            await TaskRunQueue.create_table()
+        except Exception as error:
+            logger.error(f"创建定时任务触发队列表失败：{error}")
+        renew_time = maintain_time = 0
+        while True:
+            try:
+                cls.configure(**await Config.get_task_dispatch_conf())
+                now = time.monotonic()
+                if now - renew_time >= cls.lease_timeout / 3:
+                    renew_time = now
+                    await TaskRunQueue.renew(list(cls._running_dict.values()))
+                    await TaskRunQueue.recover(cls.lease_timeout)
+                if now - maintain_time >= cls.maintain_interval:
+                    maintain_time = now
+                    await TaskRunQueue.purge(cls.keep_days)
+
+                free_count = cls.max_concurrency - len(cls._running_dict)
+                if free_count > 0:
+                    for queue in await TaskRunQueue.claim(free_count, cls.misfire_grace_time):
+                        task = asyncio.create_task(cls.dispatch(queue))
+                        cls._running_dict[task] = queue.id
+                        task.add_done_callback(lambda done_task: cls._running_dict.pop(done_task, None))
+            except Exception as error:
+                logger.error(f"消费定时任务触发队列失败：{error}")
+            await asyncio.sleep(cls.poll_interval)
+
+    @classmethod
+    async def dispatch(cls, queue: TaskRunQueue):
+        """ 执行任务，等任务运行完毕才释放并发数 """
+        logger.info(f'{"*" * 20} 开始执行定时任务【{queue.task_code}】 {"*" * 20}')
+        task_id = queue.task_code.split("_", 1)[1]
+        try:
+            if queue.task_type == "cron":  # 系统定时任务
+                await getattr(JobFuncs, task_id)()
+                return await queue.run_success()
+
+            run_func_list = []
+            form = RunTaskForm(id_list=[task_id], trigger_type=TriggerTypeEnum.CRON, extend=None)
+            data = await trigger_task(queue.task_type, form, await User.get_run_user_id(), run_func_list.append)
+            await asyncio.gather(*[run_func() for run_func in run_func_list])
+            await queue.run_success(data)
+        except Exception as error:
+            logger.error(f"定时任务【{queue.task_code}】执行失败：{error}")
+            await queue.run_fail({"error": str(error)})
+
+
 async def get_job_func_list(request: Request):
     data_list = []
     for func_name in dir(JobFuncs):
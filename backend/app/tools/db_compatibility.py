@@ -2,6 +2,7 @@
 数据库兼容性工具类，处理不同数据库之间的差异
 """
 import os
+import json
 from typing import Dict, Any
 from tortoise import Tortoise
 
@@ -48,6 +49,17 @@ class DatabaseCompatibility:
         else:  # MySQL
             return f"JSON_EXTRACT({column}, '$.{path}')"
     
+    @staticmethod
+    async def append_json_array(table: str, column: str, pk: int, items: list):
+        """向JSON数组字段末尾追加元素，在数据库中追加，不需要把整个数组读出来再整体写回"""
+        value = json.dumps(items, ensure_ascii=False, default=str)
+        if DatabaseCompatibility.is_postgresql():
+            sql = f'UPDATE "{table}" SET "{column}" = COALESCE("{column}", \'[]\'::jsonb) || $1::jsonb WHERE "id" = $2'
+        else:  # MySQL
+            sql = f"UPDATE `{table}` SET `{column}` = JSON_MERGE_PRESERVE(" \
+                  f"COALESCE(`{column}`, JSON_ARRAY()), CAST(%s AS JSON)) WHERE `id` = %s"
+        await Tortoise.get_connection("default").execute_query(sql, [value, pk])
+
     @staticmethod
     def get_concat_sql(*columns) -> str:
         """获取字符串连接SQL"""
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
+import copy
+
 from app.models.autotest.model_factory import ApiCaseSuite as CaseSuite, ApiMsg as Api, ApiStep as Step,\
     ApiReportCase as ReportCase, ApiReportStep as reportStep
 from app.models.assist.model_factory import Script
 from app.models.config.model_factory import Config
 from app.schemas.enums import DataStatusEnum
-from utils.client.parse_model import StepModel, FormatModel
+from utils.client.parse_model import StepModel, FormatModel, CaseModel
 from utils.client.run_test_runner import RunTestRunner
 from utils.logs.log import logger
 
@@ -33,6 +35,7 @@ class RunApi(RunTestRunner):
             self.test_plan["response_time_level"] = await Config.get_response_time_level()
             self.front_report_addr = f'{await Config.get_report_host()}{await Config.get_api_report_addr()}'
             self.test_plan["pause_step_time_out"] = await Config.get_pause_step_time_out()
+            self.test_plan["http_client_conf"] = await Config.get_http_client_conf()
             await Script.create_script_file(self.env_code)  # 创建所有函数文件
             self.report = await self.report_model.filter(id=self.report_id).first()
             self.project = await self.get_format_project(self.report.project_id)  # 解析当前服务信息
@@ -104,6 +107,10 @@ class RunCase(RunTestRunner):
         self.test_plan["is_async"] = is_async
         self.case_id_list = case_id_list  # 要执行的用例id_list
         self.all_case_steps = []  # 所有测试步骤
+        self.case_step_dict = {}  # 预取的用例步骤 {case_id: [step]}
+        self.api_obj_dict = {}  # 预取的接口 {api_id: api}
+        self.suite_project_dict = {}  # 预取的用例集所在服务 {suite_id: project_id}
+        self.bulk_create_batch_size = 500
 
     async def parse_and_run(self):
         """ 把解析放到异步线程里面 """
@@ -111,13 +118,14 @@ class RunCase(RunTestRunner):
         self.test_plan["response_time_level"] = await Config.get_response_time_level()
         self.front_report_addr = f'{await Config.get_report_host()}{await Config.get_api_report_addr()}'
         self.test_plan["pause_step_time_out"] = await Config.get_pause_step_time_out()
+        self.test_plan["http_client_conf"] = await Config.get_http_client_conf()
         await Script.create_script_file(self.env_code)  # 创建所有函数文件
         self.report = await self.report_model.filter(id=self.report_id).first()
         await self.parse_all_case()
         await self.report.parse_data_finish()
         await self.run_case()
 
-    async def parse_step(self, current_project, project, current_case, case, api, step, report_case_id):
+    def parse_step(self, current_project, project, current_case, case, api, step):
         """ 解析测试步骤
         current_project: 当前用例所在的服务(解析后的)
         project: 当前步骤对应接口所在的服务(解析后的)
@@ -125,7 +133,7 @@ class RunCase(RunTestRunner):
         case: 被引用的case
         api: 解析后的api
         step: 原始step
-        返回解析后的步骤 {}
+        返回解析后的步骤执行记录（未入库，用例执行记录创建后批量插入）
         """
         # 解析头部信息，继承头部信息，接口所在服务、当前所在服务、用例、步骤
         step_headers = {}
@@ -164,32 +172,85 @@ class RunCase(RunTestRunner):
                 "follow_redirects": step.allow_redirect # httpx的重定向字段
             }
         }
-        await reportStep.create(
+        return reportStep(
             element_id=api["id"],
             step_id=step.id,
             case_id=step.case_id,
             report_id=self.report.id,
-            report_case_id=report_case_id,
             name=step_data["name"],
             step_data=step_data
         )
 
-    async def get_all_steps(self, case_id: int):
-        """ 解析引用的用例 """
-        case = await self.get_format_case(case_id)
+    async def prefetch_case_data(self):
+        """ 批量预取要用到的用例、步骤、接口、用例集、服务，后续解析都从内存中取，不再逐条查询数据库 """
+        case_id_list, fetched_case_set = list(self.case_id_list), set()
+        while case_id_list:  # 逐层获取被引用的用例
+            case_id_list = list({case_id for case_id in case_id_list if case_id not in fetched_case_set})
+            if not case_id_list:
+                break
+            fetched_case_set.update(case_id_list)
+            for case in await self.case_model.filter(id__in=case_id_list):
+                if case.id not in self.parsed_case_dict:
+                    self.parsed_case_dict[case.id] = CaseModel(**dict(case))
+            step_list = await Step.filter(case_id__in=case_id_list, status=DataStatusEnum.ENABLE).order_by("num")
+            for step in step_list:
+                self.case_step_dict.setdefault(step.case_id, []).append(step)
+            case_id_list = [step.quote_case for step in step_list if step.quote_case]
+
+        api_id_list = {step.api_id for step_list in self.case_step_dict.values() for step in step_list if not step.quote_case}
+        if api_id_list:
+            self.api_obj_dict = {api.id: api for api in await Api.filter(id__in=api_id_list)}
+
+        suite_id_list = {
+            self.parsed_case_dict[case_id].suite_id for case_id in self.case_id_list if case_id in self.parsed_case_dict}
+        if suite_id_list:
+            self.suite_project_dict = {
+                suite["id"]: suite["project_id"] for suite in await CaseSuite.filter(id__in=suite_id_list).values("id", "project_id")}
+
+        # 按用例的顺序解析服务：先用例所在服务，再步骤对应接口所在服务
+        project_id_list = []
+        for case_id in self.case_id_list:
+            if case_id not in self.parsed_case_dict:
+                continue
+            project_id_list.append(self.suite_project_dict.get(self.parsed_case_dict[case_id].suite_id))
+            project_id_list.extend(
+                self.api_obj_dict[step.api_id].project_id for step in self.walk_case_steps(case_id)
+                if step.api_id in self.api_obj_dict)
+        await self.prefetch_format_project([project_id for project_id in project_id_list if project_id is not None])
+
+    def walk_case_steps(self, case_id, quote_chain=()):
+        """ 按顺序遍历用例的步骤，引用的用例展开为其步骤，循环引用的跳过 """
+        if case_id in quote_chain:
+            logger.warning(f"用例循环引用，已跳过: {' -> '.join(map(str, quote_chain + (case_id,)))}")
+            return
+        for step in self.case_step_dict.get(case_id, []):
+            if step.quote_case:
+                yield from self.walk_case_steps(step.quote_case, quote_chain + (case_id,))
+            else:
+                yield step
+
+    def get_all_steps(self, case_id: int, quote_chain=()):
+        """ 解析引用的用例，数据已在 prefetch_case_data 中预取 """
+        if case_id in quote_chain:
+            logger.warning(f"用例循环引用，已跳过: {' -> '.join(map(str, quote_chain + (case_id,)))}")
+            return
+        case = self.parsed_case_dict.get(case_id)
+        if case is None:  # 被引用的用例已被删除
+            return
 
         if self.parse_case_is_skip(case.skip_if) is not True:  # 不满足跳过条件才解析
-            step_list = await Step.filter(case_id=case.id, status=DataStatusEnum.ENABLE).order_by("num").all()
-            for step in step_list:
+            for step in self.case_step_dict.get(case_id, []):
                 if step.quote_case:
-                    await self.get_all_steps(step.quote_case)
+                    self.get_all_steps(step.quote_case, quote_chain + (case_id,))
                 else:
                     self.all_case_steps.append(step)
                     self.count_step += 1
                     self.api_set.add(step.api_id)
 
     async def parse_all_case(self):
-        """ 解析所有用例 """
+        """ 解析所有用例，先在内存中解析完，再批量写入用例和步骤的执行记录 """
+        await self.prefetch_case_data()
+        report_case_list, report_step_dict = [], {}  # report_step_dict: {用例执行记录下标: [步骤执行记录]}
 
         # 遍历要运行的用例
         for case_id in self.case_id_list:
@@ -219,30 +280,30 @@ class RunCase(RunTestRunner):
                     report_case_data = current_case.get_attr()
                     report_case_data["run_env"] = self.env_code
 
-                    report_case = await ReportCase.create(
+                    report_case = ReportCase(
                         name=case_name,
                         case_id=current_case.id,
                         suite_id=current_case.suite_id,
                         report_id=self.report.id,
-                        case_data=current_case.get_attr(),
                         summary=ReportCase.get_summary_template()
                     )
+                    report_case_list.append(report_case)
 
                     # 满足跳过条件则跳过
                     if self.parse_case_is_skip(current_case.skip_if) is True:
-                        await report_case.test_is_skip()
+                        report_case.case_data, report_case.result = copy.deepcopy(current_case.get_attr()), "skip"
                         continue
 
-                    case_suite = await CaseSuite.filter(id=current_case.suite_id).first()
-                    current_project = await self.get_format_project(case_suite.project_id)
-                    await self.get_all_steps(case_id)  # 递归获取测试步骤（中间有可能某些测试步骤是引用的用例）
+                    current_project = await self.get_format_project(self.suite_project_dict[current_case.suite_id])
+                    self.get_all_steps(case_id)  # 递归获取测试步骤（中间有可能某些测试步骤是引用的用例）
 
                     # 循环解析测试步骤
                     all_variables = {}  # 当前用例的所有公共变量
+                    report_step_list = report_step_dict.setdefault(len(report_case_list) - 1, [])
                     for step in self.all_case_steps:
                         step = StepModel(**dict(step))
                         step_case = await self.get_format_case(step.case_id)
-                        api_temp = await Api.filter(id=step.api_id).first()
+                        api_temp = self.api_obj_dict.get(step.api_id) or await Api.filter(id=step.api_id).first()
                         api_project = await self.get_format_project(api_temp.project_id)
                         api_data = await self.get_format_api(api_project, api_obj=api_temp)
 
@@ -258,9 +319,11 @@ class RunCase(RunTestRunner):
                                 # 数据驱动的 comment 字段，用于做标识
                                 step.name += driver_data.get("comment", "")
                                 step.params = step.params = step.data_json = step.data_form = driver_data.get("data", {})
-                                await self.parse_step(current_project, api_project, current_case, step_case, api_data, step, report_case.id)
+                                report_step_list.append(
+                                    self.parse_step(current_project, api_project, current_case, step_case, api_data, step))
                         else:
-                            await self.parse_step(current_project, api_project, current_case, step_case, api_data, step, report_case.id)
+                            report_step_list.append(
+                                self.parse_step(current_project, api_project, current_case, step_case, api_data, step))
 
                         # 把服务和用例的的自定义变量留下来
                         all_variables.update(api_project.variables)
@@ -271,11 +334,21 @@ class RunCase(RunTestRunner):
                     all_variables.update(current_case.variables)
                     report_case_data["variables"].update(all_variables)  # = all_variables
                     report_case_data["run_type"] = self.run_type
-                    await report_case.update_report_case_data(report_case_data)
-
-                    self.test_plan["report_case_list"].append(report_case.id)
+                    report_case.case_data = copy.deepcopy(report_case_data)  # 后续的数据驱动会修改用例变量，先保存当前的数据
                     self.all_case_steps = []  # 完整的解析完一条用例后，去除对应的解析信息
 
+        # 批量写入用例执行记录，再把用例执行记录id回填到步骤执行记录上批量写入
+        await ReportCase.batch_create_report_case(report_case_list, self.bulk_create_batch_size)
+        all_report_step_list = []
+        for report_case_index, report_step_list in report_step_dict.items():
+            report_case_id = report_case_list[report_case_index].id
+            self.test_plan["report_case_list"].append(report_case_id)
+            for report_step in report_step_list:
+                report_step.report_case_id = report_case_id
+            all_report_step_list.extend(report_step_list)
+        if all_report_step_list:
+            await reportStep.bulk_create(all_report_step_list, batch_size=self.bulk_create_batch_size)
+
         # 去除服务级的公共变量，保证用步骤上解析后的公共变量
         self.test_plan["project_mapping"]["variables"] = {}
         self.init_parsed_data()
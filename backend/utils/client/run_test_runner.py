@@ -1,7 +1,3 @@
-import copy
-import types
-import importlib
-
 from app.models.autotest.model_factory import ApiProject, ApiProjectEnv, ApiCaseSuite, ApiCase, ApiStep, ApiMsg, \
     ApiReport, ApiReportCase, ApiReportStep, UiProject, UiProjectEnv, UiElement, UiCaseSuite, UiCase, UiStep, UiReport, \
     UiReportCase, UiReportStep, AppProject, AppProjectEnv, AppElement, AppCaseSuite, AppCase, AppStep, AppReport, \
@@ -42,6 +38,7 @@ class RunTestRunner:
         self.parsed_case_dict = {}
         self.parsed_api_dict = {}
         self.parsed_element_dict = {}
+        self.script_dict = {}
         self.run_env = None
         self.report = None
         self.api_model = ApiMsg
@@ -101,6 +98,7 @@ class RunTestRunner:
         self.parsed_case_dict = {}
         self.parsed_api_dict = {}
         self.parsed_element_dict = {}
+        self.script_dict = {}
         self.run_env = None
 
     # async def get_report_addr(self):
@@ -131,6 +129,28 @@ class RunTestRunner:
             self.parsed_project_dict.update({project_id: ProjectModel(**data)})
         return self.parsed_project_dict[project_id]
 
+    async def prefetch_format_project(self, project_id_list):
+        """ 批量查询并解析服务，已解析过的不再解析，解析顺序与传入顺序一致 """
+        project_id_list = [project_id for project_id in dict.fromkeys(project_id_list)
+                           if project_id not in self.parsed_project_dict]
+        if not project_id_list:
+            return
+        if not self.run_env:
+            self.run_env = await RunEnv.filter(code=self.env_code).first()
+
+        project_dict = {project.id: project for project in await self.project_model.filter(id__in=project_id_list)}
+        project_env_dict = {project_env.project_id: project_env for project_env in await self.project_env_model.filter(
+            env_id=self.run_env.id, project_id__in=project_id_list)}
+        await self.prefetch_script([script_id for project in project_dict.values() for script_id in project.script_list])
+
+        for project_id in project_id_list:
+            project, project_env = project_dict.get(project_id), project_env_dict.get(project_id)
+            if project is None or project_env is None:
+                continue  # 数据不完整的，留给 get_format_project 处理
+            await self.parse_functions(project.script_list)
+            data = dict(project_env) | dict(project) | dict(self.run_env)
+            self.parsed_project_dict.update({project_id: ProjectModel(**data)})
+
     async def get_format_case(self, case_id):
         """ 从已解析的用例字典中取指定id的用例，如果没有，则取出来解析后放进去 """
         if case_id not in self.parsed_case_dict:
@@ -159,15 +179,20 @@ class RunTestRunner:
             self.parsed_api_dict.update({api.id: self.parse_api(project, ApiModel(**dict(api)))})
         return self.parsed_api_dict[api_id]
 
+    async def prefetch_script(self, script_id_list):
+        """ 批量获取脚本名和内容 """
+        script_id_list = [script_id for script_id in set(script_id_list) if script_id not in self.script_dict]
+        if script_id_list:
+            for script in await Script.filter(id__in=script_id_list).values("id", "name", "script_data"):
+                self.script_dict[script["id"]] = script
+
     async def parse_functions(self, func_file_id_list):
-        """ 获取自定义函数 """
+        """ 获取自定义函数，脚本内容没有变化的直接使用已编译的函数 """
+        await self.prefetch_script(func_file_id_list)
         for func_file_id in func_file_id_list:
-            query_set = await Script.filter(id=func_file_id).values("name")
-            func_file_data = importlib.reload(
-                importlib.import_module(f'script_list.{self.env_code}_{query_set[0]["name"]}'))
-            self.test_plan["project_mapping"]["functions"].update({
-                name: item for name, item in vars(func_file_data).items() if isinstance(item, types.FunctionType)
-            })
+            script = self.script_dict[func_file_id]
+            self.test_plan["project_mapping"]["functions"].update(
+                Script.get_script_functions(self.env_code, script["name"], script["script_data"]))
 
     def parse_case_is_skip(self, skip_if_list, server_id=None, phone_id=None):
         """ 判断是否跳过用例，暂时只支持对运行环境的判断 """
@@ -295,24 +320,27 @@ class RunTestRunner:
                 summary=update_summary["summary"], is_passed=self.report.is_passed, notified=False  # 状态更新后未通知
             )
 
+    async def get_case_concurrency(self):
+        """ 并行执行时的用例并发数，任务运行配置中设置了则以任务的为准，否则取全局配置 """
+        if self.run_type == "app":  # app自动化只有一台运行设备，不能并行
+            return 1
+        case_concurrency = (self.task_dict.get("conf") or {}).get("case_concurrency")
+        if not case_concurrency:
+            case_concurrency = await Config.get_run_case_concurrency()
+        return max(int(case_concurrency), 1)
+
     async def run_case(self):
         """ 调 testRunner().run() 执行测试 """
         logger.info(f'\n测试执行数据：\n{self.test_plan}')
+        self.test_plan["executor_conf"] = await Config.get_executor_conf()
 
         if self.test_plan.get("is_async", 0):
-            # 并行执行, 遍历case，以case为维度多线程执行，测试报告按顺序排列
-            run_case_res_dict = {}
-            await self.report.run_case_start()
-            for index, case in enumerate(self.test_plan["report_case_list"]):
-                run_case_res_dict[index] = False  # 用例运行标识，索引：是否运行完成
-                test_plan = copy.deepcopy(self.test_plan)
-                test_plan["report_case_list"] = [case]
-                # self._async_run_case(temp_case, run_case_dict, index) # TODO 并行执行
-        else:  # 串行执行
-            await self.sync_run_case()
+            # 并行执行, 以case为维度并发执行，每条用例独立的Runner，测试报告按用例顺序汇总
+            self.test_plan["case_concurrency"] = await self.get_case_concurrency()
+        await self.sync_run_case()
 
     async def sync_run_case(self):
-        """ 单线程运行用例 """
+        """ 运行用例，串行/并行由 test_plan 的 is_async 决定 """
         await self.report.run_case_start()
         runner = TestRunner()
         await runner.run(self.test_plan)
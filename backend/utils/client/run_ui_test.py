@@ -8,6 +8,8 @@ from app.models.assist.model_factory import Script
 from utils.client.run_test_runner import RunTestRunner
 from utils.client.parse_model import StepModel, FormatModel
 from utils.client.test_runner.utils import build_url
+from utils.client.test_runner.webdriver_pool import WebDriverPool
+from utils.client.test_runner.screenshot import ScreenshotWriter
 from utils.util.file_util import FileUtil
 from app.configs.config import ui_action_mapping_reverse
 
@@ -56,6 +58,8 @@ class RunCase(RunTestRunner):
             self.front_report_addr = f'{await Config.get_report_host()}{await Config.get_app_ui_report_addr()}'
 
         self.test_plan["pause_step_time_out"] = await Config.get_pause_step_time_out()
+        WebDriverPool.configure(**await Config.get_webdriver_pool_conf())
+        ScreenshotWriter.configure(**await Config.get_screenshot_conf())
         await Script.create_script_file(self.env_code)  # 创建所有函数文件
         if self.run_type != "ui":
             self.device_dict = {device.id: dict(device) for device in await AppRunPhone.all()}
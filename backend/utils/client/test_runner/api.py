@@ -1,14 +1,21 @@
+import asyncio
 import datetime
 import traceback
+from contextlib import aclosing, suppress
 
 from utils.logs.log import logger
+from utils.util.executor_util import ExecutorService
 from . import exceptions, parser, runner
+from .client.http import HttpClientPool
 
 
 class TestRunner:
+    case_prefetch_count = 2  # 串行执行时，提前从数据库加载的用例数
+    executor_concurrency = 20  # 一次运行最多同时占用共享线程池的线程数（自定义函数、UI操作），executor_conf 没有配置时使用
 
     def __init__(self):
         self.summary = None
+        self.http_client_pool = None
 
     async def run_test(self, parsed_tests_mapping):
         """ 执行测试 """
@@ -18,7 +25,7 @@ class TestRunner:
         test_case_mapping = parsed_tests_mapping["test_case_mapping"]  # 执行测试用例
 
         report_case = await report_case_model.filter(id=test_case_mapping["config"]["report_case_id"]).first()
-        case_runner = runner.Runner(test_case_mapping["config"], functions)
+        case_runner = runner.Runner(test_case_mapping["config"], functions, http_client_pool=self.http_client_pool)
         await case_runner.init_session_context()
 
         report_case.summary["stat"]["total"] = len(test_case_mapping["step_list"])
@@ -43,23 +50,90 @@ class TestRunner:
             else:
                 case_runner.report_step.add_run_step_result_count(report_case.summary, case_runner.client_session.meta_data)
         report_case.summary["time"]["end_at"] = datetime.datetime.now()  # 用例执行结束时间
-        case_runner.try_close_browser()  # 执行完一条用例，不管是不是ui自动化，都强制执行关闭浏览器，防止执行时报错，导致没有关闭到浏览器造成driver进程一直存在
+        await case_runner.release_browser()  # 执行完一条用例，把浏览器重置后归还到会话池，重置失败的直接关闭，防止driver进程一直存在
+        await report_step_model.flush_progress()  # 用例执行完毕，把缓冲中的步骤执行进度写入数据库
+        report_step_model.get_status_registry().clear_case(report_case.id)
         await report_case.save_case_result_and_summary()
 
         return report_case.summary
 
+    async def run_report_case(self, test_plan, report_case_id):
+        """ 解析并执行一条用例，返回用例的summary """
+        parsed_test_res = await parser.parse_test_data(test_plan, report_case_id)  # 解析测试计划
+        if parsed_test_res.get("result") == "error":  # 解析测试计划报错了，会返回当前用例的初始summary
+            return parsed_test_res
+        return await self.run_test(parsed_test_res)  # 执行测试用例
+
+    async def pipeline_run_case_list(self, test_plan):
+        """ 串行执行用例，执行当前用例的同时，提前加载后面 case_prefetch_count 条用例的数据，隐藏数据库查询耗时
+        队列满了就暂停加载，内存占用保持平稳；自定义函数会在解析时执行，所以解析仍然放在用例执行前，保证执行顺序不变
+        调用方需要用 aclosing 包装，执行中断时立即关闭生成器，停止加载任务
+        """
+        queue = asyncio.Queue(maxsize=self.case_prefetch_count)
+
+        async def load_case_list():
+            for report_case_id in test_plan["report_case_list"]:
+                try:
+                    loaded_test_data = await parser.load_test_data(test_plan, report_case_id)
+                except Exception as error:
+                    loaded_test_data = error  # 加载报错了，交给执行的地方抛出
+                await queue.put(loaded_test_data)
+
+        load_task = asyncio.create_task(load_case_list())
+        try:
+            for _ in test_plan["report_case_list"]:
+                loaded_test_data = await queue.get()
+                if isinstance(loaded_test_data, Exception):
+                    raise loaded_test_data
+                parsed_test_res = await parser.parse_loaded_test_data(test_plan, loaded_test_data)  # 解析测试计划
+                if parsed_test_res.get("result") == "error":  # 解析测试计划报错了，会返回当前用例的初始summary
+                    yield parsed_test_res
+                else:
+                    yield await self.run_test(parsed_test_res)  # 执行测试用例
+        finally:
+            load_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await load_task  # 等加载任务真正结束，不留下还在查询数据库的任务
+
+    async def async_run_case_list(self, test_plan):
+        """ 并行执行用例，每条用例都有独立的 Runner/SessionContext，并发数由 case_concurrency 控制
+        返回的用例summary与 report_case_list 的顺序一致
+        """
+        semaphore = asyncio.Semaphore(max(int(test_plan.get("case_concurrency") or 1), 1))
+
+        async def run_with_semaphore(report_case_id):
+            async with semaphore:  # 拿到执行名额才开始解析，并发数之外的用例不占内存
+                return await self.run_report_case(test_plan, report_case_id)
+
+        case_summary_list = await asyncio.gather(
+            *[run_with_semaphore(report_case_id) for report_case_id in test_plan["report_case_list"]],
+            return_exceptions=True  # 一条用例报错不影响其他正在执行的用例
+        )
+        for case_summary in case_summary_list:
+            if isinstance(case_summary, BaseException):
+                raise case_summary
+        return case_summary_list
+
     async def run(self, test_plan):
         """ 执行测试的流程 """
         report = await test_plan["report_model"].filter(id=test_plan["report_id"]).first()
         self.summary = report.summary  # 防止任务中没有用例导致报错
         start_run_test_time = datetime.datetime.now()
-        for report_case_id in test_plan["report_case_list"]: # 解析一条用例就执行一条用例，减少内存开销
-            parsed_test_res = await parser.parse_test_data(test_plan, report_case_id)  # 解析测试计划
-            if parsed_test_res.get("result") == "error":  # 解析测试计划报错了，会返回当前用例的初始summary
-                case_summary = parsed_test_res
+        self.http_client_pool = HttpClientPool(**test_plan.get("http_client_conf", {}))  # 本次运行的所有用例共享连接
+        run_limit_token = ExecutorService.set_run_limit(
+            test_plan.get("executor_conf", {}).get("run_concurrency") or self.executor_concurrency)
+        try:
+            if test_plan.get("is_async", 0):  # 并行执行，全部执行完后按用例顺序汇总，保证报告统计稳定
+                for case_summary in await self.async_run_case_list(test_plan):
+                    self.summary = report.merge_test_result(case_summary)  # 汇总测试结果
             else:
-                case_summary = await self.run_test(parsed_test_res)  # 执行测试用例
-            self.summary = report.merge_test_result(case_summary)  # 汇总测试结果
+                # 解析一条用例就执行一条用例，减少内存开销；执行中断时退出 aclosing 就会取消预加载任务，不依赖生成器被回收
+                async with aclosing(self.pipeline_run_case_list(test_plan)) as case_summary_list:
+                    async for case_summary in case_summary_list:
+                        self.summary = report.merge_test_result(case_summary)  # 汇总测试结果
+        finally:
+            ExecutorService.reset_run_limit(run_limit_token)
+            await self.http_client_pool.close()
         run_case_finish_time = datetime.datetime.now()
         self.summary["time"]["start_at"] = start_run_test_time.strftime("%Y-%m-%d %H:%M:%S")
         self.summary["time"]["end_at"] = run_case_finish_time.strftime("%Y-%m-%d %H:%M:%S")
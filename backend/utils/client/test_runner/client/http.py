@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-import copy
 import traceback
 from datetime import datetime
 from urllib import parse
@@ -21,6 +20,51 @@ class ApiResponse(Response):
         Response.raise_for_status(self)
 
 
+class HttpClientPool:
+    """ 一次测试运行内共享的HTTP连接池
+    按TLS配置（是否校验证书、是否启用HTTP/2）复用transport，transport内部再按host维护keep-alive连接，
+    同一个host的请求不用每个步骤都重新建立 TCP + TLS 连接
+    """
+
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=30, http2=False):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.http2 = http2 and self.h2_is_installed()
+        self.transport_dict = {}
+
+    @staticmethod
+    def h2_is_installed():
+        """ HTTP/2 依赖 h2 """
+        try:
+            import h2
+            return True
+        except ImportError:
+            logger.warning("没有安装h2，不能启用HTTP/2，使用HTTP/1.1发送请求")
+            return False
+
+    def get_transport(self, verify=False):
+        key = (verify, self.http2)
+        if key not in self.transport_dict:
+            self.transport_dict[key] = httpx.AsyncHTTPTransport(verify=verify, http2=self.http2, limits=self.limits)
+        return self.transport_dict[key]
+
+    def get_client(self, verify=False):
+        """ 获取使用共享连接的client，cookie由client自己保存，同一条用例的步骤之间保持会话，用例之间互不影响 """
+        return httpx.AsyncClient(transport=self.get_transport(verify), verify=verify)
+
+    async def close(self):
+        """ 测试运行结束，关闭所有连接 """
+        for transport in self.transport_dict.values():
+            try:
+                await transport.aclose()
+            except Exception as error:
+                logger.error(f"关闭HTTP连接池报错：{error}")
+        self.transport_dict = {}
+
+
 class HttpSession(BaseSession):
     """
     用于执行HTTP请求和在请求之间保持会话（cookie），以便能够登录和退出网站。
@@ -30,9 +74,11 @@ class HttpSession(BaseSession):
     url允许只传接口地址，不传host，此时在发请求时会自动加上base_url
     """
 
-    def __init__(self, base_url=None, *args, **kwargs):
+    def __init__(self, base_url=None, client_pool=None, *args, **kwargs):
         # super(HttpSession, self).__init__(*args, **kwargs)
         self.base_url = base_url if base_url else ""
+        # 有连接池则整个会话使用同一个client，没有则每次请求新建client
+        self.client = client_pool.get_client() if client_pool else None
         self.request_at = self.response_at = datetime.now()
         self.init_step_meta_data()
 
@@ -103,7 +149,8 @@ class HttpSession(BaseSession):
 
         # 构建请求的url
         url = build_url(self.base_url, url)
-        copy_kwargs = copy.deepcopy(kwargs)  # 保留转码前的内容
+        # 保留转码前的内容，后面只会替换 files、data 和修改 headers，所以只拷贝 headers
+        copy_kwargs = {**kwargs, "headers": dict(kwargs.get("headers") or {})}
         copy_kwargs["files"] = FileUtil.build_request_file(copy_kwargs["files"])  # 构建文件请求对象
 
         # 如果是 x-www-form-urlencoded 则进行转码
@@ -150,8 +197,11 @@ class HttpSession(BaseSession):
             self.request_at = datetime.now()
             logger.info(f"method: {method}, url: {url}, kwargs: {kwargs}")
             # requests库出现过卡死发不出请求的情况，换为httpx后没有出现问题
-            async with httpx.AsyncClient(verify=False) as client:
-                response = await client.request(method, url, **kwargs)
+            if self.client:
+                response = await self.client.request(method, url, **kwargs)
+            else:
+                async with httpx.AsyncClient(verify=False) as client:
+                    response = await client.request(method, url, **kwargs)
             self.response_at = datetime.now()
             return response
         except HTTPStatusError as ex:
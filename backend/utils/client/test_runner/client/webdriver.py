@@ -1,14 +1,12 @@
-import os
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from functools import partial
 from datetime import datetime
 
 from selenium.common.exceptions import SessionNotCreatedException, InvalidArgumentException, WebDriverException
 
 from utils.client.test_runner.client import BaseSession
 from utils.client.test_runner.exceptions import TimeoutException, RunTimeException, InvalidElementStateException
-from utils.util.file_util import FileUtil
+from utils.logs.log import logger
+from utils.util.executor_util import ExecutorService
+from ..screenshot import ScreenshotWriter
 
 
 class WebDriverSession(BaseSession):
@@ -16,6 +14,8 @@ class WebDriverSession(BaseSession):
 
     def __init__(self):
         self.driver = None
+        self.step_index = 0  # 当前用例执行到第几个步骤，用于按截图策略截图
+        self.screenshot_step = None  # 最近执行的步骤的截图信息 [截图路径, 步骤id, 是否已截执行后的图]
         self.init_step_meta_data()
 
     async def async_do_action(self, driver, name=None, case_id=None, variables_mapping={}, **kwargs):
@@ -26,15 +26,7 @@ class WebDriverSession(BaseSession):
             case_id=case_id,
             variables_mapping=variables_mapping
         ))
-        max_workers = min(50, os.cpu_count() * 5)
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            try:
-                bound_func = partial(self.do_action, *(), **kwargs)
-                return await asyncio.wait_for(
-                    asyncio.get_running_loop().run_in_executor(executor, bound_func), timeout=600)
-            except Exception as e:
-                executor.shutdown(wait=True)  # 强制终止超时任务
-                raise
+        return await ExecutorService.run(self.do_action, kwargs=kwargs, timeout=600)
 
     def do_action(self, driver, name=None, case_id=None, variables_mapping={}, **kwargs):
         self.meta_data["name"] = name  # 记录测试名
@@ -42,19 +34,19 @@ class WebDriverSession(BaseSession):
         self.meta_data["variables_mapping"] = variables_mapping  # 记录发起此次请求时内存中的自定义变量
         self.meta_data["data"][0]["test_action"] = kwargs  # 记录原始的请求信息
         report_img_folder, report_step_id = kwargs.pop("report_img_folder"), kwargs.pop("report_step_id")
+        self.step_index += 1
+        self.screenshot_step = [report_img_folder, report_step_id, False]
 
         # 执行前截图
-        before_page_folder = os.path.join(report_img_folder, f'{report_step_id}_before_page.txt')
-        FileUtil.save_file(before_page_folder, driver.get_screenshot_as_base64())
+        self.save_screenshot(driver, report_img_folder, report_step_id, "before_page")
 
-        # 执行测试步骤
+        # 执行测试步骤，执行失败时由 save_fail_screenshot 按步骤最终结果截图
         start_at = datetime.now()
         result = self._do_action(driver, **kwargs)  # 执行步骤
         end_at = datetime.now()
 
         # 执行后截图
-        after_page_folder = os.path.join(report_img_folder, f'{report_step_id}_after_page.txt')
-        FileUtil.save_file(after_page_folder, driver.get_screenshot_as_base64())
+        self.screenshot_step[2] = self.save_screenshot(driver, report_img_folder, report_step_id, "after_page")
 
         # 记录消耗的时间
         self.meta_data["stat"] = {
@@ -65,6 +57,29 @@ class WebDriverSession(BaseSession):
 
         return result
 
+    def save_screenshot(self, driver, report_img_folder, report_step_id, img_type, is_fail=False):
+        """ 按截图策略截图，放到后台队列写入，返回是否截图 """
+        if ScreenshotWriter.need_capture(img_type, self.step_index, is_fail) is False:
+            return False
+        try:
+            ScreenshotWriter.save(report_img_folder, report_step_id, img_type, driver.get_screenshot_as_png())
+        except Exception as error:
+            if is_fail is False:
+                raise
+            logger.warning(f"步骤执行失败后截图失败：{error}")  # 不覆盖步骤本身的报错，也不写到自定义函数的打印里
+        return True
+
+    async def async_save_fail_screenshot(self, driver, report_step_id):
+        """ 步骤最终结果为失败时（操作报错、数据提取失败、后置函数报错、断言不通过）截执行后的图 """
+        if self.screenshot_step is None or self.screenshot_step[1] != report_step_id or self.screenshot_step[2]:
+            return  # 步骤的操作没有执行，或者已经截过图
+        report_img_folder, self.screenshot_step[2] = self.screenshot_step[0], True
+        try:
+            await ExecutorService.run(
+                self.save_screenshot, (driver, report_img_folder, report_step_id, "after_page", True), timeout=60)
+        except Exception as error:
+            logger.warning(f"步骤执行失败后截图失败：{error}")  # 不覆盖步骤本身的报错，也不写到自定义函数的打印里
+
     def _do_action(self, driver, **kwargs):
         """ 执行浏览器操作 """
         try:
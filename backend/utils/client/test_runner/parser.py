@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import ast
+import functools
 import json
 import re
 import traceback
@@ -336,18 +337,83 @@ def get_mapping_function(function_name, functions_mapping):
         raise exceptions.FunctionNotFound(f"自定义函数 【{function_name}】 没有找到")
 
 
-async def parse_string_functions(content, variables_mapping, functions_mapping):
+class CompiledTemplate:
+    """ 预编译的字符串模板，同样内容的字符串只解析一次
+    - 没有 $ 的字符串为常量，直接返回
+    - 只有变量的字符串拆分为常量、变量片段，解析时按片段拼接: "/api/$uid" => [(False, "/api/"), (True, "uid")]
+    - 有自定义函数的字符串，预先解析好函数名和参数，执行时不用再做正则匹配
+    """
+    __slots__ = ("content", "is_literal", "function_list", "segment_list")
+
+    def __init__(self, content):
+        self.content = content.strip()
+        self.is_literal = "$" not in self.content
+        self.function_list = []  # [("add(1, 2)", {"func_name": "add", "args": [1, 2], "kwargs": {}})]
+        self.segment_list = None  # 只有变量时才有值
+        if self.is_literal:
+            return
+
+        self.function_list = [(func_content, parse_function(func_content)) for func_content in extract_functions(self.content)]
+        if not self.function_list:
+            self.segment_list, position = [], 0
+            for matched in re.finditer(variable_regexp, self.content):
+                if matched.start() > position:
+                    self.segment_list.append((False, self.content[position:matched.start()]))
+                self.segment_list.append((True, matched.group(1)))
+                position = matched.end()
+            if position < len(self.content):
+                self.segment_list.append((False, self.content[position:]))
+
+
+template_cache_max_length = 2048  # 超过这个长度的字符串（如整个请求体）很少重复，不缓存，避免缓存占用过多内存
+
+
+@functools.lru_cache(maxsize=10000)
+def get_cached_template(content):
+    """ 按字符串内容缓存预编译的模板，超出数量淘汰最久未使用的 """
+    return CompiledTemplate(content)
+
+
+def get_compiled_template(content):
+    """ 获取预编译的模板，长字符串每次重新解析 """
+    if len(content) > template_cache_max_length:
+        return CompiledTemplate(content)
+    return get_cached_template(content)
+
+
+async def render_template_variables(template, variables_mapping, functions_mapping):
+    """ 按片段把变量的值拼接到字符串中 """
+    segment_list = template.segment_list
+    if len(segment_list) == 1 and segment_list[0][0]:  # content is a variable, e.g. "$var"
+        return await parse_variable_value(segment_list[0][1], variables_mapping, functions_mapping)
+
+    content_list = []
+    for is_variable, text in segment_list:
+        if is_variable is False:
+            content_list.append(text)
+            continue
+        variable_value = await parse_variable_value(text, variables_mapping, functions_mapping)
+        if not isinstance(variable_value, str):
+            variable_value = builtin_str(variable_value)
+        if "$" in variable_value:  # 变量的值里面还有 $，按逐个替换的方式解析，保持和原来的解析结果一致
+            return await parse_string_variables(template.content, variables_mapping, functions_mapping)
+        content_list.append(variable_value)
+    return "".join(content_list)
+
+
+async def parse_string_functions(content, variables_mapping, functions_mapping, function_list=None):
     """ 映射字符串中的函数
     Args:
         content (str): "abc${add_one(3)}def"
         variables_mapping (dict): 变量字典
         functions_mapping (dict): {"add_one": lambda x: x + 1}
+        function_list (list): 预编译好的函数，不传则从content中提取
     Returns:
         parse_string_functions(content, functions_mapping) >>> "abc4def"
     """
-    functions_list = extract_functions(content)
-    for func_content in functions_list:
-        function_meta = parse_function(func_content)
+    if function_list is None:
+        function_list = [(func_content, parse_function(func_content)) for func_content in extract_functions(content)]
+    for func_content, function_meta in function_list:
         args = await parse_data(function_meta.get("args", []), variables_mapping, functions_mapping)
         kwargs = await parse_data(function_meta.get("kwargs", {}), variables_mapping, functions_mapping)
         func = get_mapping_function(function_meta["func_name"], functions_mapping)
@@ -387,6 +453,33 @@ async def parse_string_functions(content, variables_mapping, functions_mapping):
     return content
 
 
+async def parse_variable_value(variable_name, variables_mapping, functions_mapping):
+    """ 获取变量解析后的值，变量的值里面有引用其他变量、自定义函数的，解析后更新到变量映射中 """
+    variable_value = get_mapping_variable(variable_name, variables_mapping)
+
+    if variable_name == "request" and isinstance(variable_value, dict) \
+            and "url" in variable_value and "method" in variable_value:
+        # call setup_hooks action with $request
+        for key, value in variable_value.items():
+            variable_value[key] = await parse_data(
+                value,
+                variables_mapping,
+                functions_mapping
+            )
+        return variable_value
+    elif "${}".format(variable_name) == variable_value:
+        return variable_value
+
+    parsed_variable_value = await parse_data(
+        variable_value,
+        variables_mapping,
+        functions_mapping,
+        raise_if_variable_not_found=False
+    )
+    variables_mapping[variable_name] = parsed_variable_value
+    return parsed_variable_value
+
+
 async def parse_string_variables(content, variables_mapping, functions_mapping):
     """ 从字符串中，解析引用变量
 
@@ -406,28 +499,7 @@ async def parse_string_variables(content, variables_mapping, functions_mapping):
     """
     variables_list = extract_variables(content)
     for variable_name in variables_list:
-        variable_value = get_mapping_variable(variable_name, variables_mapping)
-
-        if variable_name == "request" and isinstance(variable_value, dict) \
-                and "url" in variable_value and "method" in variable_value:
-            # call setup_hooks action with $request
-            for key, value in variable_value.items():
-                variable_value[key] = await parse_data(
-                    value,
-                    variables_mapping,
-                    functions_mapping
-                )
-            parsed_variable_value = variable_value
-        elif "${}".format(variable_name) == variable_value:
-            parsed_variable_value = variable_value
-        else:
-            parsed_variable_value = await parse_data(
-                variable_value,
-                variables_mapping,
-                functions_mapping,
-                raise_if_variable_not_found=False
-            )
-            variables_mapping[variable_name] = parsed_variable_value
+        parsed_variable_value = await parse_variable_value(variable_name, variables_mapping, functions_mapping)
         # TODO: replace variable label from $var to {{var}}
         if "${}".format(variable_name) == content:
             # content is a variable
@@ -505,18 +577,30 @@ async def parse_data(content, variables_mapping=None, functions_mapping=None, ra
 
         return parsed_content
 
+    if isinstance(content, bytes):
+        return content.strip()
+
     if isinstance(content, basestring):
         # content is in string format here
+        template = get_compiled_template(content)
+        content = template.content
+        if template.is_literal:  # 没有引用变量、自定义函数
+            return content
+
         variables_mapping = utils.list_to_dict(variables_mapping or {})
         functions_mapping = functions_mapping or {}
-        content = content.strip()
 
         try:
-            # 提取并执行自定义函数
-            content = await parse_string_functions(content, variables_mapping, functions_mapping)
+            if template.segment_list is not None:
+                # 只引用了变量，按片段拼接
+                content = await render_template_variables(template, variables_mapping, functions_mapping)
+            else:
+                # 提取并执行自定义函数
+                content = await parse_string_functions(
+                    content, variables_mapping, functions_mapping, template.function_list)
 
-            # 用公用变量替换字符串中的占位符
-            content = await parse_string_variables(content, variables_mapping, functions_mapping)
+                # 用公用变量替换字符串中的占位符
+                content = await parse_string_variables(content, variables_mapping, functions_mapping)
         except exceptions.VariableNotFound:
             if raise_if_variable_not_found:
                 raise
@@ -658,6 +742,23 @@ async def parse_test_data(tests_dict, report_case_id):
 
         report_case_id: 测试报告用例的id
     """
+    return await parse_loaded_test_data(tests_dict, await load_test_data(tests_dict, report_case_id))
+
+
+async def load_test_data(tests_dict, report_case_id):
+    """ 从数据库加载用例和步骤数据，只查询不解析，可以提前加载 """
+    report_case = await tests_dict["report_case_model"].filter(id=report_case_id).first()
+    step_list = await tests_dict["report_step_model"].get_test_step_by_report_case(report_case.id)
+    return report_case, step_list
+
+
+async def parse_loaded_test_data(tests_dict, loaded_test_data):
+    """ 解析已加载的用例数据，解析时会执行自定义函数，要在用例执行前才解析
+    Args:
+        tests_dict (dict): 测试计划，同 parse_test_data
+        loaded_test_data (tuple): load_test_data 的返回 (report_case, step_list)
+    """
+    report_case, step_list = loaded_test_data
     parsed_tests_mapping = {
         "project": tests_dict.get("project", {}),
         "project_mapping": tests_dict.get("project_mapping", {}),
@@ -668,13 +769,12 @@ async def parse_test_data(tests_dict, report_case_id):
         "response_time_level": tests_dict["response_time_level"],
         "test_case": []
     }
-
-    report_case = await tests_dict["report_case_model"].filter(id=report_case_id).first()
     report_case.case_data["report_case_id"] = report_case.id
+    report_case.case_data["report_id"] = report_case.report_id
 
     test_case_mapping = {
         "config": report_case.case_data,
-        "step_list": await tests_dict["report_step_model"].get_test_step_by_report_case(report_case.id)
+        "step_list": step_list
     }
     test_case_mapping["config"]["pause_step_time_out"] = tests_dict["pause_step_time_out"]
     try:
@@ -1,4 +1,3 @@
-import copy
 import traceback
 from unittest.case import SkipTest
 
@@ -7,7 +6,8 @@ from .client.http import HttpSession
 from .client.webdriver import WebDriverSession
 from .exceptions import StopTest
 from .runner_context import SessionContext
-from .webdriver_action import GetUiDriver, GetAppDriver, get_web_driver
+from .webdriver_action import GetUiDriver, GetAppDriver
+from .webdriver_pool import WebDriverPool
 from utils.logs.redirect_print_log import RedirectPrintLogToMemory
 from utils.logs.log import logger
 
@@ -35,7 +35,7 @@ class Runner:
 
     """
 
-    def __init__(self, config, functions, task_type="api"):
+    def __init__(self, config, functions, task_type="api", http_client_pool=None):
         """ 运行测试用例
 
         Args:
@@ -52,6 +52,7 @@ class Runner:
         self.run_env = config.get("run_env")
         self.output = config.get("output", [])
         self.functions = functions
+        self.http_client_pool = http_client_pool  # 同一次运行共享的HTTP连接池
         self.validation_results = []
         self.run_type = config.get("run_type") or "api"
         self.resp_obj = None
@@ -66,6 +67,8 @@ class Runner:
 
         # 记录当前步骤的执行进度
         self.report_step = None
+        self.report_id = config.get("report_id")
+        self.report_case_id = config.get("report_case_id")
         self.pause_step_time_out = config.get("pause_step_time_out", 10 * 60) # 暂停测试步骤状态变更的超时时间（暂停 => 放行），默认10分钟
         self.testcase_teardown_hooks = config.get("teardown_hooks", [])  # 用例级别的后置条件
         self.session_context = SessionContext(self.functions)
@@ -79,14 +82,14 @@ class Runner:
         """ 根据不同的测试类型获取不同的client_session """
         if self.client_session is None:
             if self.run_type == "api":
-                self.client_session = HttpSession(self.base_url)
+                self.client_session = HttpSession(self.base_url, client_pool=self.http_client_pool)
             elif self.run_type == "ui":
                 self.client_session = WebDriverSession()
-                self.driver = await get_web_driver(
+                self.driver = await WebDriverPool.acquire(
                     driver_type="ui", browser_driver_path=self.browser_driver_path, browser_name=self.browser_name)
             else:
                 self.client_session = WebDriverSession()
-                self.driver = await get_web_driver(driver_type="app", **self.appium_config)
+                self.driver = await WebDriverPool.acquire(driver_type="app", **self.appium_config)
 
     def try_close_browser(self):
         """ 强制关闭浏览器、app """
@@ -96,6 +99,13 @@ class Runner:
         except Exception as e:
             print(f"try_close_browser 错误：{e}")
 
+    async def release_browser(self):
+        """ 把浏览器、app会话重置后归还到会话池，给下一条用例复用 """
+        if self.driver is None:
+            return
+        driver, self.driver = self.driver, None
+        await WebDriverPool.release(driver)
+
     # def __del__(self):
     #     if self.testcase_teardown_hooks:
     #         self.do_hook_actions(self.testcase_teardown_hooks)
@@ -241,10 +251,8 @@ class Runner:
         await self.report_step.test_is_start_before()
         await self.do_hook_actions(step_dict.get("setup_hooks", []))
 
-        # 深拷贝除 request 的其他数据，请求数据有可能是io，io不能深拷贝，所以先移出再深拷贝，再移入
-        copy_request = self.session_context.test_variables_mapping.pop("request")
-        variables_mapping = copy.deepcopy(self.session_context.test_variables_mapping)
-        self.session_context.test_variables_mapping["request"] = copy_request
+        # 记录发起请求时的变量快照，浅拷贝，只隔离第一层的变量名，变量值与其他步骤共用
+        variables_mapping = self.session_context.get_variables_snapshot()
 
         # 开始执行测试
         await self.report_step.test_is_start_running()
@@ -257,7 +265,7 @@ class Runner:
                 url,
                 name=step_name,
                 case_id=case_id,
-                variables_mapping=copy.deepcopy(variables_mapping),
+                variables_mapping=variables_mapping,
                 **parsed_step
             )
             self.resp_obj = response.ResponseObject(resp)
@@ -273,7 +281,7 @@ class Runner:
                 self.driver,
                 name=step_name,
                 case_id=case_id,
-                variables_mapping=copy.deepcopy(variables_mapping),
+                variables_mapping=variables_mapping,
                 **parsed_step
             )
 
@@ -316,10 +324,10 @@ class Runner:
 
     def get_test_step_data(self):
         """ 获取测试数据 """
-        request = copy.deepcopy(self.client_session.meta_data["data"][0]["request"])
+        request = self.client_session.meta_data["data"][0]["request"]
         request_body = request.get("body")
         if request_body and isinstance(request_body, bytes):
-            request["body"] = str(request_body)
+            request = {**request, "body": str(request_body)}  # 只替换body，其他数据不拷贝
 
         data = {
             "case_id": self.client_session.meta_data.get("case_id"),
@@ -376,7 +384,8 @@ class Runner:
                 self.client_init_error = str(error)
                 logger.error(traceback.format_exc())
 
-        self.report_step = await report_step_model.get_resport_step_with_status(step_dict.get("report_step_id"), self.pause_step_time_out)
+        self.report_step = await report_step_model.get_resport_step_with_status(
+            step_dict.get("report_step_id"), self.pause_step_time_out, self.report_id, self.report_case_id)
         if self.report_step.status == "stop": # 停止测试
             self.__clear_step_test_data()
             raise StopTest("中断测试执行")
@@ -407,6 +416,9 @@ class Runner:
                     self.client_session.meta_data["result"] = "error"
                 else:
                     self.client_session.meta_data["result"] = "fail"
+
+                if isinstance(self.client_session, WebDriverSession):  # 按步骤的最终结果截图，断言不通过也要截
+                    await self.client_session.async_save_fail_screenshot(self.driver, step_dict.get("report_step_id"))
             raise
         finally:
             # 保存自定义函数的 print 打印, 并把print重定向到默认输出
@@ -61,6 +61,15 @@ class SessionContext(object):
         self.session_variables_mapping.update(variables_mapping)
         self.test_variables_mapping.update(self.session_variables_mapping)
 
+    def get_variables_snapshot(self):
+        """ 获取当前变量的快照，用于记录到测试报告
+        只做浅拷贝，不深拷贝：只隔离第一层的变量名，新增、替换变量不影响快照，
+        字典、列表类型的变量值和当前变量共用同一个对象，在记录到进度缓冲（序列化）之前，
+        后置函数、自定义函数对它的原地修改会体现在快照中
+        request 为当前步骤的请求数据，可能包含io，不记录到快照中
+        """
+        return {key: value for key, value in self.test_variables_mapping.items() if key != "request"}
+
     def save_update_to_header_filed(self, filed_list: list, extracted_variables_mapping: dict):
         """ 把提取后需要更新到头部信息的数据保存下来
         filed_list: ['data']
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import queue
+import threading
+
+from PIL import Image
+
+from utils.logs.log import logger
+
+
+class ScreenshotWriter:
+    """ 步骤截图的后台写入队列，截图保存为压缩后的二进制图片，不再保存base64文本
+    - 截图后放入队列就返回，由后台线程压缩、写文件，不阻塞步骤执行，队列满了才会等待
+    - 截图策略，policy:
+        all: 每个步骤执行前、后都截图
+        after: 只在步骤执行后截图
+        failure: 只在步骤最终结果为失败时（包括断言不通过）截执行后的图
+        every_n: 每 every_n 个步骤截一次图（执行前、后）
+    - 图片格式，format: png / webp / jpeg，quality 为 webp、jpeg 的压缩质量
+    """
+    policy = "all"
+    every_n = 5
+    format = "jpeg"
+    quality = 75
+    max_queue_size = 200
+    extension_dict = {"png": "png", "webp": "webp", "jpeg": "jpg"}
+    _queue = None
+    _thread = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, policy="all", every_n=5, format="jpeg", quality=75, **kwargs):
+        cls.policy, cls.every_n, cls.quality = policy, max(int(every_n), 1), int(quality)
+        cls.format = format if format in cls.extension_dict else "jpeg"
+
+    @classmethod
+    def get_file_name(cls, report_step_id, img_type, img_format=None):
+        return f'{report_step_id}_{img_type}.{cls.extension_dict[img_format or cls.format]}'
+
+    @classmethod
+    def need_capture(cls, img_type, step_index, is_fail=False):
+        """ 根据截图策略判断当前是否需要截图
+        img_type: before_page / after_page
+        step_index: 当前用例的第几个步骤，从1开始
+        is_fail: 是否是步骤最终失败后的截图
+        """
+        match cls.policy:
+            case "after":
+                return img_type == "after_page"
+            case "failure":
+                return is_fail
+            case "every_n":
+                return (step_index - 1) % cls.every_n == 0
+            case _:
+                return True
+
+    @classmethod
+    def get_queue(cls):
+        if cls._thread is None or not cls._thread.is_alive():
+            with cls._lock:
+                if cls._thread is None or not cls._thread.is_alive():
+                    cls._queue = queue.Queue(maxsize=cls.max_queue_size)
+                    cls._thread = threading.Thread(target=cls._write_loop, name="screenshot-writer", daemon=True)
+                    cls._thread.start()
+        return cls._queue
+
+    @classmethod
+    def save(cls, folder, report_step_id, img_type, png_data):
+        """ 把截图（png二进制数据）放入写入队列 """
+        file_path = os.path.join(folder, cls.get_file_name(report_step_id, img_type))
+        cls.get_queue().put((file_path, png_data, cls.format, cls.quality))
+
+    @classmethod
+    def flush(cls):
+        """ 等待队列中的截图全部写入 """
+        if cls._queue is not None:
+            cls._queue.join()
+
+    @classmethod
+    def _write_loop(cls):
+        while True:
+            file_path, png_data, img_format, quality = cls._queue.get()
+            try:
+                cls.write_file(file_path, png_data, img_format, quality)
+            except Exception as error:
+                logger.error(f"保存步骤截图失败：{file_path}，{error}")
+            finally:
+                cls._queue.task_done()
+
+    @staticmethod
+    def write_file(file_path, png_data, img_format, quality):
+        """ 压缩并写入图片，先写临时文件再重命名，读取时不会读到写了一半的文件 """
+        if img_format != "png":
+            image = Image.open(io.BytesIO(png_data))
+            if img_format == "jpeg":
+                image = image.convert("RGB")  # jpeg不支持透明通道
+            buffer = io.BytesIO()
+            image.save(buffer, format=img_format.upper(), quality=quality)
+            png_data = buffer.getvalue()
+        temp_path = f'{file_path}.tmp'
+        with open(temp_path, "wb") as file:
+            file.write(png_data)
+        os.replace(temp_path, file_path)
@@ -3,12 +3,9 @@ import os
 import time
 import json
 import base64
-import asyncio
 import platform
 import subprocess
-from functools import partial
 from unittest.case import SkipTest
-from concurrent.futures import ThreadPoolExecutor
 
 from appium import webdriver as appium_webdriver
 from appium.webdriver.common.touch_action import TouchAction
@@ -21,6 +18,7 @@ from selenium.webdriver.support.select import Select
 from selenium.webdriver.support import expected_conditions as ec
 from selenium.webdriver.support.ui import WebDriverWait
 
+from utils.util.executor_util import ExecutorService
 from .utils import get_dict_data
 
 
@@ -761,15 +759,7 @@ class GetAppDriver(Actions):
 async def get_web_driver(driver_type, **kwargs):
     """ 实例化driver比较耗时，异步执行 """
     func = GetAppDriver if driver_type == 'app' else GetUiDriver
-    max_workers = min(50, os.cpu_count() * 5)
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        try:
-            bound_func = partial(func, *(), **kwargs)
-            return await asyncio.wait_for(
-                asyncio.get_running_loop().run_in_executor(executor, bound_func), timeout=600)
-        except Exception as e:
-            executor.shutdown(wait=True)  # 强制终止超时任务
-            raise
+    return await ExecutorService.run(func, kwargs=kwargs, timeout=600)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+from urllib.parse import urlparse
+
+from utils.logs.log import logger
+from utils.util.executor_util import ExecutorService
+from .webdriver_action import GetUiDriver, GetAppDriver
+
+
+class WebDriverPool:
+    """ 浏览器/app会话池，用例执行完后把会话重置（cookie、storage、多余的窗口）后放回池中，下一条用例直接复用，不再每条用例都重新启动浏览器
+    - 按 驱动类型+浏览器类型+驱动地址 / appium配置 区分，配置相同的才会复用
+    - 同一个会话同一时间只会借给一条用例
+    - 空闲超过 idle_timeout 秒的会话会被关闭（有空闲会话时后台定时检查），每种配置最多保留 max_idle 个空闲会话
+    - 借出前做健康检查，已经失效的会话直接关闭，重新启动
+    - 只复用能完整重置的会话：chrome 通过 devtools 协议清除所有域名的数据，其他浏览器不复用；
+      app 只复用 noReset 为 true 的，需要重置app数据的每条用例都重新启动
+    """
+    enabled = True
+    max_idle = 2
+    idle_timeout = 300
+    health_check = True
+    _idle_dict = {}  # {key: [(driver, 放回时间)]}
+    _evict_task = None
+
+    @classmethod
+    def configure(cls, enabled=True, max_idle=2, idle_timeout=300, health_check=True, **kwargs):
+        cls.enabled, cls.max_idle, cls.idle_timeout, cls.health_check = \
+            bool(enabled), int(max_idle), int(idle_timeout), bool(health_check)
+
+    @staticmethod
+    def get_key(driver_type, **kwargs):
+        return f'{driver_type}:{json.dumps(kwargs, sort_keys=True, default=str)}'
+
+    @staticmethod
+    def can_pool(driver_type, **kwargs):
+        """ 能否复用，app 重启应用不会清除app数据，只有不需要重置的才复用 """
+        if driver_type == 'app':
+            return kwargs.get("noReset") is True
+        return kwargs.get("browser_name") == "chrome"
+
+    @classmethod
+    async def acquire(cls, driver_type, **kwargs):
+        """ 借出一个会话，池中没有可用的则启动一个新的 """
+        key = cls.get_key(driver_type, **kwargs)
+        await cls.evict_idle()
+        idle_list = cls._idle_dict.get(key, [])
+        while cls.enabled and idle_list:
+            driver, _ = idle_list.pop()
+            if cls.health_check is False or await ExecutorService.run(cls.is_alive, (driver,), timeout=30):
+                driver.pool_key = key
+                return driver
+            await cls.quit(driver)
+
+        func = GetAppDriver if driver_type == 'app' else GetUiDriver
+        driver = await ExecutorService.run(func, kwargs=dict(kwargs), timeout=600)  # appium会pop配置，传副本
+        driver.pool_key = key if cls.can_pool(driver_type, **kwargs) else None  # 不复用的归还时直接关闭
+        return driver
+
+    @classmethod
+    async def release(cls, driver):
+        """ 归还会话，重置失败、池已满、未启用会话池的直接关闭 """
+        key = getattr(driver, "pool_key", None)
+        if cls.enabled is False or key is None or len(cls._idle_dict.get(key, [])) >= cls.max_idle:
+            return await cls.quit(driver)
+        try:
+            await ExecutorService.run(cls.reset, (driver,), timeout=60)
+        except Exception as error:
+            logger.warning(f"重置浏览器会话失败，关闭会话：{error}")
+            return await cls.quit(driver)
+        cls._idle_dict.setdefault(key, []).append((driver, time.time()))
+        if cls._evict_task is None or cls._evict_task.done():
+            cls._evict_task = asyncio.create_task(cls.evict_loop())
+
+    @classmethod
+    async def evict_loop(cls):
+        """ 定时关闭空闲超时的会话，池中没有空闲会话了就退出 """
+        while any(cls._idle_dict.values()):
+            await asyncio.sleep(min(cls.idle_timeout, 60))
+            try:
+                await cls.evict_idle()
+            except Exception as error:
+                logger.warning(f"关闭空闲超时的浏览器会话失败：{error}")
+
+    @classmethod
+    async def evict_idle(cls):
+        """ 关闭空闲超时的会话，关闭期间可能有会话归还，遍历副本 """
+        expire_time = time.time() - cls.idle_timeout
+        for key, idle_list in list(cls._idle_dict.items()):
+            expired_list = [driver for driver, release_time in idle_list if release_time < expire_time]
+            if expired_list:
+                idle_list[:] = [item for item in idle_list if item[1] >= expire_time]  # 原地修改，借出中的遍历也能看到
+                for driver in expired_list:
+                    await cls.quit(driver)
+
+    @classmethod
+    async def close_all(cls):
+        """ 关闭池中所有空闲会话 """
+        if cls._evict_task is not None:
+            cls._evict_task.cancel()
+        idle_dict, cls._idle_dict = cls._idle_dict, {}
+        for idle_list in idle_dict.values():
+            for driver, _ in idle_list:
+                await cls.quit(driver)
+
+    @staticmethod
+    async def quit(driver):
+        try:
+            await ExecutorService.run(driver.close_all, timeout=60)
+        except Exception as error:
+            logger.warning(f"关闭浏览器会话失败：{error}")
+
+    @staticmethod
+    def is_alive(driver):
+        """ 健康检查，能获取到当前地址则认为会话可用 """
+        try:
+            return driver.driver.current_url is not None
+        except Exception:
+            return False
+
+    @staticmethod
+    def get_origin(url):
+        parsed = urlparse(url or "")
+        return f'{parsed.scheme}://{parsed.netloc}' if parsed.scheme in ("http", "https") and parsed.netloc else None
+
+    @classmethod
+    def reset(cls, driver):
+        """ 重置会话，app重启应用（只有 noReset 的会复用）；
+        浏览器关闭多余的窗口，清除所有域名的cookie，以及访问过的域名（各窗口的浏览记录、cookie所属域名）的 storage、indexedDB、缓存等
+        """
+        if isinstance(driver, GetAppDriver):
+            app_package = driver.appium_webdriver.capabilities.get("appPackage")
+            if not app_package:
+                raise ValueError("没有appPackage，无法重置app")
+            driver.appium_webdriver.terminate_app(app_package)
+            driver.appium_webdriver.activate_app(app_package)
+            return
+
+        web_driver = driver.driver
+        handle_list, origin_set = web_driver.window_handles, set()
+        for handle in reversed(handle_list):
+            web_driver.switch_to.window(handle)
+            history = web_driver.execute_cdp_cmd("Page.getNavigationHistory", {})
+            origin_set.update(cls.get_origin(entry.get("url")) for entry in history.get("entries", []))
+            if handle != handle_list[0]:
+                web_driver.close()
+        web_driver.switch_to.window(handle_list[0])
+
+        for cookie in web_driver.execute_cdp_cmd("Network.getAllCookies", {}).get("cookies", []):
+            domain = cookie.get("domain", "").lstrip(".")
+            origin_set.update((f'http://{domain}', f'https://{domain}'))
+        origin_set.discard(None)
+        for origin in origin_set:
+            web_driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+        web_driver.execute_cdp_cmd("Network.clearBrowserCookies", {})  # 清除所有域名的cookie
+        web_driver.get("about:blank")
+        web_driver.execute_cdp_cmd("Page.resetNavigationHistory", {})
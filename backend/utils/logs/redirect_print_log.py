@@ -1,4 +1,28 @@
 import sys
+from contextvars import ContextVar
+
+# 当前上下文（协程/线程）对应的重定向对象，并行执行用例时每条用例互不干扰
+_current_redirect = ContextVar("current_redirect", default=None)
+
+
+class _ContextStdout:
+    """ 按上下文分发print内容，当前上下文设置了重定向则写到对应的内存，否则输出到console """
+
+    def write(self, out_stream):
+        redirect = _current_redirect.get()
+        if redirect is None:
+            return sys.__stdout__.write(out_stream)
+        redirect.write(out_stream)
+
+    def flush(self):
+        if _current_redirect.get() is None:
+            sys.__stdout__.flush()
+
+    def __getattr__(self, item):
+        return getattr(sys.__stdout__, item)
+
+
+_context_stdout = _ContextStdout()
 
 
 class RedirectPrintLogToMemory:
@@ -6,7 +30,8 @@ class RedirectPrintLogToMemory:
 
     def __init__(self):
         self.text = ""
-        sys.stdout = self
+        _current_redirect.set(self)
+        sys.stdout = _context_stdout
 
     def write(self, out_stream):
         self.text += out_stream
@@ -21,7 +46,7 @@ class RedirectPrintLogToMemory:
     @classmethod
     def redirect_to_default(cls):
         """ 恢复输出到console """
-        sys.stdout = sys.__stdout__
+        _current_redirect.set(None)
 
     # def __del__(self):
     #     """ 恢复输出到console """
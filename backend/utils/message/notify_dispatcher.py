@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import httpx
+
+from .send_email import SendEmail
+from ..logs.log import logger
+from ..util.executor_util import ExecutorService
+
+
+class NotifyDispatcher:
+    """ 通知发送器，钉钉、企业微信、飞书、webhook、邮件统一从这里发送
+    - 共用一个http客户端，不再每发一条消息都新建连接
+    - 多个接收地址并发发送，同时发送的数量不超过 max_concurrency
+    - 发送失败（网络错误、5xx、429）按 retry_interval * 2^n 秒退避重试 retry_times 次
+    - 每种渠道单独设置超时时间
+    - 邮件放到线程池发送，不阻塞事件循环，同一个发件箱复用SMTP连接
+    """
+    max_concurrency = 10
+    retry_times = 2
+    retry_interval = 1
+    timeout_dict = {"ding_ding": 10, "we_chat": 10, "fei_shu": 10, "webhook": 30, "email": 60}
+    _client = None
+    _semaphore = None
+    _loop = None
+
+    @classmethod
+    def configure(cls, max_concurrency=10, retry_times=2, retry_interval=1, timeout=None, **kwargs):
+        cls.max_concurrency, cls.retry_times, cls.retry_interval = \
+            max(int(max_concurrency), 1), max(int(retry_times), 0), float(retry_interval)
+        cls.timeout_dict = {**cls.timeout_dict, **(timeout or {})}
+        cls._semaphore = None  # 并发数可能有变化，下次使用时重新创建
+
+    @classmethod
+    def get_client(cls):
+        """ 获取共用的http客户端，事件循环变了则重新创建 """
+        loop = asyncio.get_running_loop()
+        if cls._client is None or cls._client.is_closed or cls._loop is not loop:
+            cls._client, cls._semaphore, cls._loop = httpx.AsyncClient(verify=False), None, loop
+        return cls._client
+
+    @classmethod
+    def get_semaphore(cls):
+        cls.get_client()
+        if cls._semaphore is None:
+            cls._semaphore = asyncio.Semaphore(cls.max_concurrency)
+        return cls._semaphore
+
+    @staticmethod
+    def get_channel(addr):
+        """ 根据地址判断渠道 """
+        if "dingtalk" in addr:
+            return "ding_ding"
+        if "qyapi.weixin" in addr:
+            return "we_chat"
+        if "feishu" in addr or "larksuite" in addr:
+            return "fei_shu"
+        return "webhook"
+
+    @classmethod
+    async def retry_sleep(cls, retry_count):
+        await asyncio.sleep(cls.retry_interval * 2 ** retry_count)
+
+    @classmethod
+    async def send_msg(cls, addr, msg, channel=None):
+        """ 发送消息，返回是否发送成功 """
+        timeout = cls.timeout_dict.get(channel or cls.get_channel(addr), 30)
+        async with cls.get_semaphore():
+            for retry_count in range(cls.retry_times + 1):
+                try:
+                    response = await cls.get_client().post(addr, json=msg, timeout=timeout)
+                    if response.status_code == 429 or response.status_code >= 500:
+                        raise httpx.HTTPStatusError(
+                            f'状态码：{response.status_code}', request=response.request, response=response)
+                    logger.info(f'发送消息，结果：{response.text}')
+                    return True
+                except httpx.HTTPError as error:
+                    logger.info(f'发送消息失败，第 {retry_count + 1} 次，地址：{addr}，错误信息：\n{error}')
+                    if retry_count < cls.retry_times:
+                        await cls.retry_sleep(retry_count)
+                except Exception as error:  # 地址错误等，重试也不会成功
+                    logger.info(f'发送消息失败，地址：{addr}，错误信息：\n{error}')
+                    return False
+        return False
+
+    @classmethod
+    async def send_msg_list(cls, addr_list, msg, channel=None):
+        """ 并发发送到多个地址，返回每个地址是否发送成功 """
+        return list(await asyncio.gather(*[cls.send_msg(addr, msg, channel) for addr in addr_list]))
+
+    @classmethod
+    async def send_email(cls, email: SendEmail):
+        """ 在线程池中发送邮件，返回是否发送成功 """
+        for retry_count in range(cls.retry_times + 1):
+            try:
+                if await ExecutorService.run(email.send_email, timeout=cls.timeout_dict.get("email", 60)):
+                    return True
+            except asyncio.TimeoutError:
+                logger.info(f'发送邮件超时，第 {retry_count + 1} 次')
+            if retry_count < cls.retry_times:
+                await cls.retry_sleep(retry_count)
+        return False
+
+    @classmethod
+    async def close(cls):
+        """ 服务关闭时释放http连接和SMTP连接 """
+        if cls._client is not None and cls._client.is_closed is False:
+            await cls._client.aclose()
+        cls._client = cls._semaphore = cls._loop = None
+        SendEmail.close_all()
@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 import smtplib
+import threading
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.header import Header
 
 
 class SendEmail:
-    """ 发送测试报告到邮箱 """
+    """ 发送测试报告到邮箱，同一个发件箱的SMTP连接发送完后保留，下一封邮件直接复用 """
+    _connection_dict = {}  # {(邮箱服务器, 发件箱): smtp连接}
+    _lock = threading.Lock()
 
     def __init__(self, email_server, username, password, to_list, msg_content):
         self.email_server = email_server
@@ -31,18 +34,58 @@ class SendEmail:
         message["From"] = self.username
         message["To"] = Header("".join(self.to_list), "utf-8")
 
+        service = None
         try:
             # 发送邮件
             print(f'{"=" * 30} 开始发送邮件，发件箱为 {self.username} {"=" * 30}')
-            service = smtplib.SMTP_SSL(host=self.email_server, port=smtplib.SMTP_SSL_PORT)
-            service.login(user=self.username, password=self.password)  # 登录
+            service = self.get_connection()
             service.sendmail(from_addr=self.username, to_addrs=self.to_list, msg=message.as_string())
             print(f'{"=" * 30} 邮件发送成功 {"=" * 30}')
-            service.close()
+            self.release_connection(service)
             return True
         except Exception as error:
             print(f'发送邮件出错，错误信息为：\n {error}')
+            self.close_connection(service)
             return False
 
+    def get_connection(self):
+        """ 取出已有的连接，连接已失效则重新连接并登录 """
+        with self._lock:
+            service = self._connection_dict.pop((self.email_server, self.username), None)
+        if service is not None:
+            try:
+                if service.noop()[0] == 250:
+                    return service
+            except smtplib.SMTPException:
+                pass
+            self.close_connection(service)
+        service = smtplib.SMTP_SSL(host=self.email_server, port=smtplib.SMTP_SSL_PORT, timeout=30)
+        service.login(user=self.username, password=self.password)  # 登录
+        return service
+
+    def release_connection(self, service):
+        """ 放回连接，同一个发件箱已有空闲连接的则关闭 """
+        with self._lock:
+            if (self.email_server, self.username) not in self._connection_dict:
+                self._connection_dict[(self.email_server, self.username)] = service
+                return
+        self.close_connection(service)
+
+    @staticmethod
+    def close_connection(service):
+        if service is None:
+            return
+        try:
+            service.quit()
+        except Exception:
+            service.close()
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            connection_list, cls._connection_dict = list(cls._connection_dict.values()), {}
+        for service in connection_list:
+            cls.close_connection(service)
+
 if __name__ == '__main__':
     pass
\ No newline at end of file
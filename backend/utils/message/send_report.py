@@ -1,12 +1,11 @@
 # -*- coding: utf-8 -*-
 import json
 
-import httpx
-
 from app.models.config.model_factory import Config, WebHook
 from app.models.assist.model_factory import CallBack
 from app.schemas.enums import SendReportTypeEnum, ReceiveTypeEnum, WebHookTypeEnum
 from .send_email import SendEmail
+from .notify_dispatcher import NotifyDispatcher
 from .template import run_time_error_msg, call_back_webhook_msg, render_html_report, \
     get_business_stage_count_msg, inspection_ding_ding, inspection_we_chat, server_status_msg_ding_ding, \
     server_status_msg_we_chat
@@ -14,17 +13,10 @@ from ..logs.log import logger
 from app.configs.config import _default_web_hook_type, _default_web_hook, _web_hook_secret
 
 
-async def send_msg(addr, msg):
+async def send_msg(addr, msg, channel=None):
     """ 发送消息 """
     logger.info(f'发送消息, 地址: {addr}, 文本: {json.dumps(msg, ensure_ascii=False)}')
-    try:
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.post(addr, json=msg, timeout=30)
-            logger.info(f'发送消息，结果：{response.json()}')
-        return True
-    except Exception as error:
-        logger.info(f'向机器人发送测试报告失败，错误信息：\n{error}')
-        return False
+    return await NotifyDispatcher.send_msg(addr, msg, channel)
 
 
 async def send_server_status(server_name, app_title=None, action_type="启动"):
@@ -52,19 +44,20 @@ async def send_inspection_by_msg(receive_type, content_list, kwargs):
     """ 发送巡检消息 """
     msg = inspection_ding_ding(content_list, kwargs) \
         if receive_type == ReceiveTypeEnum.DING_DING.value else inspection_we_chat(content_list, kwargs)
-    res_list = [await send_msg(webhook, msg) for webhook in kwargs["webhook_list"]]
+    logger.info(f'发送巡检消息, 地址: {kwargs["webhook_list"]}, 文本: {json.dumps(msg, ensure_ascii=False)}')
+    res_list = await NotifyDispatcher.send_msg_list(kwargs["webhook_list"], msg, receive_type)
     return False not in res_list
 
 
-def send_inspection_by_email(content_list, kwargs):
+async def send_inspection_by_email(content_list, kwargs):
     """ 通过邮件发送测试报告 """
-    return SendEmail(
+    return await NotifyDispatcher.send_email(SendEmail(
         kwargs.get("email_server"),
         kwargs.get("email_from").strip(),
         kwargs.get("email_pwd"),
         [email.strip() for email in kwargs.get("email_to") if email],
         render_html_report(content_list, kwargs)
-    ).send_email()
+    ))
 
 
 async def send_report(**kwargs):
@@ -75,8 +68,9 @@ async def send_report(**kwargs):
             or (is_send == SendReportTypeEnum.ON_FAIL.value and "fail" in result)
             or (is_send == SendReportTypeEnum.ON_SUCCESS.value and "fail" not in result)):
         logger.info(f'开始发送测试报告')
+        NotifyDispatcher.configure(**await Config.get_notify_conf())
         if receive_type == ReceiveTypeEnum.EMAIL.value:
-            return send_inspection_by_email(content_list, kwargs)
+            return await send_inspection_by_email(content_list, kwargs)
         else:
             return await send_inspection_by_msg(receive_type, content_list, kwargs)
     return None
@@ -101,9 +95,8 @@ async def call_back_for_pipeline(task_id, call_back_info: list, extend: dict, st
         })
 
         try:
-            async with httpx.AsyncClient(verify=False) as client:
-                response = await client.request(**call_back)
-                logger.info(f'发送消息，结果：{response.json()}')
+            response = await NotifyDispatcher.get_client().request(**call_back)
+            logger.info(f'发送消息，结果：{response.json()}')
             call_back_obj.success(response.text)
             logger.info(f'回调{call_back.get("url")}结束: \n{response.text}')
             msg = call_back_webhook_msg(call_back.get("json", {}))
@@ -132,8 +125,7 @@ async def send_business_stage_count(content):
     """ 发送阶段统计报告 """
     # if content["total"]:
     msg = get_business_stage_count_msg(content)
-    for webhook in content["webhookList"]:
-        await send_msg(webhook, msg)
+    await NotifyDispatcher.send_msg_list(content["webhookList"], msg)
 
 
 if __name__ == "__main__":
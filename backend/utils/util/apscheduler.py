@@ -1,6 +1,5 @@
 """ apscheduler 默认的调度器存储对于异步支持有问题，这里自己实现存储，启动 """
 import datetime
-import json
 from pathlib import Path
 
 import httpx
@@ -9,6 +8,8 @@ from tortoise import Tortoise
 from loguru import logger as loguru_logger
 
 from app.configs.config import main_server_host
+from app.models.config.config import Config
+from app.models.system.job import TaskRunQueue
 from utils.parse.parse_cron import parse_cron
 from utils.util.file_util import LOG_ADDRESS
 
@@ -49,7 +50,7 @@ class AsyncIOScheduler(_AsyncIOScheduler):
         """ 添加任务 """
         kwargs.setdefault("trigger", "cron")
         kwargs.setdefault("misfire_grace_time", 60)
-        kwargs.setdefault("coalesce", False)
+        kwargs.setdefault("coalesce", True)  # 错过的多次触发合并为一次
         memory_job = self.add_job(*args, **kwargs, **parse_cron(cron))
 
         db = Tortoise.get_connection("default")
@@ -75,21 +76,31 @@ scheduler = AsyncIOScheduler()
 
 
 async def request_run_task_api(task_code, task_type, skip_holiday=True):
-    """ 调执行任务接口 """
+    """ 触发定时任务，默认写入触发队列，由主服务的worker消费执行；配置为http时调执行任务接口 """
     logger.info(f'{"*" * 20} 开始触发执行定时任务【{task_code}】 {"*" * 20}')
 
-    # 判断是否设置了跳过节假日、调休日
+    # 判断是否设置了跳过节假日、调休日，配置走缓存，不再每次触发都查库
     if skip_holiday:
-
-        # 查配置的节假日
-        db = Tortoise.get_connection("default")
-        result = await db.execute_query_dict("SELECT value FROM config_config WHERE name='holiday_list'")
-        holiday_list = json.loads(result[0]['value'])
-
-        if datetime.datetime.today().strftime("%m-%d") in holiday_list:
+        if datetime.datetime.today().strftime("%m-%d") in await Config.get_holiday_list():
             logger.info(f'{"*" * 20} 节假日/调休日，跳过 {"*" * 20}')
             return None
 
+    if (await Config.get_task_dispatch_conf()).get("mode", "queue") == "queue":
+        try:
+            queue = await TaskRunQueue.enqueue(task_code, task_type)
+            logger.info(f'{"*" * 20} 定时任务已加入触发队列：{queue.id if queue else "已有待执行的，合并"} {"*" * 20}')
+            await update_next_run_time(task_code)
+            return queue
+        except Exception as error:
+            logger.error(f'定时任务加入触发队列失败，改为调接口触发：{error}')
+
+    response = await request_run_task(task_code, task_type)
+    await update_next_run_time(task_code)
+    return response
+
+
+async def request_run_task(task_code, task_type):
+    """ 调执行任务接口 """
     if isinstance(task_code, str) and task_code.startswith('cron'):  # 系统定时任务
         api_addr = '/system/job/run'
     else:  # 自动化测试定时任务
@@ -110,11 +121,13 @@ async def request_run_task_api(task_code, task_type, skip_holiday=True):
         )
         logger.info(f'{"*" * 20} 定时任务触发完毕 {"*" * 20}')
         logger.info(f'{"*" * 20} 触发响应为：{response.json()} {"*" * 20}')
+    return response
 
-    # 更新 next_run_time
+
+async def update_next_run_time(task_code):
+    """ 更新 next_run_time """
     db = Tortoise.get_connection("default")
     job_data = await db.execute_query_dict(f"SELECT job_id FROM apscheduler_jobs WHERE task_code='{task_code}'")
     job = scheduler.get_job(job_data[0]["job_id"])
     await db.execute_script(
         f"update apscheduler_jobs set next_run_time = '{job.next_run_time}' WHERE task_code='{task_code}'")
-    return response
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial  # 处理关键字参数必备
+from typing import Callable, Any
+
+# 当前测试运行的并发限制，由 ExecutorService.set_run_limit 设置，同一次运行的所有用例共享
+_run_limiter = contextvars.ContextVar("run_limiter", default=None)
+
+
+def run_in_process(func):
+    """ 标记自定义函数为纯计算函数，执行时放到进程池，不占用线程池也不受GIL限制
+    注意：在进程中执行时，函数的print不会记录到测试报告中，参数和返回值需要能被pickle
+    from utils.util.executor_util import run_in_process
+
+    @run_in_process
+    def calc(a, b): ...
+    """
+    func.run_in_process = True
+    return func
+
+
+class ExecutorService:
+    """ 全局共享的线程池/进程池，执行自定义函数、UI操作等同步阻塞的任务
+    - 线程池、进程池只在第一次使用时创建，整个进程共用，不再每次调用都创建和销毁线程
+    - 支持按测试运行限制并发数，一次运行的任务不会把线程池占满
+    - 超时后如果任务还在排队，会直接取消，不再执行
+    - 记录排队、执行中、完成、报错、超时的数量，进程池的任务单独记录排队、执行中的数量
+    """
+    max_workers = min(50, os.cpu_count() * 5)
+    max_process_workers = os.cpu_count()
+    _thread_executor = None
+    _process_executor = None
+    _lock = threading.RLock()
+    stats = {"pending": 0, "running": 0, "completed": 0, "failed": 0, "timeout": 0}
+    _process_task_count = 0  # 已提交到进程池、还没结束的任务数
+
+    @classmethod
+    def get_thread_executor(cls):
+        if cls._thread_executor is None:
+            with cls._lock:
+                if cls._thread_executor is None:
+                    cls._thread_executor = ThreadPoolExecutor(max_workers=cls.max_workers, thread_name_prefix="ntest")
+        return cls._thread_executor
+
+    @classmethod
+    def get_process_executor(cls):
+        if cls._process_executor is None:
+            with cls._lock:
+                if cls._process_executor is None:
+                    cls._process_executor = ProcessPoolExecutor(max_workers=cls.max_process_workers)
+        return cls._process_executor
+
+    @classmethod
+    def set_run_limit(cls, limit: int):
+        """ 设置当前上下文（一次测试运行）最多同时占用的线程数，在创建用例任务之前调用，子任务会继承 """
+        return _run_limiter.set(asyncio.Semaphore(max(int(limit), 1)))
+
+    @classmethod
+    def reset_run_limit(cls, token):
+        _run_limiter.reset(token)
+
+    @classmethod
+    def get_stats(cls):
+        """ 获取线程池、进程池的使用情况，pending 即为排队中的任务数
+        进程池按先进先出执行，超出进程数的任务都在排队
+        """
+        with cls._lock:
+            process_running = min(cls._process_task_count, cls.max_process_workers)
+            return {
+                **cls.stats,
+                "max_workers": cls.max_workers,
+                "process_pending": cls._process_task_count - process_running,
+                "process_running": process_running,
+                "max_process_workers": cls.max_process_workers
+            }
+
+    @classmethod
+    def _update_stats(cls, **kwargs):
+        with cls._lock:
+            for key, value in kwargs.items():
+                cls.stats[key] += value
+
+    @classmethod
+    async def run(cls, func: Callable, args: tuple = None, kwargs: dict = None, timeout: int = 600) -> Any:
+        """ 把同步函数放到共享的线程池（被 run_in_process 标记的放到进程池）中执行，支持超时控制 """
+        limiter = _run_limiter.get()
+        if limiter is None:
+            return await cls._run(func, args or (), kwargs or {}, timeout)
+        async with limiter:
+            return await cls._run(func, args or (), kwargs or {}, timeout)
+
+    @classmethod
+    async def _run(cls, func, args, kwargs, timeout):
+        loop = asyncio.get_running_loop()
+        bound_func = partial(func, *args, **kwargs)
+        if getattr(func, "run_in_process", False):
+            def on_process_done(future):  # 在进程池的结果线程中回调，超时取消后任务还在执行的，等真正结束才减
+                with cls._lock:
+                    cls._process_task_count -= 1
+
+            with cls._lock:
+                cls._process_task_count += 1
+            try:
+                process_future = cls.get_process_executor().submit(bound_func)
+            except Exception:
+                on_process_done(None)
+                raise
+            process_future.add_done_callback(on_process_done)
+            executor_future = asyncio.wrap_future(process_future, loop=loop)
+        else:
+            context = contextvars.copy_context()  # 带上当前上下文，自定义函数的print才能重定向到对应用例的内存中
+            dequeued = []  # 任务开始执行、或排队中被取消，只从排队数中减一次
+
+            def dequeue():
+                with cls._lock:
+                    if not dequeued:
+                        dequeued.append(True)
+                        cls.stats["pending"] -= 1
+
+            def run_in_thread():
+                dequeue()
+                cls._update_stats(running=1)
+                try:
+                    return context.run(bound_func)
+                finally:
+                    cls._update_stats(running=-1)
+
+            def on_done(future):
+                if future.cancelled():
+                    dequeue()
+
+            cls._update_stats(pending=1)
+            executor_future = loop.run_in_executor(cls.get_thread_executor(), run_in_thread)
+            executor_future.add_done_callback(on_done)
+
+        try:
+            result = await asyncio.wait_for(executor_future, timeout=timeout)
+        except asyncio.TimeoutError:
+            cls._update_stats(timeout=1)  # 还在排队的任务随超时一起取消，已经开始执行的线程无法强制终止
+            raise
+        except Exception:
+            cls._update_stats(failed=1)
+            raise
+        cls._update_stats(completed=1)
+        return result
+
+    @classmethod
+    def shutdown(cls):
+        """ 服务关闭时释放线程池、进程池 """
+        for executor in (cls._thread_executor, cls._process_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        cls._thread_executor = cls._process_executor = None
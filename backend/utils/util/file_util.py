@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import base64
 import json
 import os
 import io
@@ -24,6 +25,8 @@ DB_BACK_UP_ADDRESS = os.path.abspath(os.path.join(basedir, ".." + r"/db_back_up_
 BROWSER_DRIVER_ADDRESS = os.path.abspath(os.path.join(basedir, ".." + r"/browser_drivers/"))  # 浏览器驱动文件存放地址
 REPORT_IMG_UI_ADDRESS = os.path.abspath(os.path.join(basedir, ".." + r"/report_img_ui/"))  # 截图存放路径
 REPORT_IMG_APP_ADDRESS = os.path.abspath(os.path.join(basedir, ".." + r"/report_img_app/"))  # 截图存放路径
+QDRANT_ADDRESS = os.path.abspath(os.path.join(basedir, ".." + r"/qdrant_data/"))  # 知识库本地向量数据存放路径
+KNOWLEDGE_INDEX_ADDRESS = os.path.abspath(os.path.join(basedir, ".." + r"/knowledge_index/"))  # 知识库关键词索引存放路径
 
 
 def _check_file_path(paths):
@@ -40,7 +43,8 @@ def _check_file_path(paths):
 _check_file_path([
     LOG_ADDRESS, SCRIPT_ADDRESS, DIFF_RESULT, CASE_FILE_ADDRESS, UI_CASE_FILE_ADDRESS,
     MOCK_DATA_ADDRESS, CALL_BACK_ADDRESS, TEMP_FILE_ADDRESS, GIT_FILE_ADDRESS, DB_BACK_UP_ADDRESS, SWAGGER_FILE_ADDRESS,
-    BROWSER_DRIVER_ADDRESS, REPORT_IMG_UI_ADDRESS, REPORT_IMG_APP_ADDRESS
+    BROWSER_DRIVER_ADDRESS, REPORT_IMG_UI_ADDRESS, REPORT_IMG_APP_ADDRESS, QDRANT_ADDRESS,
+    KNOWLEDGE_INDEX_ADDRESS
 ])
 
 
@@ -83,9 +87,17 @@ class FileUtil:
     @classmethod
     def save_script_data(cls, name, content, env="debug"):
         """ 保存自定义函数数据 """
-        content = content or ''
-        func_data = "# coding:utf-8\n\n" + f'env = "{env}"\n\n' + content
-        cls.save_file(os.path.join(SCRIPT_ADDRESS, f'{name}.py'), func_data)
+        cls.save_file(cls.get_script_path(name), cls.build_script_data(content, env))
+
+    @classmethod
+    def build_script_data(cls, content, env="debug"):
+        """ 生成自定义函数文件的内容，第一行加上运行环境 """
+        return "# coding:utf-8\n\n" + f'env = "{env}"\n\n' + (content or '')
+
+    @classmethod
+    def get_script_path(cls, name):
+        """ 自定义函数文件的路径 """
+        return os.path.join(SCRIPT_ADDRESS, f'{name}.py')
 
     @classmethod
     def save_mock_script_data(cls, name, content, path={}, headers={}, query={}, body={}):
@@ -149,13 +161,24 @@ class FileUtil:
 
     @classmethod
     def get_report_step_img(cls, report_id, report_step_id, img_type, report_type='ui'):
-        """ 获取步骤的截图 """
+        """ 获取步骤的截图，返回base64，兼容旧报告的base64文本文件 """
+        file_path = cls.get_report_step_img_path(report_id, report_step_id, img_type, report_type)
+        if file_path is None:
+            return
+        if file_path.endswith(".txt"):
+            with io.open(file_path) as file:
+                return file.read()
+        with io.open(file_path, "rb") as file:
+            return base64.b64encode(file.read()).decode()
+
+    @classmethod
+    def get_report_step_img_path(cls, report_id, report_step_id, img_type, report_type='ui'):
+        """ 获取步骤截图的文件路径，优先取二进制图片，没有则取旧报告的base64文本文件 """
         folder_path = os.path.join(cls.get_report_img_path(report_type), str(report_id))
-        file_path = os.path.join(folder_path, f'{report_step_id}_{img_type}.txt')
-        if os.path.exists(file_path):
-            with io.open(os.path.join(folder_path, f'{report_step_id}_{img_type}.txt')) as file:
-                data = file.read()
-            return data
+        for extension in ["jpg", "webp", "png", "txt"]:
+            file_path = os.path.join(folder_path, f'{report_step_id}_{img_type}.{extension}')
+            if os.path.exists(file_path):
+                return file_path
 
 
 if __name__ == "__main__":
@@ -2378,6 +2378,30 @@ CREATE TABLE `system_role_permissions`  (
 INSERT INTO `system_role_permissions` VALUES (1, '2026-01-22 17:25:53.344268', '2026-01-22 17:25:53.344268', 1, 1, 1, 1);
 INSERT INTO `system_role_permissions` VALUES (2, '2026-01-22 17:25:53.352262', '2026-01-22 17:25:53.352262', 1, 1, 2, 7);
 
+-- ----------------------------
+-- Table structure for system_task_run_queue
+-- ----------------------------
+DROP TABLE IF EXISTS `system_task_run_queue`;
+CREATE TABLE `system_task_run_queue`  (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `create_time` datetime(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) COMMENT '创建时间',
+  `update_time` datetime(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6) COMMENT '最后修改时间',
+  `create_user` int NULL DEFAULT 1 COMMENT '创建人',
+  `update_user` int NULL DEFAULT 1 COMMENT '最后修改人',
+  `task_code` varchar(64) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NOT NULL COMMENT '任务code，任务类型_任务id，如 api_1、cron_cron_clear_report',
+  `task_type` varchar(16) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NOT NULL COMMENT '任务类型：api、ui、app、cron',
+  `fire_time` datetime(6) NOT NULL COMMENT '触发时间',
+  `status` int NOT NULL DEFAULT 0 COMMENT '执行状态：0待执行、1执行中、2执行成功、3执行失败、4超过容忍时间未执行',
+  `detail` json NOT NULL COMMENT '执行结果数据',
+  PRIMARY KEY (`id`) USING BTREE,
+  INDEX `idx_system_task_task_co_9bfaa2`(`task_code` ASC) USING BTREE,
+  INDEX `idx_system_task_status_c5bda8`(`status` ASC) USING BTREE
+) ENGINE = InnoDB CHARACTER SET = utf8mb4 COLLATE = utf8mb4_0900_ai_ci COMMENT = '定时任务触发队列表' ROW_FORMAT = Dynamic;
+
+-- ----------------------------
+-- Records of system_task_run_queue
+-- ----------------------------
+
 -- ----------------------------
 -- Table structure for system_user
 -- ----------------------------